@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Benchmark for the memory that is held for each listed photo.
+
+Builds a synthetic library from the CPLMaster/CPLAsset records in
+tests/vcr_cassettes/listing_photos.yml (with a new record name, filename
+and download URLs for every photo), decodes it page by page like
+PhotoAlbum does, and keeps every photo alive, as a long prefetch queue,
+worker pool queue or retry queue would. Compares keeping the PhotoAsset
+objects (with their versions built) to keeping AssetRecords.
+
+    python benchmarks/bench_asset_records.py --photos 100000
+
+Each variant runs in a new process, and its peak RSS (ru_maxrss) is
+reported, together with the peak RSS of a run that keeps nothing.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import yaml
+from pyicloud_ipd.services.photos import PhotoAsset
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# pylint: disable=wrong-import-position
+from icloudpd.asset_record import AssetRecord  # noqa: E402
+
+CASSETTE = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "vcr_cassettes",
+    "listing_photos.yml")
+PAGE_SIZE = 100
+
+
+def template_records():
+    """Returns the first (master_record, asset_record) pair in the cassette"""
+    with open(CASSETTE) as cassette:
+        interactions = yaml.safe_load(cassette)["interactions"]
+    for interaction in interactions:
+        body = interaction["response"]["body"]["string"]
+        if "CPLMaster" not in body:
+            continue
+        records = json.loads(body)["records"]
+        masters = [r for r in records if r["recordType"] == "CPLMaster"]
+        assets = [r for r in records if r["recordType"] == "CPLAsset"]
+        return masters[0], assets[0]
+    raise ValueError("No photo records in %s" % CASSETTE)
+
+
+def page_template(master, asset):
+    """The JSON of one photo, with NAME where its record name goes"""
+    name = master["recordName"]
+    return (json.dumps(master).replace(name, "NAME") + ", " +
+            json.dumps(asset).replace(name, "NAME"))
+
+
+def page_body(template, start, count):
+    """The JSON of one page of the listing, as it comes from the server"""
+    photos = [template.replace("NAME", "AY%026d" % number)
+              for number in range(start, start + count)]
+    return '{"records": [' + ", ".join(photos) + "]}"
+
+
+def list_photos(bodies):
+    """Decode each page and yield its photos, like PhotoAlbum.__iter__"""
+    for body in bodies:
+        records = json.loads(body)["records"]
+        masters = [r for r in records if r["recordType"] == "CPLMaster"]
+        assets = {
+            r["fields"]["masterRef"]["value"]["recordName"]: r
+            for r in records if r["recordType"] == "CPLAsset"}
+        for master in masters:
+            yield PhotoAsset(None, master, assets[master["recordName"]])
+
+
+def keep_photo_assets(bodies):
+    """What was kept before: the PhotoAsset, with its versions built"""
+    kept = []
+    for photo in list_photos(bodies):
+        photo.versions  # pylint: disable=pointless-statement
+        kept.append(photo)
+    return kept
+
+
+def keep_asset_records(bodies):
+    """What is kept now: the AssetRecord"""
+    return [AssetRecord.from_photo(photo) for photo in list_photos(bodies)]
+
+
+def keep_nothing(bodies):
+    """Only list the photos, to measure the baseline"""
+    for _ in list_photos(bodies):
+        pass
+    return []
+
+
+VARIANTS = {
+    "nothing": keep_nothing,
+    "PhotoAsset": keep_photo_assets,
+    "AssetRecord": keep_asset_records,
+}
+
+
+def page_bodies(template, photos):
+    """Yields the pages of the listing. Only one is in memory at a time"""
+    for start in range(0, photos, PAGE_SIZE):
+        yield page_body(template, start, min(PAGE_SIZE, photos - start))
+
+
+def run_variant(name, photos):
+    """Keep the photos, and print the seconds and peak RSS in KB"""
+    master, asset = template_records()
+    start = time.time()
+    kept = VARIANTS[name](page_bodies(page_template(master, asset), photos))
+    elapsed = time.time() - start
+    assert len(kept) in (0, photos)
+    # KB on Linux
+    print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--photos", type=int, default=100000)
+    parser.add_argument("--variant", choices=sorted(VARIANTS))
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.photos)
+        return
+
+    print("%d photos, %d per page" % (args.photos, PAGE_SIZE))
+    baseline = None
+    for name in ("nothing", "PhotoAsset", "AssetRecord"):
+        output = subprocess.check_output([
+            sys.executable, __file__, "--photos", str(args.photos),
+            "--variant", name])
+        elapsed, max_rss = output.split()
+        peak = int(max_rss) / 1024.0
+        if baseline is None:
+            baseline = peak
+        print("keep %-12s peak RSS %7.1f MB  (%5.0f bytes/photo)  %.1fs" % (
+            name, peak, (peak - baseline) * 1024 * 1024 / args.photos,
+            float(elapsed)))
+
+
+if __name__ == "__main__":
+    main()
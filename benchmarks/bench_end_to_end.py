@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of icloudpd against a local fake iCloud server.
+
+Generates a synthetic library, runs icloudpd in a subprocess for each
+--threads-num value, and reports assets/s, MB/s, peak RSS and the number
+of requests of each kind:
+
+    python benchmarks/bench_end_to_end.py --assets 100000 --file-size-kb 64 \\
+        --threads 1,8,32 -- --page-size 500 --prefetch-pages 2
+
+Arguments after "--" are passed to icloudpd.
+"""
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+# pylint: disable=wrong-import-position
+from fake_icloud import FakeICloud  # noqa: E402
+
+RUNNER = os.path.join(os.path.dirname(__file__), "run_icloudpd.py")
+
+
+def count_complete_files(directory, file_size):
+    """Number of files in directory that have been downloaded in full"""
+    count = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if not filename.endswith(".part") and \
+                    os.path.getsize(path) == file_size:
+                count += 1
+    return count
+
+
+def run(args, threads_num, icloudpd_args, faults=None):
+    """Run icloudpd once, returns a dict of results"""
+    server = FakeICloud(
+        assets=args.assets,
+        file_size=args.file_size_kb * 1024,
+        latency=args.latency_ms / 1000.0,
+        faults=faults,
+        bandwidth=getattr(args, "bandwidth_kbps", 0) * 1024).start()
+    directory = tempfile.mkdtemp(dir=args.directory)
+    cookie_directory = tempfile.mkdtemp()
+    try:
+        command = [
+            sys.executable, RUNNER, server.url,
+            "--username", "bench@example.com",
+            "--password", "password",
+            "--cookie-directory", cookie_directory,
+            "--directory", directory,
+            "--threads-num", str(threads_num),
+            "--no-progress-bar",
+            "--log-level", "error",
+        ] + icloudpd_args
+        env = dict(os.environ, CLIENT_ID="BENCHMARK")
+        start = time.time()
+        with open(os.devnull, "w") as devnull:
+            process = subprocess.Popen(command, env=env, stdout=devnull)
+            # wait4 returns the resource usage of this child only
+            _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.time() - start
+        return {
+            "status": status,
+            "elapsed": elapsed,
+            "downloads": server.request_counts["download"],
+            "bytes": server.bytes_sent,
+            # ru_maxrss is in KB on Linux, and in bytes on macOS
+            "peak_rss_mb": rusage.ru_maxrss / (
+                1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0),
+            "requests": dict(server.request_counts),
+            "complete": count_complete_files(
+                directory, args.file_size_kb * 1024),
+        }
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+        shutil.rmtree(cookie_directory)
+
+
+def report(threads_num, assets, result):
+    """Print one line of results"""
+    print("threads %3d  %6.1fs  %8.1f assets/s  %8.1f MB/s  "
+          "peak RSS %6.1f MB  requests %s%s" % (
+              threads_num,
+              result["elapsed"],
+              assets / result["elapsed"],
+              result["bytes"] / 1024.0 / 1024.0 / result["elapsed"],
+              result["peak_rss_mb"],
+              ", ".join("%s=%d" % item
+                        for item in sorted(result["requests"].items())),
+              "" if result["status"] == 0 else
+              "  (exit status %d)" % result["status"]))
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--assets", type=int, default=10000)
+    parser.add_argument("--file-size-kb", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--bandwidth-kbps", type=int, default=0,
+                        help="Limit each download connection to this many "
+                        "KB/s (default: no limit)")
+    parser.add_argument("--threads", default="1,4,16",
+                        help="Comma-separated --threads-num values")
+    parser.add_argument("--directory", default=None,
+                        help="Where to create the download directories")
+    argv = sys.argv[1:]
+    icloudpd_args = []
+    if "--" in argv:
+        icloudpd_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    print("%d assets of %d KB, %.0f ms latency, icloudpd %s" % (
+        args.assets, args.file_size_kb, args.latency_ms,
+        " ".join(icloudpd_args)))
+    for threads_num in [int(t) for t in args.threads.split(",")]:
+        report(threads_num, args.assets,
+               run(args, threads_num, icloudpd_args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Benchmark for reading the EXIF date from a folder of photos.
+
+Fills a temporary folder with copies of tests/fixtures/IMG_7409-original.JPG
+and compares loading the whole file into piexif (what piexif < 1.1 does for
+piexif.load(path)), piexif.load(path) with the pinned piexif, and
+exif_datetime.get_photo_exif (which only reads the JPEG headers).
+
+    python benchmarks/bench_exif_probe.py --files 5000
+
+Hard links are used by default, so the folder doesn't take up any space.
+Use --copy to write real copies (e.g. on a network volume, or to measure
+with a cold page cache).
+"""
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import piexif
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# pylint: disable=wrong-import-position
+from icloudpd.exif_datetime import get_photo_exif  # noqa: E402
+
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), "..", "tests", "fixtures",
+    "IMG_7409-original.JPG")
+
+
+def piexif_load_file(path):
+    """Read the whole file, and load the EXIF data from it"""
+    with open(path, "rb") as file_obj:
+        return piexif.load(file_obj.read()).get("Exif").get(36867)
+
+
+def piexif_load(path):
+    """The lookup that get_photo_exif used before"""
+    return piexif.load(path).get("Exif").get(36867)
+
+
+def run(paths, probe):
+    """Probe all paths, returns files/s"""
+    start = time.time()
+    for path in paths:
+        assert probe(path)
+    return len(paths) / (time.time() - start)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--copy", action="store_true")
+    parser.add_argument("--directory", default=None)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.directory)
+    try:
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(directory, "IMG_%05d.JPG" % i)
+            if args.copy or not hasattr(os, "link"):
+                shutil.copyfile(FIXTURE, path)
+            else:
+                os.link(FIXTURE, path)
+            paths.append(path)
+
+        size_mb = os.path.getsize(FIXTURE) * len(paths) / 1024.0 / 1024.0
+        print("%d files, %.0f MB" % (len(paths), size_mb))
+        for name, probe in [("whole file", piexif_load_file),
+                            ("piexif.load", piexif_load),
+                            ("get_photo_exif", get_photo_exif)]:
+            results = [run(paths, probe) for _ in range(args.repeat)]
+            print("%-16s best %8.0f files/s  (%s)" % (
+                name, max(results),
+                ", ".join("%.0f" % r for r in results)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmark of the download path under injected faults.
+
+Runs icloudpd against the fake iCloud server (see fake_icloud.py) once
+without faults, and then once for each fault profile. Reports the
+throughput, the number of injected faults, how many files were complete
+at the end, and the extra time per fault compared to the run without
+faults (the recovery time):
+
+    python benchmarks/bench_faults.py --assets 2000 --rate 0.02 \\
+        --profiles throttle,disconnect -- --threads-num 8
+
+Arguments after "--" are passed to icloudpd.
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+# pylint: disable=wrong-import-position
+from fake_icloud import FaultProfile  # noqa: E402
+from bench_end_to_end import run  # noqa: E402
+
+PROFILES = {
+    "slow": lambda rate: FaultProfile(slow=rate),
+    "throttle": lambda rate: FaultProfile(throttle=rate),
+    "rate_limit": lambda rate: FaultProfile(rate_limit=rate),
+    "disconnect": lambda rate: FaultProfile(disconnect=rate),
+    "session_error": lambda rate: FaultProfile(session_error=rate),
+    "listing_session_error": lambda rate: FaultProfile(
+        session_error=rate, kinds=("query",)),
+    "mixed": lambda rate: FaultProfile(
+        slow=rate / 4, throttle=rate / 4, rate_limit=rate / 4,
+        disconnect=rate / 4),
+}
+
+
+def report(name, assets, result, baseline):
+    """Print one line of results"""
+    faults = sum(count for kind, count in result["requests"].items()
+                 if kind.startswith("fault:"))
+    extra = result["elapsed"] - baseline["elapsed"] if baseline else 0
+    print("%-22s %7.1fs  %8.1f assets/s  %7.1f MB/s  faults %5d  "
+          "complete %d/%d  recovery %s" % (
+              name,
+              result["elapsed"],
+              assets / result["elapsed"],
+              result["bytes"] / 1024.0 / 1024.0 / result["elapsed"],
+              faults,
+              result["complete"], assets,
+              "%.2fs/fault" % (extra / faults) if faults else "-"))
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--assets", type=int, default=1000)
+    parser.add_argument("--file-size-kb", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--threads-num", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0.02,
+                        help="Rate of the faults in each profile")
+    parser.add_argument("--profiles", default=",".join(sorted(PROFILES)),
+                        help="Comma-separated fault profiles")
+    parser.add_argument("--directory", default=None,
+                        help="Where to create the download directories")
+    argv = sys.argv[1:]
+    icloudpd_args = []
+    if "--" in argv:
+        icloudpd_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    print("%d assets of %d KB, %.0f ms latency, fault rate %.3f, "
+          "--threads-num %d %s" % (
+              args.assets, args.file_size_kb, args.latency_ms, args.rate,
+              args.threads_num, " ".join(icloudpd_args)))
+    baseline = run(args, args.threads_num, icloudpd_args)
+    report("none", args.assets, baseline, None)
+    for name in args.profiles.split(","):
+        result = run(args, args.threads_num, icloudpd_args,
+                     faults=PROFILES[name](args.rate))
+        report(name, args.assets, result, baseline)
+
+
+if __name__ == "__main__":
+    main()
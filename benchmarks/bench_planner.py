@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for working out the download path of each photo.
+
+Compares what base.main and download.update_mtime did for every photo
+(look up the local timezone, convert the created date, format the
+folder structure and the path, and then look up the timezone and
+convert the date again for the mtime) to planner.PathPlanner, which
+looks up the timezone once and formats each day's folder once.
+
+    python benchmarks/bench_planner.py --photos 100000
+
+The created dates are spread over --days days, so there are about
+photos / days photos per day (like a phone camera roll).
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+import pytz
+from tzlocal import get_localzone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# pylint: disable=wrong-import-position
+from icloudpd.asset_record import AssetRecord, AssetVersion  # noqa: E402
+from icloudpd.paths import local_download_path  # noqa: E402
+from icloudpd.planner import PathPlanner, plan_pages  # noqa: E402
+
+DIRECTORY = "/photos"
+FOLDER_STRUCTURE = "{:%Y/%m/%d}"
+PAGE_SIZE = 100
+
+
+def synthetic_records(photos, days):
+    """AssetRecords with created dates spread over the last `days` days"""
+    random.seed(1)
+    newest = datetime.datetime(2018, 7, 31, tzinfo=pytz.utc)
+    records = []
+    for number in range(photos):
+        created = newest - datetime.timedelta(
+            seconds=random.randint(0, days * 24 * 3600))
+        filename = "IMG_%04d.JPG" % (number % 10000)
+        records.append(AssetRecord(
+            None, "AY%026d" % number, filename, created, "image",
+            {"original": AssetVersion(filename, 10, "https://", None)}))
+    # Newest first, like the album listing
+    records.sort(key=lambda record: record.created, reverse=True)
+    return records
+
+
+def plan_each(records):
+    """What was done for each photo before"""
+    plans = []
+    for record in records:
+        created_date = record.created.astimezone(get_localzone())
+        date_path = FOLDER_STRUCTURE.format(created_date)
+        download_dir = os.path.join(DIRECTORY, date_path)
+        download_path = local_download_path(record, "original", download_dir)
+        # download.update_mtime
+        mtime = time.mktime(
+            record.created.astimezone(get_localzone()).timetuple())
+        plans.append((record, "original", download_path, mtime))
+    return plans
+
+
+def plan_by_page(records):
+    """PathPlanner, a page at a time"""
+    planner = PathPlanner(DIRECTORY, FOLDER_STRUCTURE, "original")
+    return list(plan_pages(planner, records, PAGE_SIZE))
+
+
+def run(plan, records, repeat):
+    """Returns the fastest microseconds per photo"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        plan(records)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6 / len(records)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--photos", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    records = synthetic_records(args.photos, args.days)
+    # Both work out the same paths and mtimes
+    before = [(plan[2], plan[3]) for plan in plan_each(records)]
+    after = [(plan.download_path, plan.mtime) for plan in plan_by_page(records)]
+    assert before == after
+
+    print("%d photos over %d days, timezone %s" % (
+        args.photos, args.days, get_localzone()))
+    for name, plan in (("per photo", plan_each),
+                       ("PathPlanner", plan_by_page)):
+        print("%-12s %6.2f us/photo" % (
+            name, run(plan, records, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark for writing downloads to disk.
+
+Serves a file from a local HTTP server and compares the old
+iter_content(chunk_size=1024) loop with stream_writer.write_stream.
+
+    python benchmarks/bench_stream_writer.py --size-mb 512
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# pylint: disable=wrong-import-position
+from icloudpd.stream_writer import write_stream  # noqa: E402
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2.7
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+def make_handler(payload):
+    """Request handler that serves the same payload for every GET"""
+    class PayloadHandler(BaseHTTPRequestHandler):
+        """Serves the payload"""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Send the payload"""
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            view = memoryview(payload)
+            for start in range(0, len(payload), 1024 * 1024):
+                self.wfile.write(view[start:start + 1024 * 1024])
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+    return PayloadHandler
+
+
+def write_iter_content(response, file_obj, _expected_size):
+    """The loop that download_media used before"""
+    for chunk in response.iter_content(chunk_size=1024):
+        if chunk:
+            file_obj.write(chunk)
+
+
+def run(url, path, writer, size):
+    """Download url to path with writer, returns MB/s"""
+    start = time.time()
+    response = requests.get(url, stream=True)
+    with open(path, "wb") as file_obj:
+        writer(response, file_obj, size)
+    elapsed = time.time() - start
+    assert os.path.getsize(path) == size
+    return size / 1024.0 / 1024.0 / elapsed
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    payload = os.urandom(size)
+    server = HTTPServer(("127.0.0.1", 0), make_handler(payload))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = "http://127.0.0.1:%d/asset" % server.server_port
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for name, writer in [("iter_content(1024)", write_iter_content),
+                             ("write_stream", write_stream)]:
+            results = [run(url, path, writer, size)
+                       for _ in range(args.repeat)]
+            print("%-20s best %8.1f MB/s  (%s)" % (
+                name, max(results),
+                ", ".join("%.1f" % r for r in results)))
+    finally:
+        os.remove(path)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Local stand-in for the iCloud endpoints that icloudpd uses.
+
+Serves the login, the CloudKit photo listing (records/query and the
+item count batch query), records/lookup and the asset downloads for a
+synthetic library:
+
+    server = FakeICloud(assets=100000, file_size=2 * 1024 * 1024)
+    server.start()
+    ...  # run icloudpd with patch_pyicloud(server.url)
+    print(server.request_counts)
+    server.stop()
+
+Every asset is a JPEG record with an original version of file_size bytes.
+The same bytes are served for every asset, so the library doesn't need
+any memory or disk space. Downloads support Range requests.
+
+Faults can be injected at set rates with a FaultProfile:
+
+    FakeICloud(faults=FaultProfile(throttle=0.05, disconnect=0.01))
+"""
+from __future__ import print_function
+import base64
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2.7
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+SETUP_ENDPOINT = "https://setup.icloud.com/setup/ws/1"
+DATABASE_PATH = "/database/1/com.apple.photos.cloud/production/private"
+
+# 2018-07-31 00:00:00 UTC, in milliseconds
+START_DATE = 1532995200000
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Lots of download threads connect at the same time
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients close connections after injected faults
+        pass
+
+
+class FaultProfile(object):
+    """
+    Rates (0 to 1) of the faults that are injected into requests.
+
+    slow: wait slow_seconds before answering
+    throttle: 503 Service Unavailable
+    rate_limit: 429 Too Many Requests
+    disconnect: close the connection halfway through a download
+    session_error: "Invalid global session" JSON error
+
+    Faults are only injected into the request kinds in `kinds`
+    ("download", "query"). The random generator is seeded, so every run
+    with the same profile gets the same faults.
+    """
+    FAULTS = ("slow", "throttle", "rate_limit", "disconnect", "session_error")
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(self, slow=0.0, throttle=0.0, rate_limit=0.0,
+                 disconnect=0.0, session_error=0.0, slow_seconds=1.0,
+                 kinds=("download",), seed=0):
+        self.rates = {
+            "slow": slow,
+            "throttle": throttle,
+            "rate_limit": rate_limit,
+            "disconnect": disconnect,
+            "session_error": session_error,
+        }
+        self.slow_seconds = slow_seconds
+        self.kinds = kinds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def pick(self, kind):
+        """Returns the fault to inject into a request, or None"""
+        if kind not in self.kinds:
+            return None
+        with self._lock:
+            value = self._random.random()
+        for fault in self.FAULTS:
+            rate = self.rates[fault]
+            if value < rate:
+                return fault
+            value -= rate
+        return None
+
+
+class FakeICloud(object):
+    """
+    Synthetic iCloud photo library served over HTTP.
+
+    assets: number of photos in "All Photos"
+    file_size: size of each original in bytes
+    latency: seconds to wait before answering each request
+    faults: FaultProfile of faults to inject
+    bandwidth: bytes/s that each download connection is limited to
+        (like a single TCP connection to a CDN), 0 for no limit
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(self, assets=1000, file_size=1024 * 1024, latency=0.0,
+                 faults=None, host="127.0.0.1", port=0, bandwidth=0):
+        self.assets = assets
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.faults = faults
+        self.request_counts = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._payload = _payload(file_size)
+        self._server = _ThreadingHTTPServer((host, port), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL of the server"""
+        return "http://%s:%d" % self._server.server_address[:2]
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, kind, sent=0):
+        """Record a request"""
+        with self._lock:
+            self.request_counts[kind] += 1
+            self.bytes_sent += sent
+
+    def inject_fault(self, handler, kind):
+        """
+        Inject a fault into a request. Returns True if the fault
+        has been sent as the response, "disconnect" if the download
+        should be cut off, or False to answer normally.
+        """
+        fault = self.faults.pick(kind) if self.faults else None
+        if fault is None:
+            return False
+        self.count("fault:" + fault)
+        if fault == "slow":
+            time.sleep(self.faults.slow_seconds)
+            return False
+        if fault == "disconnect":
+            return "disconnect" if kind == "download" else False
+        if fault == "session_error":
+            handler.send_json({
+                "error": "Invalid global session",
+                "errorCode": "INVALID_GLOBAL_SESSION",
+            }, status=421)
+        else:
+            status = 503 if fault == "throttle" else 429
+            body = b"Service Unavailable" if status == 503 \
+                else b"Too Many Requests"
+            handler.send_response(status)
+            handler.send_header("Content-Type", "text/plain")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.send_header("Retry-After", "1")
+            handler.end_headers()
+            handler.wfile.write(body)
+        return True
+
+    # Responses
+
+    def login(self):
+        """Response to /setup/ws/1/login"""
+        return {
+            "dsInfo": {"dsid": "1234567890", "hsaVersion": 0},
+            "hsaChallengeRequired": False,
+            "webservices": {
+                "ckdatabasews": {"url": self.url, "status": "active"},
+            },
+        }
+
+    def query(self, body):
+        """Response to records/query"""
+        query = body.get("query", {})
+        record_type = query.get("recordType")
+        if record_type == "CheckIndexingState":
+            return {"records": [{
+                "recordName": "CheckIndexingState",
+                "recordType": "CheckIndexingState",
+                "fields": {"state": {"value": "FINISHED"}},
+            }]}
+        if record_type == "CPLAlbumByPositionLive":
+            return {"records": []}
+
+        filters = dict(
+            (f["fieldName"], f["fieldValue"]["value"])
+            for f in query.get("filterBy", []))
+        if filters.get("smartAlbum") or "Deleted" in (record_type or ""):
+            # Smart albums and "Recently Deleted" are empty
+            return {"records": []}
+        offset = int(filters.get("startRank", 0))
+        direction = filters.get("direction", "ASCENDING")
+        limit = max(int(body.get("resultsLimit", 200)) // 2, 1)
+        if direction == "DESCENDING":
+            indexes = range(offset, max(offset - limit, -1), -1)
+        else:
+            indexes = range(offset, min(offset + limit, self.assets))
+        records = []
+        for index in indexes:
+            if 0 <= index < self.assets:
+                records.extend(self.records(self.asset_at(index)))
+        return {"records": records}
+
+    def lookup(self, body):
+        """Response to records/lookup"""
+        records = []
+        for record in body.get("records", []):
+            name = record.get("recordName", "")
+            match = re.match(r"(ASSET-)?FAKE(\d+)ASSET$", name)
+            if match and int(match.group(2)) < self.assets:
+                asset, master = self.records(int(match.group(2)))
+                records.append(asset if match.group(1) else master)
+            else:
+                records.append(
+                    {"recordName": name, "serverErrorCode": "NOT_FOUND"})
+        return {"records": records}
+
+    def count_query(self):
+        """Response to internal/records/query/batch"""
+        return {"batch": [{"records": [{
+            "recordName": "CPLAssetByAddedDate",
+            "recordType": "IndexCountResult",
+            "fields": {"itemCount": {"value": self.assets}},
+        }]}]}
+
+    def asset_at(self, rank):
+        """
+        The asset at a rank in "All Photos". The newest asset is at rank 0,
+        so assets that are added to the library (by raising `assets`)
+        come first, and the other assets keep their numbers.
+        """
+        return self.assets - 1 - rank
+
+    def records(self, index):
+        """CPLMaster and CPLAsset records for an asset"""
+        record_name = "FAKE%08dASSET" % index
+        filename = "IMG_%06d.JPG" % index
+        date = START_DATE + index * 60 * 1000
+        master = {
+            "recordName": record_name,
+            "recordType": "CPLMaster",
+            "fields": {
+                "itemType": {"value": "public.jpeg"},
+                "filenameEnc": {
+                    "value": base64.b64encode(
+                        filename.encode("utf-8")).decode("ascii")},
+                "resOriginalRes": {"value": {
+                    "size": self.file_size,
+                    "downloadURL": "%s/assets/%d" % (self.url, index),
+                    "fileChecksum": "CHECKSUM%08d" % index,
+                }},
+                "resOriginalWidth": {"value": 4032},
+                "resOriginalHeight": {"value": 3024},
+                "resOriginalFileType": {"value": "public.jpeg"},
+            },
+        }
+        asset = {
+            "recordName": "ASSET-%s" % record_name,
+            "recordType": "CPLAsset",
+            "fields": {
+                "masterRef": {"value": {"recordName": record_name}},
+                "assetDate": {"value": date},
+                "addedDate": {"value": date},
+            },
+        }
+        return [asset, master]
+
+    def asset(self, handler, index):
+        """Send the bytes of an asset, with support for Range requests"""
+        if not 0 <= index < self.assets:
+            handler.send_error(404)
+            return
+        fault = self.inject_fault(handler, "download")
+        if fault is True:
+            return
+        start = 0
+        end = self.file_size
+        match = re.match(
+            r"bytes=(\d+)-(\d*)$", handler.headers.get("Range") or "")
+        if match and int(match.group(1)) < self.file_size:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)) + 1, self.file_size)
+            handler.send_response(206)
+            handler.send_header(
+                "Content-Range",
+                "bytes %d-%d/%d" % (start, end - 1, self.file_size))
+        else:
+            handler.send_response(200)
+        handler.send_header("Content-Type", "image/jpeg")
+        handler.send_header("Content-Length", str(end - start))
+        handler.end_headers()
+        if fault == "disconnect":
+            # Send half of the file, then drop the connection
+            half = start + (end - start) // 2
+            self.send_payload(handler, start, half)
+            self.count("partial_download", half - start)
+            handler.wfile.flush()
+            handler.connection.shutdown(socket.SHUT_RDWR)
+            handler.close_connection = True
+            return
+        self.send_payload(handler, start, end)
+        self.count("download", end - start)
+
+    def send_payload(self, handler, start, end):
+        """Write the asset bytes from start to end"""
+        view = memoryview(self._payload)
+        size = len(self._payload)
+        # Small writes with a bandwidth limit, so the rate is even
+        max_write = max(self.bandwidth // 50, 1024) if self.bandwidth else size
+        started = time.time()
+        position = start
+        while position < end:
+            offset = position % size
+            length = min(size - offset, end - position, max_write)
+            handler.wfile.write(view[offset:offset + length])
+            position += length
+            if self.bandwidth:
+                ahead = (position - start) / float(self.bandwidth) - \
+                    (time.time() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+def _payload(file_size):
+    """A block of bytes that is repeated for the asset downloads"""
+    size = min(file_size, 1024 * 1024) or 1
+    pattern = b"\xff\xd8" + bytes(bytearray(range(256))) * (size // 256 + 1)
+    return pattern[:size]
+
+
+def _make_handler(app):
+    """Request handler bound to a FakeICloud"""
+
+    class FakeICloudHandler(BaseHTTPRequestHandler):
+        """Handles the requests for a FakeICloud"""
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, data, status=200):
+            """Send a JSON response"""
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_json(self):
+            """Read the JSON body of a POST request"""
+            length = int(self.headers.get("Content-Length") or 0)
+            data = self.rfile.read(length) if length else b""
+            try:
+                return json.loads(data.decode("utf-8") or "{}")
+            except ValueError:
+                return {}
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """Login and CloudKit queries"""
+            body = self.read_json()
+            if app.latency:
+                time.sleep(app.latency)
+            path = self.path.split("?")[0]
+            if path.endswith("/login"):
+                app.count("login")
+                self.send_json(app.login())
+            elif path == DATABASE_PATH + "/records/query":
+                app.count("query")
+                if body.get("query", {}).get("recordType") in (
+                        "CheckIndexingState", "CPLAlbumByPositionLive") \
+                        or not app.inject_fault(self, "query"):
+                    self.send_json(app.query(body))
+            elif path == DATABASE_PATH + "/records/lookup":
+                app.count("lookup")
+                self.send_json(app.lookup(body))
+            elif path == DATABASE_PATH + "/internal/records/query/batch":
+                app.count("count")
+                self.send_json(app.count_query())
+            else:
+                app.count("other")
+                self.send_error(404)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Asset downloads"""
+            if app.latency:
+                time.sleep(app.latency)
+            match = re.match(r"/assets/(\d+)$", self.path)
+            if match:
+                app.asset(self, int(match.group(1)))
+            else:
+                app.count("other")
+                self.send_error(404)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+    return FakeICloudHandler
+
+
+def patch_pyicloud(url):
+    """
+    Send the iCloud login request to the fake server at url. All the other
+    URLs (CloudKit and downloads) come from the fake server's responses.
+    """
+    from pyicloud_ipd.base import PyiCloudSession
+    request = PyiCloudSession.request
+
+    def fake_request(self, method, request_url, *args, **kwargs):
+        """Replace the setup endpoint"""
+        if request_url.startswith(SETUP_ENDPOINT):
+            request_url = url + "/setup/ws/1" + \
+                request_url[len(SETUP_ENDPOINT):]
+        return request(self, method, request_url, *args, **kwargs)
+
+    PyiCloudSession.request = fake_request
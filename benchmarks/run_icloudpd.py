@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+"""
+Runs icloudpd against a fake iCloud server (see fake_icloud.py):
+
+    python benchmarks/run_icloudpd.py http://127.0.0.1:8080 -d /tmp/photos ...
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+# pylint: disable=wrong-import-position
+from fake_icloud import patch_pyicloud  # noqa: E402
+from icloudpd.base import main  # noqa: E402
+
+
+if __name__ == "__main__":
+    patch_pyicloud(sys.argv[1])
+    main.main(args=sys.argv[2:], prog_name="icloudpd")
@@ -0,0 +1,189 @@
+"""Download the photos of several iCloud accounts, in a pool of processes"""
+
+from __future__ import print_function
+import json
+import logging
+import multiprocessing
+import sys
+import time
+import click
+from icloudpd import base
+from icloudpd.bandwidth import BandwidthLimiter
+from icloudpd.logger import setup_logger
+
+CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
+
+# Shared by all the accounts that run in a worker process
+# (set by init_worker)
+_BANDWIDTH = None
+
+
+def load_accounts(path):
+    """
+    Returns the accounts in a JSON file: a list of objects with a
+    username, directory and cookie_directory, and optionally a password
+    and the args for icloudpd (e.g. ["--until-found", "10"]).
+    """
+    with open(path) as accounts_file:
+        accounts = json.load(accounts_file)
+    if not isinstance(accounts, list):
+        raise click.BadParameter("%s must contain a list of accounts" % path)
+    for number, account in enumerate(accounts, 1):
+        for key in ("username", "directory", "cookie_directory"):
+            if not account.get(key):
+                raise click.BadParameter(
+                    "Account %d in %s has no %s" % (number, path, key))
+    return accounts
+
+
+def account_args(account, threads_num):
+    """
+    Returns the icloudpd args for an account. The threads come last,
+    so they override the account's own --threads-num.
+    """
+    args = [
+        "--username", account["username"],
+        "--directory", account["directory"],
+        "--cookie-directory", account["cookie_directory"],
+        "--no-progress-bar",
+    ]
+    if account.get("password"):
+        args += ["--password", account["password"]]
+    args += list(account.get("args", []))
+    args += [
+        "--threads-num", str(threads_num),
+        "--connection-pool-size", str(threads_num),
+    ]
+    return args
+
+
+def log_format(username):
+    """The log format of an account, with its username on every line"""
+    return "%(asctime)s %(levelname)-8s " + \
+        username.replace("%", "%%") + ": %(message)s"
+
+
+def init_worker(bandwidth):
+    """Keep the shared bandwidth limiter in the worker process"""
+    global _BANDWIDTH  # pylint: disable-msg=global-statement
+    _BANDWIDTH = bandwidth
+
+
+def run_account(task):
+    """
+    Run icloudpd for one account, in a worker process.
+    Returns the summary of the account.
+    """
+    account, threads_num = task
+    username = account["username"]
+    # Every line in the combined output says which account it is from
+    logger = setup_logger()
+    for handler in logger.handlers:
+        handler.setFormatter(logging.Formatter(
+            fmt=log_format(username), datefmt="%Y-%m-%d %H:%M:%S"))
+
+    summary = {
+        "username": username,
+        "status": "ok",
+        "downloaded": 0,
+        "linked": 0,
+        "failed": 0,
+    }
+    start = time.time()
+    try:
+        result = base.main.main(
+            args=account_args(account, threads_num),
+            prog_name="icloudpd",
+            standalone_mode=False,
+            obj={"bandwidth": _BANDWIDTH})
+        if result:
+            summary.update(result)
+    except SystemExit as ex:
+        # e.g. two-step authentication is required
+        if ex.code:
+            summary["status"] = "exit %s" % ex.code
+    except Exception as ex:  # pylint: disable-msg=broad-except
+        logger.error("%s", ex)
+        summary["status"] = "error: %s" % ex
+    if summary["status"] == "ok" and summary["failed"]:
+        summary["status"] = "failed downloads"
+    summary["seconds"] = time.time() - start
+    return summary
+
+
+def print_summary(summaries):
+    """Print one line for each account, and the totals"""
+    width = max([len("Account")] + [len(s["username"]) for s in summaries])
+    row = "%-" + str(width) + "s %10s %7s %7s %8s  %s"
+    print(row % (
+        "Account", "Downloaded", "Linked", "Failed", "Seconds", "Status"))
+    for summary in summaries:
+        print(row % (
+            summary["username"], summary["downloaded"], summary["linked"],
+            summary["failed"], "%.0f" % summary["seconds"],
+            summary["status"]))
+    failed = [s for s in summaries if s["status"] != "ok"]
+    print(row % (
+        "Total", sum(s["downloaded"] for s in summaries),
+        sum(s["linked"] for s in summaries),
+        sum(s["failed"] for s in summaries),
+        "", "%d of %d accounts ok" % (
+            len(summaries) - len(failed), len(summaries))))
+
+
+@click.command(context_settings=CONTEXT_SETTINGS, options_metavar="<options>")
+@click.argument(
+    "accounts_file",
+    metavar="<accounts.json>",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--processes",
+    help="Number of accounts that are downloaded at the same time, "
+    "at most --max-connections (default: 4)",
+    type=click.IntRange(1),
+    default=4,
+)
+@click.option(
+    "--max-connections",
+    help="Maximum number of download connections of all the accounts. "
+    "Each account that is running gets an equal share (default: 16)",
+    type=click.IntRange(1),
+    default=16,
+)
+@click.option(
+    "--max-bandwidth",
+    help="Maximum download bandwidth of all the accounts, in KB/s "
+    "(default: no limit)",
+    type=click.IntRange(1),
+)
+@click.version_option()
+def main(accounts_file, processes, max_connections, max_bandwidth):
+    """
+    Download the photos of all the accounts in <accounts.json>.
+    Each account runs in a new process, and one summary is printed at the end.
+    """
+    accounts = load_accounts(accounts_file)
+    # Every account needs at least one connection
+    processes = max(min(processes, len(accounts), max_connections), 1)
+    threads_num = max_connections // processes
+
+    bandwidth = None
+    if max_bandwidth:
+        bandwidth = BandwidthLimiter(max_bandwidth * 1024, shared=True)
+
+    # One process for each account, so the accounts don't share a session,
+    # a logger or a crash. On Linux the processes are forked from this one,
+    # so they don't have to start Python and import icloudpd again.
+    pool = multiprocessing.Pool(
+        processes, init_worker, (bandwidth,), maxtasksperchild=1)
+    try:
+        summaries = list(pool.imap(
+            run_account, [(account, threads_num) for account in accounts]))
+    finally:
+        pool.close()
+        pool.join()
+
+    print_summary(summaries)
+    if any(summary["status"] != "ok" for summary in summaries):
+        sys.exit(1)
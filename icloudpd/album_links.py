@@ -0,0 +1,110 @@
+"""Links the photos that are in more than one album, so they are only downloaded once"""
+
+import os
+from icloudpd.logger import setup_logger
+from icloudpd.durability import link_file
+
+
+class AlbumLinker(object):
+    """
+    With more than one album, a photo that is in several of them is
+    downloaded to the folder of the first album, and linked into the
+    folders of the other albums once the downloads have finished.
+
+    The paths in the manifest are relative to directory. Pass no manifest
+    when it is being rebuilt, so the copies are only found on disk.
+    """
+
+    def __init__(self, directory, download_manifest=None, file_index=None,
+                 fsync_policy="none"):
+        self.directory = directory
+        self.manifest = download_manifest
+        self.file_index = file_index
+        self.fsync_policy = fsync_policy
+        # (record id, version) => the path it was downloaded to (or found at)
+        self.copies = {}
+        # (record id, version, source path, path) of the links to make
+        self.links = []
+
+    def manifest_path(self, path):
+        """Returns the path that is stored in the manifest"""
+        return os.path.relpath(path, self.directory)
+
+    def existing_path(self, record_id, manifest_entry, download_path,
+                      album_dir):
+        """
+        Returns the downloaded path in the manifest entry if it is in
+        album_dir, download_path if it was linked there in an earlier
+        run, or None if the album doesn't have this photo yet.
+        """
+        existing_path = os.path.join(self.directory, manifest_entry["path"])
+        if existing_path.startswith(os.path.join(album_dir, "")):
+            return existing_path
+        if self.manifest.path_owner(
+                self.manifest_path(download_path)) == record_id:
+            return download_path
+        return None
+
+    def add_copy(self, record_id, version, path):
+        """Remember a file that already exists, for the albums that come next"""
+        self.copies.setdefault((record_id, version), path)
+
+    def copy_of(self, record_id, version, download_path):
+        """
+        Returns the path of this version of the photo in another album
+        (downloaded now or in an earlier run), or None. Remembers
+        download_path as a copy for the albums that come next.
+        """
+        key = (record_id, version)
+        copy_path = self.copies.get(key)
+        if copy_path is None and self.manifest is not None:
+            manifest_entry = self.manifest.lookup(record_id, version)
+            if manifest_entry is not None:
+                copy_path = os.path.join(
+                    self.directory, manifest_entry["path"])
+        if copy_path is None:
+            self.copies[key] = download_path
+        return copy_path
+
+    def defer_link(self, record_id, version, source, path):
+        """Link path to source when link_all is called"""
+        self.links.append((record_id, version, source, path))
+
+    def record_link(self, record_id, version, path):
+        """Add a link to the manifest"""
+        if self.file_index is not None:
+            self.file_index.add(path)
+        if self.manifest is not None:
+            self.manifest.add_link(
+                record_id, version, self.manifest_path(path))
+
+    def link_all(self):
+        """
+        Make the links that were deferred.
+        Returns (number of links, paths that could not be linked).
+        """
+        logger = setup_logger()
+        methods = {}
+        failed = []
+        for record_id, version, source, path in self.links:
+            if not os.path.isfile(source):
+                logger.error(
+                    "Could not link %s, %s was not downloaded.", path, source)
+                failed.append(path)
+                continue
+            try:
+                method = link_file(source, path, self.fsync_policy)
+            except (IOError, OSError) as ex:
+                logger.error("Could not link %s: %s", path, ex)
+                failed.append(path)
+                continue
+            methods[method] = methods.get(method, 0) + 1
+            self.record_link(record_id, version, path)
+        self.links = []
+        if methods:
+            logger.info(
+                "Linked %d photos that are in more than one album (%s).",
+                sum(methods.values()),
+                ", ".join("%d %s" % (count, method)
+                          for method, count in sorted(methods.items())))
+        return sum(methods.values()), failed
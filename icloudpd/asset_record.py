@@ -0,0 +1,107 @@
+"""Compact records of the photos in an album, without the raw CloudKit JSON"""
+
+from collections import namedtuple
+
+# A version of an asset (e.g. "original" or "mediumVideo")
+AssetVersion = namedtuple("AssetVersion", ["filename", "size", "url", "checksum"])
+
+
+def asset_record_id(photo):
+    """Returns the ID of the CPLAsset record of a photo, or None"""
+    # pylint: disable=protected-access
+    try:
+        return photo._asset_record["recordName"]
+    except (AttributeError, KeyError, TypeError):
+        return None
+    # pylint: enable=protected-access
+
+
+def master_record_checksum(photo, size):
+    """Returns the fileChecksum of a PhotoAsset version, or None"""
+    # pylint: disable=protected-access
+    try:
+        if photo.item_type == "movie":
+            lookup = photo.VIDEO_VERSION_LOOKUP
+        else:
+            lookup = photo.PHOTO_VERSION_LOOKUP
+        fields = photo._master_record["fields"]
+        return fields["%sRes" % lookup[size]]["value"].get("fileChecksum")
+    except (AttributeError, KeyError, TypeError):
+        return None
+    # pylint: enable=protected-access
+
+
+class AssetRecord(object):
+    """
+    The fields of a PhotoAsset that icloudpd uses: the ID, filename,
+    created date, item type and the URL, size and checksum of each version.
+
+    A PhotoAsset keeps its master and asset records, which are a few KB
+    of nested dicts, and builds its versions from them. An AssetRecord
+    is extracted once, when the photo is listed, so the photos that are
+    waiting in the prefetch queue, the worker pool and the retry queue
+    don't keep the JSON alive.
+    """
+
+    __slots__ = ("id", "filename", "created", "item_type", "versions",
+                 "asset_record_id", "_service")
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(self, service, record_id, filename, created, item_type,
+                 versions, asset_id=None):
+        self._service = service
+        self.id = record_id  # pylint: disable=invalid-name
+        self.filename = filename
+        self.created = created
+        self.item_type = item_type
+        self.versions = versions
+        self.asset_record_id = asset_id
+
+    @classmethod
+    def from_photo(cls, photo):
+        """
+        Extract the record of a PhotoAsset. Raises KeyError if the
+        photo's fields are incomplete (e.g. a version without a downloadURL)
+        """
+        if isinstance(photo, cls):
+            return photo
+        versions = {}
+        for key, version in photo.versions.items():
+            versions[key] = AssetVersion(
+                version["filename"], version["size"], version["url"],
+                master_record_checksum(photo, key))
+        # pylint: disable=protected-access
+        return cls(
+            photo._service, photo.id, photo.filename, photo.created,
+            photo.item_type, versions, asset_record_id(photo))
+        # pylint: enable=protected-access
+
+    def download(self, version="original", **kwargs):
+        """Request a version of the photo, like PhotoAsset.download"""
+        if version not in self.versions:
+            return None
+        return self._service.session.get(
+            self.versions[version].url,
+            stream=True,
+            **kwargs
+        )
+
+    def __repr__(self):
+        return "<%s: id=%s>" % (type(self).__name__, self.id)
+
+
+def compact_records(photos, error_handler=None):
+    """
+    Yields the AssetRecord of each photo. If the record of a photo can't
+    be extracted, error_handler(photo, exception) is called, and what it
+    returns is yielded instead, unless it's None.
+    """
+    for photo in photos:
+        try:
+            record = AssetRecord.from_photo(photo)
+        except KeyError as ex:
+            if error_handler is None:
+                raise
+            record = error_handler(photo, ex)
+        if record is not None:
+            yield record
@@ -1,6 +1,8 @@
 """Handles username/password authentication and two-step authentication"""
 
 import sys
+import threading
+import weakref
 import click
 import pyicloud_ipd
 from icloudpd.logger import setup_logger
@@ -48,6 +50,75 @@ def authenticate(
     return icloud
 
 
+class Reauthenticator(object):  # pylint: disable-msg=too-few-public-methods
+    """
+    Re-authenticates an iCloud session once for all the downloads that
+    saw it expire at the same time.
+
+    Callers pass the generation that they read before their request.
+    If the session was already refreshed since then, they just retry.
+    If another thread is logging in, they wait for it to finish and
+    share its result (or its error). Otherwise they log in.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self._in_progress = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def reauthenticate(self, icloud, generation=None):
+        """Call icloud.authenticate(), unless another caller already did"""
+        with self._cond:
+            if generation is not None and generation < self.generation:
+                return
+            if self._in_progress:
+                setup_logger().debug("Waiting for re-authentication...")
+                while self._in_progress:
+                    self._cond.wait()
+                if self._error is not None:
+                    raise self._error
+                return
+            self._in_progress = True
+            self._error = None
+        try:
+            icloud.authenticate()
+        except Exception as ex:
+            with self._cond:
+                self._error = ex
+            raise
+        finally:
+            with self._cond:
+                self._in_progress = False
+                if self._error is None:
+                    self.generation += 1
+                self._cond.notify_all()
+
+
+_REAUTHENTICATORS = weakref.WeakKeyDictionary()
+_REAUTHENTICATORS_LOCK = threading.Lock()
+
+
+def reauthenticator_for(icloud):
+    """Returns the Reauthenticator that is shared by all users of an iCloud session"""
+    with _REAUTHENTICATORS_LOCK:
+        reauthenticator = _REAUTHENTICATORS.get(icloud)
+        if reauthenticator is None:
+            reauthenticator = Reauthenticator()
+            _REAUTHENTICATORS[icloud] = reauthenticator
+        return reauthenticator
+
+
+def session_generation(icloud):
+    """Read this before a request, and pass it to reauthenticate() if it fails"""
+    return reauthenticator_for(icloud).generation
+
+
+def reauthenticate(icloud, generation=None):
+    """Re-authenticate, once for all the callers that saw the session expire"""
+    reauthenticator_for(icloud).reauthenticate(icloud, generation)
+
+
 def request_2sa(icloud, logger):
     """Request two-step authentication. Prompts for SMS or device"""
     devices = icloud.trusted_devices
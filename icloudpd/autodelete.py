@@ -2,11 +2,95 @@
 Delete any files found in "Recently Deleted"
 """
 import os
+from tzlocal import get_localzone
 from icloudpd.logger import setup_logger
 from icloudpd.paths import local_download_path
+from icloudpd.asset_record import compact_records
+from icloudpd.worker_pool import WorkerPool
 
 
-def autodelete_photos(icloud, folder_structure, directory):
+# Sizes that were downloaded before the manifest existed
+LEGACY_SIZES = [None, "original", "medium", "thumb"]
+
+
+def local_created_date(media):
+    """
+    Returns the created date in the local timezone.
+    This is the date that base.main uses for the folder structure.
+    """
+    try:
+        return media.created.astimezone(get_localzone())
+    except (ValueError, OSError):
+        return media.created
+
+
+def plan_deletions(recently_deleted, folder_structure, directory,
+                   download_manifest=None, file_index=None):
+    """
+    Returns a list of (record_id, version, path) for the downloaded files
+    of each photo in "Recently Deleted".
+
+    Files in the manifest are found by record ID. Other files (e.g. from
+    runs without a manifest) are found by their expected download path.
+    """
+    plan = []
+    for media in recently_deleted:
+        found = set()
+        if download_manifest is not None:
+            for row in download_manifest.downloads_for(media.id):
+                path = os.path.join(directory, row["path"])
+                found.add(path)
+                plan.append((media.id, row["version"], path))
+
+        date_path = folder_structure.format(local_created_date(media))
+        download_dir = os.path.join(directory, date_path)
+        for size in LEGACY_SIZES:
+            path = local_download_path(media, size, download_dir)
+            if path in found:
+                continue
+            if file_index is not None:
+                exists = file_index.isfile(path)
+            else:
+                exists = os.path.exists(path)
+            if exists:
+                found.add(path)
+                plan.append((media.id, None, path))
+    return plan
+
+
+def delete_files(plan, download_manifest=None, threads_num=1, dry_run=False):
+    """
+    Deletes the planned files in one pass, with threads_num threads.
+    Returns the number of files that were (or would be) deleted.
+    """
+    logger = setup_logger()
+    deleted = []
+
+    def delete_file(record_id, version, path):
+        """Delete a file and forget it in the manifest"""
+        if dry_run:
+            logger.info("Would delete %s", path)
+            deleted.append(path)
+            return
+        logger.info("Deleting %s!", path)
+        try:
+            os.remove(path)
+            deleted.append(path)
+        except OSError as ex:
+            logger.debug("Could not delete %s: %s", path, ex)
+        if download_manifest is not None and version is not None:
+            download_manifest.remove(record_id, version)
+
+    pool = WorkerPool(threads_num)
+    for record_id, version, path in plan:
+        pool.submit(delete_file, record_id, version, path)
+    pool.join()
+    return len(deleted)
+
+
+def autodelete_photos(icloud, folder_structure, directory,
+                      download_manifest=None, file_index=None,
+                      threads_num=1, dry_run=False):
     """
     Scans the "Recently Deleted" folder and deletes any matching files
     from the download directory.
@@ -15,15 +99,18 @@ def autodelete_photos(icloud, folder_structure, directory):
     logger = setup_logger()
     logger.info("Deleting any files found in 'Recently Deleted'...")
 
-    recently_deleted = icloud.photos.albums["Recently Deleted"]
-
-    for media in recently_deleted:
-        created_date = media.created
-        date_path = folder_structure.format(created_date)
-        download_dir = os.path.join(directory, date_path)
+    # Only the ID, filename and created date are needed here, so photos
+    # whose versions are incomplete are planned from the PhotoAsset.
+    recently_deleted = compact_records(
+        icloud.photos.albums["Recently Deleted"],
+        lambda photo, ex: photo)
 
-        for size in [None, "original", "medium", "thumb"]:
-            path = local_download_path(media, size, download_dir)
-            if os.path.exists(path):
-                logger.info("Deleting %s!", path)
-                os.remove(path)
+    plan = plan_deletions(
+        recently_deleted, folder_structure, directory,
+        download_manifest, file_index)
+    count = delete_files(plan, download_manifest, threads_num, dry_run)
+    if dry_run:
+        logger.info(
+            "Dry run: %d files would be deleted from %s", count, directory)
+    else:
+        logger.info("Deleted %d files from %s", count, directory)
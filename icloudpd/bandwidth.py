@@ -0,0 +1,52 @@
+"""Caps the download bandwidth of all the download threads (and processes)"""
+
+import multiprocessing
+import threading
+import time
+
+
+class BandwidthLimiter(object):  # pylint: disable-msg=too-few-public-methods
+    """
+    A token bucket of `rate` bytes per second, that holds up to `burst`
+    bytes (one second's worth by default). Every chunk that is written
+    to disk takes its size from the bucket, and waits while it is empty.
+
+    A limiter made with shared=True keeps its state in shared memory, so
+    it also caps the processes that inherit it (see accounts.py).
+    """
+
+    def __init__(self, rate, burst=None, shared=False):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        # [tokens, time of the last refill]
+        if shared:
+            self._lock = multiprocessing.Lock()
+            self._state = multiprocessing.RawArray(
+                "d", [self.burst, time.time()])
+        else:
+            self._lock = threading.Lock()
+            self._state = [self.burst, time.time()]
+
+    def consume(self, nbytes):
+        """
+        Wait until nbytes can be downloaded. Chunks that are larger than
+        the bucket only wait for a full bucket, and leave it in debt, so
+        the average rate stays the same.
+        Returns the number of seconds that were spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                tokens = min(
+                    self.burst,
+                    self._state[0] + (now - self._state[1]) * self.rate)
+                self._state[1] = now
+                needed = min(nbytes, self.burst)
+                if tokens >= needed:
+                    self._state[0] = tokens - nbytes
+                    return waited
+                self._state[0] = tokens
+                delay = (needed - tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
@@ -4,7 +4,6 @@ from __future__ import print_function
 import os
 import sys
 import time
-import datetime
 import logging
 import itertools
 import subprocess
@@ -12,15 +11,31 @@ import json
 import click
 
 from tqdm import tqdm
-from tzlocal import get_localzone
 
 from icloudpd.logger import setup_logger
-from icloudpd.authentication import authenticate, TwoStepAuthRequiredError
+from icloudpd.authentication import (
+    authenticate, reauthenticate, TwoStepAuthRequiredError)
 from icloudpd import download
 from icloudpd.email_notifications import send_2sa_notification
 from icloudpd.string_helpers import truncate_middle
 from icloudpd.autodelete import autodelete_photos
-from icloudpd.paths import local_download_path
+from icloudpd.paths import unique_local_download_path, album_folder
+from icloudpd.worker_pool import WorkerPool
+from icloudpd.retry import RetryQueue, RetryLater, SESSION_POLICY
+from icloudpd.concurrency import AdaptiveConcurrency
+from icloudpd.failed_assets import retry_failed_first
+from icloudpd.asset_record import compact_records
+from icloudpd.planner import PathPlanner, plan_pages
+from icloudpd.durability import FSYNC_POLICIES
+from icloudpd.album_links import AlbumLinker
+from icloudpd.local_downloads import LocalDownloads
+from icloudpd.bandwidth import BandwidthLimiter
+from icloudpd.connection_pool import configure_session
+from icloudpd.manifest import open_manifest
+from icloudpd.sync_cursor import SyncCursor, supports_cursor
+from icloudpd.prefetch import PrefetchIterator
+from icloudpd.local_index import LocalFileIndex
+from icloudpd.exif_backfill import backfill_exif
 from icloudpd import exif_datetime
 # Must import the constants object so that we can mock values in tests.
 from icloudpd import constants
@@ -79,9 +94,12 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 )
 @click.option(
     "-a", "--album",
-    help="Album to download (default: All Photos)",
+    help="Album to download (default: All Photos). "
+    "Can be given more than once, and then each album is downloaded "
+    "to a folder with its name",
     metavar="<album>",
-    default="All Photos",
+    multiple=True,
+    default=["All Photos"],
 )
 @click.option(
     "-l", "--list-albums",
@@ -110,6 +128,12 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
     + "(If you restore the photo in iCloud, it will be downloaded again.)",
     is_flag=True,
 )
+@click.option(
+    "--auto-delete-dry-run",
+    help="Lists the files that --auto-delete would delete, "
+    "without deleting them",
+    is_flag=True,
+)
 @click.option(
     "--only-print-filenames",
     help="Only prints the filenames of all files that will be downloaded "
@@ -183,6 +207,104 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
     "(Progress bar is disabled by default if there is no tty attached)",
     is_flag=True,
 )
+@click.option(
+    "--threads-num",
+    help="Maximum number of threads used for downloading photos and videos "
+    "in parallel (default: 1). Downloads start 2 at a time, and more are "
+    "added while the server keeps up",
+    type=click.IntRange(1),
+    default=1,
+)
+@click.option(
+    "--connection-pool-size",
+    help="Number of connections to keep open to each iCloud host "
+    "(default: the number of download threads, at least 10)",
+    type=click.IntRange(1),
+)
+@click.option(
+    "--timeout",
+    help="Timeout in seconds for connecting to and reading from the "
+    "iCloud download servers, 0 to disable (default: 60)",
+    type=click.IntRange(0),
+    default=60,
+)
+@click.option(
+    "--manifest",
+    help="SQLite file that records every downloaded asset by its iCloud "
+    "record ID. Assets in the manifest are skipped without checking the "
+    "download directory.",
+    type=click.Path(dir_okay=False),
+    metavar="<manifest_file>",
+)
+@click.option(
+    "--rebuild-manifest",
+    help="Scans the download directory for files that have already been "
+    "downloaded and records them in the manifest. (Does not download any files.)",
+    is_flag=True,
+)
+@click.option(
+    "--incremental",
+    help="Only look up the photos that were added since the last run. "
+    "The newest added date is saved in the manifest after each run. "
+    "(Requires --manifest)",
+    is_flag=True,
+)
+@click.option(
+    "--page-size",
+    help="Number of photos to request from iCloud in each page "
+    "of the album listing (default: 100)",
+    type=click.IntRange(1),
+    default=100,
+)
+@click.option(
+    "--prefetch-pages",
+    help="Number of album pages to look up in the background, while "
+    "the photos from the current page are downloaded (default: 0, disabled)",
+    type=click.IntRange(0),
+    default=0,
+)
+@click.option(
+    "--prescan",
+    help="Scan the download directory once at startup, and check for "
+    "existing files in memory instead of on disk "
+    "(much faster for network volumes)",
+    is_flag=True,
+)
+@click.option(
+    "--backfill-exif", "backfill_exif_dates",
+    help="Sets the EXIF date on JPEGs that have already been downloaded "
+    "and don't have one, using --threads-num processes. "
+    "(Does not download any files.)",
+    is_flag=True,
+)
+@click.option(
+    "--segmented-download-threshold",
+    help="Download files of at least this many MB (e.g. videos) as "
+    "several byte ranges at the same time (default: off)",
+    type=click.IntRange(1),
+    metavar="<megabytes>",
+)
+@click.option(
+    "--download-segments",
+    help="Number of byte ranges for --segmented-download-threshold "
+    "(default: %d)" % constants.DOWNLOAD_SEGMENTS,
+    type=click.IntRange(2),
+    default=constants.DOWNLOAD_SEGMENTS,
+)
+@click.option(
+    "--fsync-policy",
+    help="When downloaded files are flushed to disk: none (default), "
+    "file (before the file is renamed into place), or full (the file and "
+    "its directory)",
+    type=click.Choice(FSYNC_POLICIES),
+    default="none",
+)
+@click.option(
+    "--max-bandwidth",
+    help="Maximum download bandwidth of all the threads, in KB/s "
+    "(default: no limit)",
+    type=click.IntRange(1),
+)
 @click.version_option()
 # pylint: disable-msg=too-many-arguments,too-many-statements
 # pylint: disable-msg=too-many-branches,too-many-locals
@@ -201,6 +323,7 @@ def main(
         skip_live_photos,
         force_size,
         auto_delete,
+        auto_delete_dry_run,
         only_print_filenames,
         folder_structure,
         set_exif_datetime,
@@ -213,6 +336,20 @@ def main(
         log_level,
         no_progress_bar,
         notification_script,
+        threads_num,
+        connection_pool_size,
+        timeout,
+        manifest,
+        rebuild_manifest,
+        incremental,
+        page_size,
+        prefetch_pages,
+        prescan,
+        backfill_exif_dates,
+        segmented_download_threshold,
+        download_segments,
+        fsync_policy,
+        max_bandwidth,
 ):
     """Download all iCloud photos to a local directory"""
     logger = setup_logger()
@@ -256,9 +393,15 @@ def main(
             )
         exit(1)
 
-    # Default album is "All Photos", so this is the same as
-    # calling `icloud.photos.all`.
-    photos = icloud.photos.albums[album]
+    if connection_pool_size is None:
+        connection_pool_size = threads_num
+        if segmented_download_threshold:
+            # Each thread can have a connection open for every segment
+            connection_pool_size *= download_segments
+    configure_session(
+        icloud.session,
+        connection_pool_size,
+        timeout or None)
 
     if list_albums:
         albums_dict = icloud.photos.albums
@@ -276,10 +419,45 @@ def main(
         directory = directory.decode("utf-8")  # pragma: no cover
     directory = os.path.normpath(directory)
 
-    logger.debug(
-        "Looking up all photos%s from album %s...",
-        "" if skip_videos else " and videos",
-        album)
+    if rebuild_manifest and not manifest:
+        raise click.UsageError("--rebuild-manifest requires --manifest")
+    if incremental and not manifest:
+        raise click.UsageError("--incremental requires --manifest")
+    download_manifest = open_manifest(manifest) if manifest else None
+    if rebuild_manifest:
+        download_manifest.clear()
+
+    file_index = None
+    if prescan:
+        logger.debug("Scanning %s for downloaded files...", directory)
+        file_index = LocalFileIndex(directory)
+        logger.debug(
+            "Found %d files in %s", file_index.scan(), directory)
+
+    # With more than one album, each album is downloaded to its own folder
+    album_names = []
+    for album_name in album:
+        if album_name not in album_names:
+            album_names.append(album_name)
+
+    def album_directory(album_name):
+        """Returns the folder that an album is downloaded to"""
+        if len(album_names) == 1:
+            return directory
+        return os.path.join(directory, album_folder(album_name))
+
+    # A photo that is in more than one album is only downloaded once,
+    # and linked into the folders of the other albums.
+    album_linker = None
+    if len(album_names) > 1:
+        album_linker = AlbumLinker(
+            directory,
+            None if rebuild_manifest else download_manifest,
+            file_index,
+            fsync_policy)
+    local_downloads = LocalDownloads(
+        directory, download_manifest, file_index, rebuild_manifest,
+        album_linker)
 
     def photos_exception_handler(ex, retries):
         """Handles session errors in the PhotoAlbum photos iterator"""
@@ -296,233 +474,509 @@ def main(
                 # If the first reauthentication attempt failed,
                 # start waiting a few seconds before retrying in case
                 # there are some issues with the Apple servers
-                time.sleep(constants.WAIT_SECONDS)
-            icloud.authenticate()
-
-    photos.exception_handler = photos_exception_handler
-
-    photos_count = len(photos)
-
-    # Optional: Only download the x most recent photos.
-    if recent is not None:
-        photos_count = recent
-        photos = itertools.islice(photos, recent)
-
-    tqdm_kwargs = {"total": photos_count}
-
-    if until_found is not None:
-        del tqdm_kwargs["total"]
-        photos_count = "???"
-        # ensure photos iterator doesn't have a known length
-        photos = (p for p in photos)
-
-    plural_suffix = "" if photos_count == 1 else "s"
-    video_suffix = ""
-    photos_count_str = "the first" if photos_count == 1 else photos_count
-    if not skip_videos:
-        video_suffix = " or video" if photos_count == 1 else " and videos"
-    logger.info(
-        "Downloading %s %s photo%s%s to %s/ ...",
-        photos_count_str,
-        size,
-        plural_suffix,
-        video_suffix,
-        directory,
-    )
+                time.sleep(SESSION_POLICY.delay(retries - 1))
+            reauthenticate(icloud)
+
+    def photo_record_error(photo, ex):
+        """Save the record of a photo that is missing fields, and skip it"""
+        print(
+            "KeyError: %s attribute was not found in the photo fields!" %
+            ex)
+        with open('icloudpd-photo-error.json', 'w') as outfile:
+            # pylint: disable=protected-access
+            json.dump({
+                "master_record": photo._master_record,
+                "asset_record": photo._asset_record
+            }, outfile)
+            # pylint: enable=protected-access
+        print("icloudpd has saved the photo record to: "
+              "./icloudpd-photo-error.json")
+        print("Please create a Gist with the contents of this file: "
+              "https://gist.github.com")
+        print(
+            "Then create an issue on GitHub: "
+            "https://github.com/ndbroadbent/icloud_photos_downloader/issues")
+        print(
+            "Include a link to the Gist in your issue, so that we can "
+            "see what went wrong.\n")
+
+    # Downloads are handed to a bounded pool of workers, while the
+    # planning (paths, skip checks, --until-found) stays in this thread.
+    pool = WorkerPool(threads_num)
+    downloaded_files = []
+    failed_downloads = []
+    # Downloads that failed and are waiting for their backoff delay.
+    # The other downloads keep going in the meantime.
+    retry_queue = RetryQueue()
+    # With more than one worker, the number of downloads that run at the
+    # same time backs off when the server starts throttling.
+    concurrency = None
+    if threads_num > 1:
+        concurrency = AdaptiveConcurrency(threads_num)
+    # Options that are passed on to download_media when they are set
+    media_kwargs = {}
+    if segmented_download_threshold:
+        media_kwargs["segment_threshold"] = \
+            segmented_download_threshold * 1024 * 1024
+        media_kwargs["segments"] = download_segments
+    if fsync_policy != "none":
+        media_kwargs["fsync_policy"] = fsync_policy
+    # The multi-account runner (see accounts.py) shares one limiter
+    # between the processes of all the accounts
+    bandwidth = (click.get_current_context().obj or {}).get("bandwidth")
+    if bandwidth is None and max_bandwidth:
+        bandwidth = BandwidthLimiter(max_bandwidth * 1024)
+    if bandwidth is not None:
+        media_kwargs["bandwidth"] = bandwidth
+    # (path, date) of the existing JPEGs for --backfill-exif
+    backfill_tasks = []
+
+    def record_failure(photo, version, download_path, download_result):
+        """Remember a failed download, so the next run retries it first"""
+        failed_downloads.append(download_path)
+        if download_manifest is not None:
+            download_manifest.add_failure(
+                photo.id, version, photo.asset_record_id,
+                str(download_result))
+
+    def submit_due_retries():
+        """Hand the deferred downloads that are due to the pool"""
+        for func, args, kwargs in retry_queue.pop_due():
+            pool.submit(func, *args, **kwargs)
+
+    def download_photo(photo, download_path, download_size, created_date,
+                       mtime, retries=0):
+        """Download a photo and set its EXIF date or modification time"""
+        truncated_path = truncate_middle(download_path, 96)
+        logger.set_tqdm_description(
+            "Downloading %s" %
+            truncated_path)
+
+        download_kwargs = {}
+        if set_exif_datetime and \
+                photo.filename.lower().endswith((".jpg", ".jpeg")):
+            # Set the EXIF date while the file is downloaded. If that isn't
+            # possible (e.g. the download was resumed), it's set below.
+            download_kwargs["exif_date"] = created_date.strftime(
+                "%Y:%m:%d %H:%M:%S")
+        if mtime is not None:
+            download_kwargs["mtime"] = mtime
+        if retries:
+            download_kwargs["retries"] = retries
+        if concurrency is not None:
+            download_kwargs["concurrency"] = concurrency
+        download_kwargs.update(media_kwargs)
+
+        download_result = download.download_media(
+            icloud, photo, download_path, download_size,
+            defer_retries=True, **download_kwargs
+        )
 
-    consecutive_files_found = 0
+        if isinstance(download_result, RetryLater):
+            retry_queue.defer(
+                download_result.delay, download_photo, photo, download_path,
+                download_size, created_date, mtime,
+                retries=download_result.retries)
+            return
+
+        if download_result:
+            downloaded_files.append(download_path)
+            local_downloads.record(
+                photo, download_size, download_path,
+                getattr(download_result, "sha256", None))
+        else:
+            record_failure(
+                photo, download_size, download_path, download_result)
+
+        if download_result and set_exif_datetime:
+            if photo.filename.lower().endswith((".jpg", ".jpeg")):
+                if not exif_datetime.get_photo_exif(download_path):
+                    # %Y:%m:%d looks wrong but it's the correct format
+                    date_str = created_date.strftime(
+                        "%Y:%m:%d %H:%M:%S")
+                    logger.debug(
+                        "Setting EXIF timestamp for %s: %s",
+                        download_path,
+                        date_str,
+                    )
+                    exif_datetime.set_photo_exif(
+                        download_path,
+                        created_date.strftime("%Y:%m:%d %H:%M:%S"),
+                        fsync_policy,
+                    )
+            elif mtime is not None:
+                os.utime(download_path, (mtime, mtime))
+        local_downloads.in_flight.discard(download_path)
+
+    def download_live_photo(photo, lp_download_path, lp_size, mtime,
+                            retries=0):
+        """Download the video part of a live photo"""
+        truncated_path = truncate_middle(lp_download_path, 96)
+        logger.set_tqdm_description(
+            "Downloading %s" % truncated_path)
+        download_kwargs = {"retries": retries} if retries else {}
+        if mtime is not None:
+            download_kwargs["mtime"] = mtime
+        if concurrency is not None:
+            download_kwargs["concurrency"] = concurrency
+        download_kwargs.update(media_kwargs)
+        download_result = download.download_media(
+            icloud, photo, lp_download_path, lp_size,
+            defer_retries=True, **download_kwargs
+        )
 
-    # Use only ASCII characters in progress bar
-    tqdm_kwargs["ascii"] = True
+        if isinstance(download_result, RetryLater):
+            retry_queue.defer(
+                download_result.delay, download_live_photo, photo,
+                lp_download_path, lp_size, mtime,
+                retries=download_result.retries)
+            return
+
+        if download_result:
+            downloaded_files.append(lp_download_path)
+            local_downloads.record(
+                photo, lp_size, lp_download_path,
+                getattr(download_result, "sha256", None))
+        else:
+            record_failure(photo, lp_size, lp_download_path, download_result)
+        local_downloads.in_flight.discard(lp_download_path)
+
+    def list_album(album_name, album_dir):
+        """
+        Returns (plans, sync cursor, prefetcher) for the photos of an album.
+        The plans come with a progress bar, unless it is disabled.
+        """
+        # Default album is "All Photos", so this is the same as
+        # calling `icloud.photos.all`.
+        photos = icloud.photos.albums[album_name]
+
+        logger.debug(
+            "Looking up all photos%s from album %s...",
+            "" if skip_videos else " and videos",
+            album_name)
+
+        photos.exception_handler = photos_exception_handler
+        photos.page_size = page_size
+
+        sync_cursor = None
+        if incremental and not rebuild_manifest:
+            if supports_cursor(photos):
+                sync_cursor = SyncCursor(download_manifest, album_name)
+                photos = sync_cursor.photos_since(photos)
+            else:
+                logger.info(
+                    "Album %s is not sorted by the date photos were added, "
+                    "so all photos will be looked up.", album_name)
+
+        # The number of photos since the last run is not known in advance
+        photos_count = len(photos) if sync_cursor is None else None
+
+        # Optional: Only download the x most recent photos.
+        if recent is not None:
+            photos_count = recent
+            photos = itertools.islice(photos, recent)
+
+        tqdm_kwargs = {"total": photos_count}
+
+        if until_found is not None or photos_count is None:
+            del tqdm_kwargs["total"]
+            photos_count = "???"
+            # ensure photos iterator doesn't have a known length
+            photos = (p for p in photos)
+
+        if download_manifest is not None and len(album_names) == 1 and not (
+                only_print_filenames or rebuild_manifest or backfill_exif_dates):
+            # Downloads that failed in earlier runs are looked up by their
+            # record ID and retried before the listing, so they don't
+            # depend on --recent or --until-found getting to them again.
+            photos = retry_failed_first(download_manifest, icloud.photos, photos)
+
+        # Only the fields that are used below are kept for each photo,
+        # so the queues further down don't hold on to the CloudKit records.
+        photos = compact_records(photos, photo_record_error)
+
+        prefetcher = None
+        if prefetch_pages:
+            # The exception handler above re-authenticates from the
+            # prefetch thread, and raises its errors in this thread.
+            prefetcher = PrefetchIterator(photos, prefetch_pages * page_size)
+            photos = prefetcher
+
+        plural_suffix = "" if photos_count == 1 else "s"
+        video_suffix = ""
+        photos_count_str = "the first" if photos_count == 1 else photos_count
+        if not skip_videos:
+            video_suffix = " or video" if photos_count == 1 else " and videos"
+        logger.info(
+            "Downloading %s %s photo%s%s to %s/ ...",
+            photos_count_str,
+            size,
+            plural_suffix,
+            video_suffix,
+            album_dir,
+        )
 
-    # Skip the one-line progress bar if we're only printing the filenames,
-    # or if the progress bar is explicity disabled,
-    # or if this is not a terminal (e.g. cron or piping output to file)
-    if not os.environ.get("FORCE_TQDM") and (
-            only_print_filenames or no_progress_bar or not sys.stdout.isatty()
-    ):
-        photos_enumerator = photos
-        logger.set_tqdm(None)
-    else:
-        photos_enumerator = tqdm(photos, **tqdm_kwargs)
-        logger.set_tqdm(photos_enumerator)
+        # The dates, folders and paths are worked out a page at a time
+        photos = plan_pages(
+            PathPlanner(album_dir, folder_structure, size, force_size),
+            photos, page_size)
+
+        # Use only ASCII characters in progress bar
+        tqdm_kwargs["ascii"] = True
+
+        # Skip the one-line progress bar if we're only printing the filenames,
+        # or if the progress bar is explicity disabled,
+        # or if this is not a terminal (e.g. cron or piping output to file)
+        if not os.environ.get("FORCE_TQDM") and (
+                only_print_filenames or no_progress_bar or not sys.stdout.isatty()
+        ):
+            photos_enumerator = photos
+            logger.set_tqdm(None)
+        else:
+            photos_enumerator = tqdm(photos, **tqdm_kwargs)
+            logger.set_tqdm(photos_enumerator)
+        return photos_enumerator, sync_cursor, prefetcher
 
+    # The manifest is closed (and committed) even if the run dies,
+    # so the next run knows what has already been downloaded
     # pylint: disable-msg=too-many-nested-blocks
-    for photo in photos_enumerator:
-        for _ in range(constants.MAX_RETRIES):
-            if skip_videos and photo.item_type != "image":
-                logger.set_tqdm_description(
-                    "Skipping %s, only downloading photos." % photo.filename
-                )
-                break
-            if photo.item_type != "image" and photo.item_type != "movie":
-                logger.set_tqdm_description(
-                    "Skipping %s, only downloading photos and videos. "
-                    "(Item type was: %s)" % (photo.filename, photo.item_type)
-                )
-                break
-            try:
-                created_date = photo.created.astimezone(get_localzone())
-            except (ValueError, OSError):
-                logger.set_tqdm_description(
-                    "Could not convert photo created date to local timezone (%s)" %
-                    photo.created, logging.ERROR)
-                created_date = photo.created
-
-            try:
-                date_path = folder_structure.format(created_date)
-            except ValueError:  # pragma: no cover
-                # This error only seems to happen in Python 2
-                logger.set_tqdm_description(
-                    "Photo created date was not valid (%s)" %
-                    photo.created, logging.ERROR)
-                # e.g. ValueError: year=5 is before 1900
-                # (https://github.com/ndbroadbent/icloud_photos_downloader/issues/122)
-                # Just use the Unix epoch
-                created_date = datetime.datetime.fromtimestamp(0)
-                date_path = folder_structure.format(created_date)
-
-            download_dir = os.path.join(directory, date_path)
-
-            if not os.path.exists(download_dir):
-                os.makedirs(download_dir)
-
-            download_size = size
-
-            try:
-                versions = photo.versions
-            except KeyError as ex:
-                print(
-                    "KeyError: %s attribute was not found in the photo fields!" %
-                    ex)
-                with open('icloudpd-photo-error.json', 'w') as outfile:
-                    # pylint: disable=protected-access
-                    json.dump({
-                        "master_record": photo._master_record,
-                        "asset_record": photo._asset_record
-                    }, outfile)
-                    # pylint: enable=protected-access
-                print("icloudpd has saved the photo record to: "
-                      "./icloudpd-photo-error.json")
-                print("Please create a Gist with the contents of this file: "
-                      "https://gist.github.com")
-                print(
-                    "Then create an issue on GitHub: "
-                    "https://github.com/ndbroadbent/icloud_photos_downloader/issues")
-                print(
-                    "Include a link to the Gist in your issue, so that we can "
-                    "see what went wrong.\n")
-                break
-
-            if size not in versions and size != "original":
-                if force_size:
-                    filename = photo.filename.encode(
-                        "utf-8").decode("ascii", "ignore")
-                    logger.set_tqdm_description(
-                        "%s size does not exist for %s. Skipping..." %
-                        (size, filename), logging.ERROR, )
-                    break
-                download_size = "original"
-
-            download_path = local_download_path(
-                photo, download_size, download_dir)
-
-            file_exists = os.path.isfile(download_path)
-            if not file_exists and download_size == "original":
-                # Deprecation - We used to download files like IMG_1234-original.jpg,
-                # so we need to check for these.
-                # Now we match the behavior of iCloud for Windows: IMG_1234.jpg
-                original_download_path = ("-%s." % size).join(
-                    download_path.rsplit(".", 1)
-                )
-                file_exists = os.path.isfile(original_download_path)
-
-            if file_exists:
-                if until_found is not None:
-                    consecutive_files_found += 1
-                logger.set_tqdm_description(
-                    "%s already exists." % truncate_middle(download_path, 96)
-                )
-            else:
-                if until_found is not None:
-                    consecutive_files_found = 0
-
-                if only_print_filenames:
-                    print(download_path)
-                else:
-                    truncated_path = truncate_middle(download_path, 96)
-                    logger.set_tqdm_description(
-                        "Downloading %s" %
-                        truncated_path)
-
-                    download_result = download.download_media(
-                        icloud, photo, download_path, download_size
-                    )
-
-                    if download_result and set_exif_datetime:
-                        if photo.filename.lower().endswith((".jpg", ".jpeg")):
-                            if not exif_datetime.get_photo_exif(download_path):
-                                # %Y:%m:%d looks wrong but it's the correct format
-                                date_str = created_date.strftime(
-                                    "%Y:%m:%d %H:%M:%S")
-                                logger.debug(
-                                    "Setting EXIF timestamp for %s: %s",
-                                    download_path,
-                                    date_str,
-                                )
-                                exif_datetime.set_photo_exif(
-                                    download_path,
-                                    created_date.strftime("%Y:%m:%d %H:%M:%S"),
-                                )
-                        else:
-                            timestamp = time.mktime(created_date.timetuple())
-                            os.utime(download_path, (timestamp, timestamp))
-
-            # Also download the live photo if present
-            if not skip_live_photos:
-                lp_size = live_photo_size + "Video"
-                if lp_size in photo.versions:
-                    version = photo.versions[lp_size]
-                    filename = version["filename"]
-                    if live_photo_size != "original":
-                        # Add size to filename if not original
-                        filename = filename.replace(
-                            ".MOV", "-%s.MOV" %
-                            live_photo_size)
-                    lp_download_path = os.path.join(download_dir, filename)
-
-                    if only_print_filenames:
-                        print(lp_download_path)
-                    else:
-                        if os.path.isfile(lp_download_path):
-                            logger.set_tqdm_description(
-                                "%s already exists."
-                                % truncate_middle(lp_download_path, 96)
-                            )
-                            break
-
-                        truncated_path = truncate_middle(lp_download_path, 96)
+    try:
+        sync_cursors = []
+        for album_name in album_names:
+            album_dir = album_directory(album_name)
+            photos_enumerator, sync_cursor, prefetcher = list_album(
+                album_name, album_dir)
+            if sync_cursor is not None:
+                sync_cursors.append(sync_cursor)
+            consecutive_files_found = 0
+
+            for download_plan in photos_enumerator:
+                photo = download_plan.record
+                submit_due_retries()
+                for _ in range(constants.MAX_RETRIES):
+                    if skip_videos and photo.item_type != "image":
+                        logger.set_tqdm_description(
+                            "Skipping %s, only downloading photos." % photo.filename
+                        )
+                        break
+                    if photo.item_type != "image" and photo.item_type != "movie":
                         logger.set_tqdm_description(
-                            "Downloading %s" % truncated_path)
-                        download.download_media(
-                            icloud, photo, lp_download_path, lp_size
+                            "Skipping %s, only downloading photos and videos. "
+                            "(Item type was: %s)" % (photo.filename, photo.item_type)
                         )
+                        break
+                    created_date = download_plan.created_date
+                    download_dir = download_plan.download_dir
+                    download_size = download_plan.size
+                    download_path = download_plan.download_path
 
-            break
+                    local_downloads.makedirs(download_dir)
 
-        if until_found is not None and consecutive_files_found >= until_found:
-            logger.tqdm_write(
-                "Found %d consecutive previously downloaded photos. Exiting"
-                % until_found
-            )
-            if hasattr(photos_enumerator, "close"):
-                photos_enumerator.close()
-            break
+                    if download_size is None:
+                        filename = photo.filename.encode(
+                            "utf-8").decode("ascii", "ignore")
+                        logger.set_tqdm_description(
+                            "%s size does not exist for %s. Skipping..." %
+                            (size, filename), logging.ERROR, )
+                        break
+
+                    if local_downloads.path_owner(download_path) not in (
+                            None, photo.id):
+                        # Another asset with the same filename has already
+                        # been downloaded to this folder
+                        download_path = unique_local_download_path(
+                            photo, download_size, download_dir)
+
+                    legacy_download_path = None
+                    if download_size == "original":
+                        # Deprecation - We used to download files like IMG_1234-original.jpg,
+                        # so we need to check for these.
+                        # Now we match the behavior of iCloud for Windows: IMG_1234.jpg
+                        legacy_download_path = ("-%s." % size).join(
+                            download_path.rsplit(".", 1)
+                        )
+                    existing_path = local_downloads.find(
+                        photo, download_size, download_path, legacy_download_path,
+                        album_dir)
+                    file_exists = existing_path is not None
+
+                    if file_exists:
+                        download_path = existing_path
+                        if album_linker is not None:
+                            album_linker.add_copy(
+                                photo.id, download_size, download_path)
+                        if until_found is not None:
+                            consecutive_files_found += 1
+                        logger.set_tqdm_description(
+                            "%s already exists." % truncate_middle(download_path, 96)
+                        )
+                        if backfill_exif_dates and \
+                                download_path.lower().endswith((".jpg", ".jpeg")):
+                            backfill_tasks.append((
+                                download_path,
+                                created_date.strftime("%Y:%m:%d %H:%M:%S")))
+                    else:
+                        if until_found is not None:
+                            consecutive_files_found = 0
+
+                        copy_path = None
+                        if album_linker is not None:
+                            copy_path = album_linker.copy_of(
+                                photo.id, download_size, download_path)
+                        if only_print_filenames:
+                            print(download_path)
+                        elif not (rebuild_manifest or backfill_exif_dates):
+                            local_downloads.reserve_path(
+                                download_path, photo.id)
+                            if copy_path is not None:
+                                album_linker.defer_link(
+                                    photo.id, download_size, copy_path,
+                                    download_path)
+                            else:
+                                local_downloads.in_flight.add(download_path)
+                                pool.submit(
+                                    download_photo,
+                                    photo,
+                                    download_path,
+                                    download_size,
+                                    created_date,
+                                    download_plan.mtime)
+
+                    # Also download the live photo if present
+                    if not skip_live_photos:
+                        lp_size = live_photo_size + "Video"
+                        if lp_size in photo.versions:
+                            filename = photo.versions[lp_size].filename
+                            if live_photo_size != "original":
+                                # Add size to filename if not original
+                                filename = filename.replace(
+                                    ".MOV", "-%s.MOV" %
+                                    live_photo_size)
+                            lp_download_path = os.path.join(download_dir, filename)
+
+                            if only_print_filenames:
+                                print(lp_download_path)
+                            else:
+                                lp_existing_path = local_downloads.find(
+                                    photo, lp_size, lp_download_path,
+                                    album_dir=album_dir)
+                                if lp_existing_path is not None:
+                                    logger.set_tqdm_description(
+                                        "%s already exists."
+                                        % truncate_middle(lp_existing_path, 96)
+                                    )
+                                    if album_linker is not None:
+                                        album_linker.add_copy(
+                                            photo.id, lp_size, lp_existing_path)
+                                    break
+
+                                if rebuild_manifest or backfill_exif_dates:
+                                    break
+
+                                lp_copy_path = None
+                                if album_linker is not None:
+                                    lp_copy_path = album_linker.copy_of(
+                                        photo.id, lp_size, lp_download_path)
+                                if lp_copy_path is not None:
+                                    album_linker.defer_link(
+                                        photo.id, lp_size, lp_copy_path,
+                                        lp_download_path)
+                                    break
+
+                                local_downloads.in_flight.add(lp_download_path)
+                                pool.submit(
+                                    download_live_photo,
+                                    photo,
+                                    lp_download_path,
+                                    lp_size,
+                                    download_plan.mtime)
 
-    if only_print_filenames:
-        exit(0)
+                    break
 
-    logger.info("All photos have been downloaded!")
+                if until_found is not None and consecutive_files_found >= until_found:
+                    logger.tqdm_write(
+                        "Found %d consecutive previously downloaded photos. Exiting"
+                        % until_found
+                    )
+                    if hasattr(photos_enumerator, "close"):
+                        photos_enumerator.close()
+                    break
 
-    if auto_delete:
-        autodelete_photos(icloud, folder_structure, directory)
+            if prefetcher is not None:
+                prefetcher.close()
+
+        # Wait for the downloads that are still running
+        pool.join()
+
+        # Retry the failed downloads when their backoff delay is over
+        while retry_queue:
+            delay = retry_queue.next_delay()
+            if delay > 0:
+                time.sleep(delay)
+            pool = WorkerPool(threads_num)
+            submit_due_retries()
+            pool.join()
+
+        linked = 0
+        if album_linker is not None:
+            linked, link_failures = album_linker.link_all()
+            failed_downloads.extend(link_failures)
+
+        if concurrency is not None:
+            stats = concurrency.stats()
+            logger.log(
+                logging.INFO if stats["decreases"] else logging.DEBUG,
+                "Download concurrency: %d of %d (lowest %d, reduced %d times)",
+                stats["window"], stats["max_window"], stats["lowest_window"],
+                stats["decreases"])
+
+        if sync_cursors and not only_print_filenames:
+            if failed_downloads:
+                # Keep the old cursor, so the next run gets to these photos again
+                logger.info(
+                    "%d downloads failed, not updating the sync cursor.",
+                    len(failed_downloads))
+            else:
+                for sync_cursor in sync_cursors:
+                    sync_cursor.save()
+
+        if rebuild_manifest:
+            logger.info(
+                "Rebuilt the manifest with %d downloaded files.",
+                len(download_manifest))
+
+        if backfill_exif_dates:
+            logger.info(
+                "Setting EXIF dates on %d downloaded photos...",
+                len(backfill_tasks))
+            changed = backfill_exif(
+                backfill_tasks,
+                processes=threads_num,
+                progress_bar=logger.tqdm is not None)
+            logger.info("Set the EXIF date on %d photos.", changed)
+
+        if only_print_filenames or rebuild_manifest or backfill_exif_dates:
+            exit(0)
+
+        logger.info("All photos have been downloaded!")
+
+        if auto_delete or auto_delete_dry_run:
+            autodelete_photos(
+                icloud,
+                folder_structure,
+                directory,
+                download_manifest=download_manifest,
+                file_index=file_index,
+                threads_num=threads_num,
+                dry_run=auto_delete_dry_run)
+
+        # Only used when main is invoked with standalone_mode=False
+        # (see accounts.py)
+        return {
+            "downloaded": len(downloaded_files),
+            "linked": linked,
+            "failed": len(failed_downloads),
+        }
+    finally:
+        if download_manifest is not None:
+            download_manifest.close()
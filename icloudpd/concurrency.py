@@ -0,0 +1,108 @@
+"""Adapts the number of concurrent downloads to how the server is coping"""
+
+import threading
+from icloudpd.logger import setup_logger
+
+
+class DownloadSlot(object):  # pylint: disable-msg=too-few-public-methods
+    """A permit to run one download request, returned by AdaptiveConcurrency.acquire"""
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+        self.released = False
+
+
+class AdaptiveConcurrency(object):  # pylint: disable-msg=too-many-instance-attributes
+    """
+    AIMD (additive increase, multiplicative decrease) limit on the
+    number of downloads that run at the same time.
+
+    The window starts at initial_window, and can grow up to max_window
+    (the --threads-num workers). Each healthy download adds 1/window to
+    the window, so it grows by about one download per round trip of the
+    whole window. A download is healthy if its response came back within
+    latency_factor times the fastest response seen so far. Throttling responses (429, 503)
+    and timeouts halve the window, at most once for all the downloads
+    that were already running when it was cut.
+    Other errors don't change the window.
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(self, max_window, min_window=1, latency_factor=4.0,
+                 initial_window=2):
+        self.max_window = max(max_window, 1)
+        self.min_window = max(min(min_window, self.max_window), 1)
+        self.latency_factor = latency_factor
+        self.window = float(
+            min(max(initial_window, self.min_window), self.max_window))
+        self.lowest_window = self.limit
+        self.in_flight = 0
+        self.decreases = 0
+        self.min_latency = None
+        self._sequence = 0
+        self._cut_sequence = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        """The current number of downloads that can run at the same time"""
+        return int(self.window)
+
+    def acquire(self):
+        """Wait until the window has room for another download"""
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+            self._sequence += 1
+            return DownloadSlot(self._sequence)
+
+    def release(self, slot):
+        """Give back a slot. Does nothing if it was already released"""
+        with self._cond:
+            if slot.released:
+                return
+            slot.released = True
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def succeeded(self, slot, latency):
+        """A download request succeeded after latency seconds"""
+        with self._cond:
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            if latency <= self.min_latency * self.latency_factor:
+                old_limit = self.limit
+                self.window = min(
+                    self.window + 1.0 / self.window, self.max_window)
+                if self.limit != old_limit:
+                    setup_logger().debug(
+                        "Increasing download concurrency to %d", self.limit)
+                    self._cond.notify_all()
+        self.release(slot)
+
+    def throttled(self, slot):
+        """The server throttled a download request, or it timed out"""
+        with self._cond:
+            if slot.sequence > self._cut_sequence:
+                # Only cut once for the downloads that were started
+                # before the last cut, as they all saw the same congestion.
+                self._cut_sequence = self._sequence
+                self.window = max(self.window / 2, self.min_window)
+                self.lowest_window = min(self.lowest_window, self.limit)
+                self.decreases += 1
+                setup_logger().info(
+                    "Server is throttling downloads, "
+                    "reducing download concurrency to %d", self.limit)
+        self.release(slot)
+
+    def stats(self):
+        """Returns the current window and counters, for logging or metrics"""
+        with self._cond:
+            return {
+                "window": self.limit,
+                "max_window": self.max_window,
+                "lowest_window": self.lowest_window,
+                "in_flight": self.in_flight,
+                "decreases": self.decreases,
+            }
@@ -0,0 +1,52 @@
+"""Connection pooling for the iCloud session"""
+
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+
+# Hosts that photos and videos are downloaded from
+ICLOUD_CONTENT_HOSTS = [
+    "https://cvws.icloud-content.com/",
+]
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that keeps up to pool_size connections alive per host,
+    and applies a default timeout to every request that doesn't set one.
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["timeout"]
+
+    def __init__(self, pool_size=DEFAULT_POOLSIZE, timeout=None, **kwargs):
+        self.timeout = timeout
+        HTTPAdapter.__init__(
+            self,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            **kwargs)
+
+    def send(self, request, **kwargs):  # pylint: disable-msg=arguments-differ
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return HTTPAdapter.send(self, request, **kwargs)
+
+
+def configure_session(session, pool_size, timeout=None,
+                      content_hosts=None):
+    """
+    Mount pooled adapters on the session, so that parallel and
+    back-to-back downloads reuse their TLS connections instead of
+    opening (and handshaking) a new connection for every file.
+    Returns the adapter used for the content hosts.
+    """
+    pool_size = max(pool_size, DEFAULT_POOLSIZE)
+    if content_hosts is None:
+        content_hosts = ICLOUD_CONTENT_HOSTS
+
+    content_adapter = PooledHTTPAdapter(pool_size, timeout)
+    for host in content_hosts:
+        session.mount(host, content_adapter)
+
+    # Any other host (e.g. the CloudKit listing endpoints) still needs
+    # a pool that's large enough for the download threads.
+    session.mount("https://", PooledHTTPAdapter(pool_size))
+    return content_adapter
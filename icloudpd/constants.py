@@ -3,3 +3,12 @@
 # For retrying connection after timeouts and errors
 MAX_RETRIES = 5
 WAIT_SECONDS = 5
+
+# Read sizes used when streaming downloads to disk.
+# Reads start small and grow while the connection keeps the buffer full.
+DOWNLOAD_MIN_READ_SIZE = 64 * 1024
+DOWNLOAD_MAX_READ_SIZE = 4 * 1024 * 1024
+
+# Number of byte ranges that large files are split into with
+# --segmented-download-threshold
+DOWNLOAD_SEGMENTS = 4
@@ -1,27 +1,40 @@
 """Handles file downloads with retries and error handling"""
 
 import os
-import socket
+import threading
 import time
 import logging
 from tzlocal import get_localzone
 from requests.exceptions import ConnectionError  # pylint: disable=redefined-builtin
-from pyicloud_ipd.exceptions import PyiCloudAPIResponseError
+from requests.exceptions import ChunkedEncodingError
 from icloudpd.logger import setup_logger
+from icloudpd.stream_writer import (
+    StreamDigest, file_sha256, preallocate, write_stream)
+from icloudpd.exif_datetime import ExifDateInjector
+from icloudpd.durability import replace_file
+from icloudpd.authentication import reauthenticate, session_generation
+from icloudpd.retry import (
+    RETRY_ERRORS, Downloaded, DownloadFailed, RetryLater, is_congestion_error,
+    is_session_error, policy_for)
 
 # Import the constants object so that we can mock WAIT_SECONDS in tests
 from icloudpd import constants
 
 
-def update_mtime(photo, download_path):
-    """Set the modification time of the downloaded file to the photo creation date"""
-    if photo.created:
+def update_mtime(photo, download_path, mtime=None):
+    """
+    Set the modification time of the downloaded file to the photo creation
+    date, or to mtime if it has already been worked out (see planner.py)
+    """
+    if mtime is not None:
+        os.utime(download_path, (mtime, mtime))
+    elif photo.created:
         created_date = None
         try:
             created_date = photo.created.astimezone(
                 get_localzone())
         except (ValueError, OSError):
-            # We already show the timezone conversion error in base.py,
+            # We already show the timezone conversion error in planner.py,
             # when generating the download directory.
             # So just return silently without touching the mtime.
             return
@@ -29,49 +42,279 @@ def update_mtime(photo, download_path):
         os.utime(download_path, (ctime, ctime))
 
 
-def download_media(icloud, photo, download_path, size):
-    """Download the photo to path, with retries and error handling"""
+def temp_download_path(download_path):
+    """Returns the path of the partial file that is used while downloading"""
+    return download_path + ".part"
+
+
+def injected_download_path(download_path):
+    """
+    Returns the path of the partial file of a download that sets the EXIF
+    date. Its bytes don't match the remote file, so it is never resumed.
+    """
+    return download_path + ".exif-date.part"
+
+
+def discard_injected_download(download_path):
+    """Remove the partial file of a download that set the EXIF date"""
+    injected_path = injected_download_path(download_path)
+    if os.path.exists(injected_path):
+        os.remove(injected_path)
+
+
+def expected_file_size(photo, size):
+    """Returns the size of a photo version in bytes, or None if it is not known"""
+    try:
+        return int(photo.versions[size].size)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def rename_completed_download(temp_path, download_path, fsync_policy=None):
+    """
+    Move a completed partial file to its final name, after flushing it to
+    disk according to fsync_policy (see durability.FSYNC_POLICIES)
+    """
+    replace_file(temp_path, download_path, fsync_policy or "none")
+
+
+def partial_download_offset(photo, temp_path, size):
+    """
+    Returns the number of bytes of the partial file that can be resumed.
+    Returns 0 if the download has to start from the beginning.
+    """
+    if not os.path.isfile(temp_path):
+        return 0
+    offset = os.path.getsize(temp_path)
+    expected_size = expected_file_size(photo, size)
+    if expected_size is not None and offset >= expected_size:
+        # Can't tell if a partial file of the full size is complete,
+        # so just start again.
+        return 0
+    return offset
+
+
+def verify_size(digest, expected_size, download_path):
+    """Raise a ChunkedEncodingError (which is retried) if bytes are missing"""
+    if expected_size is not None and digest.received != expected_size:
+        raise ChunkedEncodingError(
+            "Received %d bytes for %s, expected %d bytes"
+            % (digest.received, download_path, expected_size))
+
+
+def segment_ranges(total_size, segments):
+    """Split total_size bytes into (start, end) byte ranges, end inclusive"""
+    segment_size = max(-(-total_size // segments), 1)
+    return [
+        (start, min(start + segment_size, total_size) - 1)
+        for start in range(0, total_size, segment_size)
+    ]
+
+
+def range_header(byte_range):
+    """Returns the Range header for a (start, end) byte range"""
+    return {"Range": "bytes=%d-%d" % byte_range}
+
+
+# pylint: disable-msg=too-many-arguments
+def download_segments(photo, size, temp_path, expected_size, segments,
+                      bandwidth=None):
+    """
+    Download a file as byte ranges at the same time, each on its own
+    connection, into a file that is preallocated to expected_size.
+    Used for new downloads of at least --segmented-download-threshold
+    bytes; resumed downloads and downloads that set the EXIF date are
+    always downloaded in one stream.
+
+    Returns False if the server doesn't support Range requests (or there
+    is no download URL), and the file has to be downloaded in one stream.
+    Raises a ChunkedEncodingError or ConnectionError if a range fails,
+    so that download_media retries the whole file.
+    """
+    ranges = segment_ranges(expected_size, segments)
+    # The first range tells us if the server supports Range requests
+    first_response = photo.download(size, headers=range_header(ranges[0]))
+    if not first_response:
+        return False
+    if first_response.status_code != 206:
+        first_response.close()
+        return False
+
+    with open(temp_path, "wb") as file_obj:
+        preallocate(file_obj, expected_size)
+        file_obj.truncate(expected_size)
+
+    errors = []
+
+    def download_range(byte_range, response=None):
+        """Write a byte range at its offset in the file"""
+        try:
+            if response is None:
+                response = photo.download(
+                    size, headers=range_header(byte_range))
+                if not response or response.status_code != 206:
+                    raise ConnectionError(
+                        "Range request for bytes %d-%d failed" % byte_range)
+            try:
+                with open(temp_path, "r+b") as file_obj:
+                    file_obj.seek(byte_range[0])
+                    written = write_stream(
+                        response, file_obj, truncate=False,
+                        bandwidth=bandwidth)
+            finally:
+                response.close()
+            expected = byte_range[1] - byte_range[0] + 1
+            if written != expected:
+                raise ChunkedEncodingError(
+                    "Received %d of %d bytes for bytes %d-%d"
+                    % ((written, expected) + byte_range))
+        except Exception as ex:  # pylint: disable-msg=broad-except
+            errors.append(ex)
+
+    threads = [
+        threading.Thread(
+            target=download_range, args=(byte_range,),
+            name="icloudpd-segment-%d" % i)
+        for i, byte_range in enumerate(ranges[1:], 1)
+    ]
+    for thread in threads:
+        thread.start()
+    download_range(ranges[0], first_response)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    # Verify that all the ranges add up to the whole file
+    actual_size = os.path.getsize(temp_path)
+    if actual_size != expected_size:
+        raise ChunkedEncodingError(
+            "Downloaded %d of %d bytes" % (actual_size, expected_size))
+    return True
+
+
+# pylint: disable-msg=too-many-arguments,too-many-branches,too-many-statements
+# pylint: disable-msg=too-many-locals
+def download_media(icloud, photo, download_path, size, exif_date=None,
+                   retries=0, defer_retries=False, concurrency=None,
+                   segment_threshold=None, segments=None, fsync_policy=None,
+                   mtime=None, bandwidth=None):
+    """
+    Download the photo to path, with retries and error handling.
+    Returns a Downloaded with the SHA-256 of the file, or a (falsy)
+    DownloadFailed. With defer_retries, a failed download returns a
+    RetryLater instead of sleeping before the next retry.
+    """
     logger = setup_logger()
+    temp_path = temp_download_path(download_path)
+    error = None
 
-    for retries in range(constants.MAX_RETRIES):
+    # A deferred download continues from the retry where it stopped
+    while retries < constants.MAX_RETRIES:
+        slot = concurrency.acquire() if concurrency is not None else None
+        generation = session_generation(icloud)
         try:
-            photo_response = photo.download(size)
+            discard_injected_download(download_path)
+            offset = partial_download_offset(photo, temp_path, size)
+            expected_size = expected_file_size(photo, size)
+            if segment_threshold is not None and not offset and \
+                    not exif_date and expected_size is not None and \
+                    expected_size >= segment_threshold:
+                logger.debug(
+                    "Downloading %s in %d segments",
+                    download_path, segments or constants.DOWNLOAD_SEGMENTS)
+                if download_segments(
+                        photo, size, temp_path, expected_size,
+                        segments or constants.DOWNLOAD_SEGMENTS, bandwidth):
+                    # The ranges were written out of order,
+                    # so the file has to be read back for the hash
+                    sha256 = file_sha256(temp_path)
+                    update_mtime(photo, temp_path, mtime)
+                    rename_completed_download(
+                        temp_path, download_path, fsync_policy)
+                    return Downloaded(sha256)
+            start = time.time()
+            if offset:
+                logger.debug(
+                    "Resuming download of %s from byte %d", download_path, offset)
+                photo_response = photo.download(
+                    size, headers={"Range": "bytes=%d-" % offset})
+            else:
+                photo_response = photo.download(size)
+            latency = time.time() - start
             if photo_response:
-                with open(download_path, "wb") as file_obj:
-                    for chunk in photo_response.iter_content(chunk_size=1024):
-                        if chunk:
-                            file_obj.write(chunk)
-                update_mtime(photo, download_path)
-                return True
+                if offset and photo_response.status_code != 206:
+                    # The server sent the whole file instead of the range
+                    offset = 0
+                injector = None
+                write_path = temp_path
+                if exif_date and not offset:
+                    injector = ExifDateInjector(exif_date)
+                    write_path = injected_download_path(download_path)
+                digest = StreamDigest()
+                try:
+                    with open(write_path, "r+b" if offset else "wb") as file_obj:
+                        if offset:
+                            # Only a resumed download reads from the disk
+                            digest.add_file(file_obj, offset)
+                        write_stream(
+                            photo_response,
+                            file_obj,
+                            expected_size,
+                            injector,
+                            digest=digest,
+                            bandwidth=bandwidth)
+                        verify_size(digest, expected_size, download_path)
+                finally:
+                    # Return the connection to the pool
+                    photo_response.close()
+                if slot is not None:
+                    concurrency.succeeded(slot, latency)
+                update_mtime(photo, write_path, mtime)
+                rename_completed_download(
+                    write_path, download_path, fsync_policy)
+                return Downloaded(digest.hexdigest())
 
             logger.tqdm_write(
                 "Could not find URL to download %s for size %s!"
                 % (photo.filename, size),
                 logging.ERROR,
             )
+            error = "No download URL for size %s" % size
             break
 
-        except (ConnectionError, socket.timeout, PyiCloudAPIResponseError) as ex:
-            if "Invalid global session" in str(ex):
+        except RETRY_ERRORS as ex:
+            error = ex
+            if slot is not None:
+                if is_congestion_error(ex):
+                    concurrency.throttled(slot)
+                else:
+                    concurrency.release(slot)
+            delay = policy_for(ex).delay(retries)
+            retries += 1
+            if is_session_error(ex):
                 logger.tqdm_write(
                     "Session error, re-authenticating...",
                     logging.ERROR)
-                if retries > 0:
+                if retries > 1:
                     # If the first reauthentication attempt failed,
                     # start waiting a few seconds before retrying in case
                     # there are some issues with the Apple servers
-                    time.sleep(constants.WAIT_SECONDS)
+                    time.sleep(delay)
 
-                icloud.authenticate()
-            else:
+                reauthenticate(icloud, generation)
+            elif retries < constants.MAX_RETRIES:
                 logger.tqdm_write(
                     "Error downloading %s, retrying after %d seconds..."
-                    % (photo.filename, constants.WAIT_SECONDS),
+                    % (photo.filename, delay),
                     logging.ERROR,
                 )
-                time.sleep(constants.WAIT_SECONDS)
+                if defer_retries:
+                    return RetryLater(delay, retries)
+                time.sleep(delay)
 
-        except IOError:
+        except IOError as ex:
+            error = ex
             logger.error(
                 "IOError while writing file to %s! "
                 "You might have run out of disk space, or the file "
@@ -79,9 +322,14 @@ def download_media(icloud, photo, download_path, size):
                 "Skipping this file...", download_path
             )
             break
+
+        finally:
+            if slot is not None:
+                concurrency.release(slot)
     else:
         logger.tqdm_write(
             "Could not download %s! Please try again later." % photo.filename
         )
 
-    return False
+    discard_injected_download(download_path)
+    return DownloadFailed(error)
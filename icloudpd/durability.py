@@ -0,0 +1,90 @@
+"""Write files atomically, with a configurable fsync policy"""
+
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows
+    fcntl = None
+
+# ioctl that clones a file's extents on Linux (btrfs, XFS)
+FICLONE = 0x40049409
+
+# none: rename only. A killed process never leaves a partial file at the
+#       final path, but a power loss can.
+# file: fsync the file before it is renamed into place.
+# full: also fsync the directory after the rename, so the new name is
+#       on disk when the download is recorded.
+FSYNC_POLICIES = ("none", "file", "full")
+
+
+def fsync_file(path):
+    """Flush a file's data to disk"""
+    with open(path, "rb+") as file_obj:
+        os.fsync(file_obj.fileno())
+
+
+def fsync_directory(path):
+    """Flush a directory entry to disk. Not possible on Windows"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        # E.g. some network filesystems
+        pass
+    finally:
+        os.close(fd)
+
+
+def replace_file(temp_path, path, fsync_policy="none"):
+    """
+    Move a complete temporary file to path, which is replaced if it exists.
+    temp_path must be in the same directory, so the rename is atomic.
+    """
+    if fsync_policy in ("file", "full"):
+        fsync_file(temp_path)
+    # os.replace is not available in Python 2.7
+    replace = getattr(os, "replace", os.rename)
+    replace(temp_path, path)
+    if fsync_policy == "full":
+        fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def reflink(source, path):
+    """Copy source to path by sharing its blocks. Raises OSError/IOError"""
+    if fcntl is None:
+        raise OSError("Reflinks are not supported")
+    with open(source, "rb") as source_obj:
+        with open(path, "wb") as file_obj:
+            fcntl.ioctl(file_obj.fileno(), FICLONE, source_obj.fileno())
+
+
+def link_file(source, path, fsync_policy="none"):
+    """
+    Make path the same file as source, without downloading it again.
+    Tries a hard link, then a reflink, and copies the file if neither is
+    possible (e.g. on another filesystem). Returns "hardlink", "reflink"
+    or "copy".
+    """
+    try:
+        os.link(source, path)
+        if fsync_policy == "full":
+            fsync_directory(os.path.dirname(os.path.abspath(path)))
+        return "hardlink"
+    except (AttributeError, OSError):
+        # AttributeError: no os.link on Windows with Python 2.7
+        pass
+    temp_path = path + ".part"
+    try:
+        reflink(source, temp_path)
+        shutil.copystat(source, temp_path)
+        method = "reflink"
+    except (IOError, OSError):
+        shutil.copy2(source, temp_path)
+        method = "copy"
+    replace_file(temp_path, path, fsync_policy)
+    return method
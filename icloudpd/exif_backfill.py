@@ -0,0 +1,49 @@
+"""Set EXIF dates on photos that were downloaded without --set-exif-datetime"""
+
+import os
+import multiprocessing
+from tqdm import tqdm
+from icloudpd.exif_datetime import get_photo_exif, set_photo_exif
+
+# Number of photos that are sent to a worker process at a time
+CHUNK_SIZE = 16
+
+
+def backfill_photo(task):
+    """
+    Set the EXIF date on a photo, unless it already has one.
+    Keeps the modification time of the file.
+    Returns True if the EXIF date was set.
+    """
+    path, date = task
+    try:
+        if get_photo_exif(path):
+            return False
+        stat = os.stat(path)
+        set_photo_exif(path, date)
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+    except (IOError, OSError):
+        return False
+    return get_photo_exif(path) is not None
+
+
+def backfill_exif(tasks, processes=1, progress_bar=False):
+    """
+    Set the EXIF date for each (path, date) task, in a pool of processes.
+    Photos that already have a date are skipped, so an interrupted
+    backfill can be run again. Returns the number of photos that were changed.
+    """
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(backfill_photo, tasks, CHUNK_SIZE)
+    else:
+        pool = None
+        results = (backfill_photo(task) for task in tasks)
+    if progress_bar:
+        results = tqdm(results, total=len(tasks), ascii=True)
+    try:
+        return sum(1 for changed in results if changed)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
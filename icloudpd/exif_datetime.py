@@ -1,31 +1,212 @@
 """Get/set EXIF dates from photos"""
 
+import os
+import struct
 import piexif
 from piexif._exceptions import InvalidImageDataError
 from icloudpd.logger import setup_logger
+from icloudpd.durability import replace_file
+
+
+# JPEG markers
+SOI = b"\xff\xd8"
+APP1 = 0xE1
+SOS = 0xDA
+EOI = 0xD9
+EXIF_HEADER = b"Exif\x00\x00"
+
+
+def read_exif_segment(file_obj):
+    """
+    Reads the marker segments at the start of a JPEG, up to the first SOS
+    (start of scan). Returns the data of the APP1 EXIF segment, or b"" if
+    there is none. Returns None if the file is not a JPEG.
+
+    Only the headers are read, not the compressed image data, so this
+    usually reads a few KB instead of the whole file.
+    """
+    if file_obj.read(2) != SOI:
+        return None
+    while True:
+        header = bytearray(file_obj.read(2))
+        # Markers can be padded with any number of 0xFF bytes
+        while len(header) == 2 and header[0] == 0xFF and header[1] == 0xFF:
+            header = header[1:] + bytearray(file_obj.read(1))
+        if len(header) < 2 or header[0] != 0xFF:
+            return b""
+        marker = header[1]
+        if marker in (SOS, EOI):
+            return b""
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # Markers without a length
+            continue
+        length_bytes = file_obj.read(2)
+        if len(length_bytes) < 2:
+            return b""
+        length = struct.unpack(">H", length_bytes)[0]
+        if length < 2:
+            return b""
+        if marker == APP1:
+            data = file_obj.read(length - 2)
+            if data.startswith(EXIF_HEADER):
+                return data
+        else:
+            file_obj.seek(length - 2, 1)
+
+
+def load_exif(path):
+    """
+    Returns the piexif dict for a photo. For JPEGs, only the EXIF segment
+    is read from disk.
+    """
+    with open(path, "rb") as file_obj:
+        exif_data = read_exif_segment(file_obj)
+    if exif_data is None:
+        # Not a JPEG, let piexif handle it (e.g. TIFF)
+        return piexif.load(path)
+    if not exif_data:
+        return {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {},
+                "1st": {}, "thumbnail": None}
+    return piexif.load(exif_data)
 
 
 def get_photo_exif(path):
     """Get EXIF date for a photo, return nothing if there is an error"""
     try:
-        exif_dict = piexif.load(path)
+        exif_dict = load_exif(path)
         return exif_dict.get("Exif").get(36867)
-    except (ValueError, InvalidImageDataError):
+    except (ValueError, InvalidImageDataError, struct.error):
         logger = setup_logger()
         logger.debug("Error fetching EXIF data for %s", path)
         return None
 
 
-def set_photo_exif(path, date):
-    """Set EXIF date on a photo, do nothing if there is an error"""
+def set_exif_dates(exif_dict, date):
+    """Set the DateTime tags in a piexif dict"""
+    exif_dict.get("1st")[306] = date
+    exif_dict.get("Exif")[36867] = date
+    exif_dict.get("Exif")[36868] = date
+
+
+def set_photo_exif(path, date, fsync_policy="none"):
+    """
+    Set EXIF date on a photo, do nothing if there is an error.
+    The photo is written to a temporary file that replaces it when it is
+    complete, so the photo is never left half written.
+    """
+    temp_path = path + ".exif.part"
     try:
         exif_dict = piexif.load(path)
-        exif_dict.get("1st")[306] = date
-        exif_dict.get("Exif")[36867] = date
-        exif_dict.get("Exif")[36868] = date
+        set_exif_dates(exif_dict, date)
         exif_bytes = piexif.dump(exif_dict)
-        piexif.insert(exif_bytes, path)
+        piexif.insert(exif_bytes, path, temp_path)
+        replace_file(temp_path, path, fsync_policy)
     except (ValueError, InvalidImageDataError):
         logger = setup_logger()
         logger.debug("Error setting EXIF data for %s", path)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
         return
+
+
+# Give up if the APPn segments at the start of the file are larger than this
+MAX_HEADER_SIZE = 1024 * 1024
+
+
+class ExifDateInjector(object):
+    """
+    Sets the EXIF date on a JPEG while it is being downloaded.
+
+    The bytes of the download are passed through feed(). The marker segments
+    at the start of the file are buffered until the APP1 EXIF segment
+    (or the first segment after the APPn segments) has arrived. If the EXIF
+    data has no DateTimeOriginal, the dates are added (or a new EXIF segment
+    is inserted), and the rest of the file is passed through unchanged.
+    This writes the same tags as set_photo_exif, without reading the file
+    back and writing it again.
+
+    The file is passed through unchanged if it's not a JPEG, if the EXIF
+    data can't be parsed, or if it already has a DateTimeOriginal.
+    """
+
+    def __init__(self, date):
+        self.date = date
+        self.injected = False
+        self._buffer = bytearray()
+        self._done = False
+
+    def feed(self, data):
+        """Returns the bytes that should be written for data"""
+        if self._done:
+            return data
+        self._buffer.extend(data)
+        return self._process()
+
+    def finish(self):
+        """Returns any buffered bytes at the end of the download"""
+        self._done = True
+        data = bytes(self._buffer)
+        self._buffer = bytearray()
+        return data
+
+    def _pass_through(self):
+        return self.finish()
+
+    def _process(self):  # pylint: disable-msg=too-many-return-statements
+        buf = self._buffer
+        if len(buf) < 2:
+            return b""
+        if buf[0:2] != SOI:
+            return self._pass_through()
+        pos = 2
+        while True:
+            if pos > MAX_HEADER_SIZE:
+                return self._pass_through()
+            if len(buf) < pos + 4:
+                return b""
+            if buf[pos] != 0xFF:
+                return self._pass_through()
+            marker = buf[pos + 1]
+            if not 0xE0 <= marker <= 0xEF:
+                # No EXIF segment before the image data, so insert one here
+                return self._replace(pos, pos, None)
+            length = struct.unpack(">H", bytes(buf[pos + 2:pos + 4]))[0]
+            end = pos + 2 + length
+            if marker == APP1 and buf[pos + 4:pos + 10] == EXIF_HEADER:
+                if len(buf) < end:
+                    return b""
+                return self._replace(pos, end, bytes(buf[pos + 4:end]))
+            pos = end
+
+    def _replace(self, start, end, exif_data):
+        """Replace buf[start:end] with an EXIF segment that has the dates"""
+        segment = self._exif_segment(exif_data)
+        if segment is None:
+            return self._pass_through()
+        buf = self._buffer
+        data = bytes(buf[:start]) + segment + bytes(buf[end:])
+        self.injected = True
+        self._done = True
+        self._buffer = bytearray()
+        return data
+
+    def _exif_segment(self, exif_data):
+        """Returns the new APP1 segment, or None to leave the file as it is"""
+        try:
+            if exif_data is None:
+                exif_dict = {
+                    "0th": {}, "Exif": {}, "GPS": {}, "Interop": {},
+                    "1st": {}, "thumbnail": None}
+            else:
+                exif_dict = piexif.load(exif_data)
+                if exif_dict.get("Exif").get(36867):
+                    return None
+            set_exif_dates(exif_dict, self.date)
+            exif_bytes = piexif.dump(exif_dict)
+        except (ValueError, InvalidImageDataError, struct.error):
+            logger = setup_logger()
+            logger.debug("Error setting EXIF data while downloading")
+            return None
+        if len(exif_bytes) + 2 > 0xFFFF:
+            return None
+        return b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
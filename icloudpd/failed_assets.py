@@ -0,0 +1,119 @@
+"""Look up the photos that failed to download in earlier runs, so they are retried first"""
+
+import json
+from pyicloud_ipd.services.photos import PhotoAsset
+from pyicloud_ipd.exceptions import PyiCloudAPIResponseError
+from requests.exceptions import RequestException
+from icloudpd.logger import setup_logger
+
+try:
+    from urllib.parse import urlencode
+except ImportError:  # pragma: no cover
+    # Python 2.7
+    from urllib import urlencode
+
+# Number of photos that are looked up in a single request
+LOOKUP_BATCH_SIZE = 100
+
+
+def lookup_request(photos_service, record_names):
+    """Fetch CloudKit records by name (records/lookup)"""
+    # pylint: disable=protected-access
+    url = ("%s/records/lookup?" % photos_service._service_endpoint) + \
+        urlencode(photos_service.params)
+    # pylint: enable=protected-access
+    response = photos_service.session.post(
+        url,
+        data=json.dumps({
+            "records": [{"recordName": name} for name in record_names],
+            "zoneID": {"zoneName": "PrimarySync"},
+        }),
+        headers={"Content-type": "text/plain"})
+    return response.json().get("records", [])
+
+
+def lookup_records(photos_service, record_names):
+    """
+    Fetch CloudKit records by name. Returns (master_records, asset_records),
+    the CPLMaster and CPLAsset records keyed by record name.
+    """
+    master_records = {}
+    asset_records = {}
+    for record in lookup_request(photos_service, record_names):
+        if record.get("recordType") == "CPLMaster":
+            master_records[record["recordName"]] = record
+        elif record.get("recordType") == "CPLAsset":
+            asset_records[record["recordName"]] = record
+    return master_records, asset_records
+
+
+def lookup_photos(photos_service, failures):
+    """
+    Returns (photos, missing_record_ids) for the failed_assets rows of
+    the manifest. The photos are fetched by record ID, so they come with
+    fresh download URLs. Photos that were deleted from iCloud (or that
+    were stored without an asset record ID) are returned as missing.
+    """
+    # A record can have failed for more than one version
+    record_ids = []
+    asset_ids = {}
+    missing = set()
+    for failure in failures:
+        record_id = failure["record_id"]
+        if failure["asset_record_id"] is None:
+            missing.add(record_id)
+        elif record_id not in asset_ids:
+            record_ids.append(record_id)
+            asset_ids[record_id] = failure["asset_record_id"]
+    record_ids = [
+        record_id for record_id in record_ids if record_id not in missing]
+
+    photos = []
+    for start in range(0, len(record_ids), LOOKUP_BATCH_SIZE):
+        batch = record_ids[start:start + LOOKUP_BATCH_SIZE]
+        master_records, asset_records = lookup_records(
+            photos_service,
+            batch + [asset_ids[record_id] for record_id in batch])
+        for record_id in batch:
+            master_record = master_records.get(record_id)
+            asset_record = asset_records.get(asset_ids[record_id])
+            if master_record is None or asset_record is None or \
+                    asset_record.get("fields", {}).get(
+                        "isDeleted", {}).get("value"):
+                missing.add(record_id)
+                continue
+            photos.append(
+                PhotoAsset(photos_service, master_record, asset_record))
+    return photos, missing
+
+
+def retry_failed_first(download_manifest, photos_service, photos):
+    """
+    Yields the photos that failed to download in earlier runs, and then
+    the other photos. Photos that are retried are not yielded again.
+    """
+    logger = setup_logger()
+    failures = download_manifest.failed_assets()
+    failed_photos = []
+    if failures:
+        logger.info(
+            "Retrying %d downloads that failed in earlier runs...",
+            len(failures))
+        try:
+            failed_photos, missing = lookup_photos(photos_service, failures)
+        except (PyiCloudAPIResponseError, RequestException, ValueError) as ex:
+            logger.error("Could not look up the failed downloads: %s", ex)
+        else:
+            for record_id in missing:
+                logger.debug(
+                    "%s is not in iCloud any more, not retrying it.",
+                    record_id)
+                download_manifest.remove_failure(record_id)
+
+    retried_ids = set()
+    for photo in failed_photos:
+        retried_ids.add(photo.id)
+        yield photo
+    for photo in photos:
+        if photo.id not in retried_ids:
+            yield photo
@@ -0,0 +1,102 @@
+"""Keeps track of the files that have already been downloaded"""
+
+import os
+from icloudpd import download
+from icloudpd.manifest import remote_checksum
+
+
+class LocalDownloads(object):
+    """
+    The downloads in a directory: the manifest (if there is one), the
+    index of the files from --prescan (or else the filesystem), and the
+    downloads that are still running.
+
+    Paths in the manifest are relative to the download directory,
+    so the directory can be moved or mounted somewhere else.
+    While the manifest is rebuilt, existing files are only found on disk.
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(self, directory, download_manifest=None, file_index=None,
+                 rebuild_manifest=False, album_linker=None):
+        self.directory = directory
+        self.manifest = download_manifest
+        self.file_index = file_index
+        self.rebuild_manifest = rebuild_manifest
+        self.album_linker = album_linker
+        # Paths that a worker is downloading to (or will retry). The final
+        # file isn't there until the download completes, so this is what
+        # stops two photos with the same path from writing the same
+        # partial file.
+        self.in_flight = set()
+
+    def manifest_path(self, path):
+        """Returns the path that is stored in the manifest"""
+        return os.path.relpath(path, self.directory)
+
+    def file_exists(self, path):
+        """Checks the pre-scanned index, or the filesystem"""
+        if self.file_index is not None:
+            return self.file_index.isfile(path)
+        return os.path.isfile(path)
+
+    def makedirs(self, download_dir):
+        """Create the folder for a photo, unless it already exists"""
+        if self.file_index is not None:
+            self.file_index.makedirs(download_dir)
+        elif not os.path.exists(download_dir):
+            os.makedirs(download_dir)
+
+    def path_owner(self, path):
+        """Returns the record ID that path was downloaded for, or None"""
+        if self.manifest is None:
+            return None
+        return self.manifest.path_owner(self.manifest_path(path))
+
+    def reserve_path(self, path, record_id):
+        """Claim path for a record before it is downloaded"""
+        if self.manifest is not None:
+            self.manifest.reserve_path(self.manifest_path(path), record_id)
+
+    def record(self, photo, version, path, sha256=None):
+        """Add a downloaded file to the manifest"""
+        if self.file_index is not None:
+            self.file_index.add(path)
+        if self.manifest is not None:
+            self.manifest.add(
+                photo.id,
+                version,
+                self.manifest_path(path),
+                download.expected_file_size(photo, version),
+                remote_checksum(photo, version),
+                sha256)
+
+    def find(self, photo, version, download_path, legacy_path=None,
+             album_dir=None):
+        """
+        Returns the path where this version of the photo has already been
+        downloaded, or None. The manifest is checked before the filesystem.
+        With more than one album, only a download in album_dir counts.
+        """
+        manifest_entry = None
+        if self.manifest is not None and not self.rebuild_manifest:
+            manifest_entry = self.manifest.lookup(photo.id, version)
+            if manifest_entry is not None:
+                if self.album_linker is None:
+                    return os.path.join(
+                        self.directory, manifest_entry["path"])
+                existing_path = self.album_linker.existing_path(
+                    photo.id, manifest_entry, download_path, album_dir)
+                if existing_path is not None:
+                    return existing_path
+        for path in (download_path, legacy_path):
+            if path is not None and path in self.in_flight:
+                return path
+            if path is not None and self.file_exists(path):
+                if manifest_entry is None:
+                    self.record(photo, version, path)
+                else:
+                    # A link from an earlier run that the manifest missed
+                    self.album_linker.record_link(photo.id, version, path)
+                return path
+        return None
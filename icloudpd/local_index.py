@@ -0,0 +1,95 @@
+"""In-memory index of the files in the download directory"""
+
+import os
+import threading
+
+
+def _scan_tree(directory):
+    """
+    Yields (directories, files) for each directory below `directory`.
+    Uses os.scandir when available, so that no stat call is needed
+    for each file.
+    """
+    scandir = getattr(os, "scandir", None)
+    if scandir is None:  # pragma: no cover
+        # Python 2.7
+        for root, dirnames, filenames in os.walk(directory):
+            yield (
+                [os.path.join(root, name) for name in dirnames],
+                [os.path.join(root, name) for name in filenames])
+        return
+
+    pending = [directory]
+    while pending:
+        root = pending.pop()
+        dirs = []
+        files = []
+        try:
+            entries = list(scandir(root))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry.path)
+            except OSError:
+                pass
+        pending.extend(dirs)
+        yield dirs, files
+
+
+class LocalFileIndex(object):
+    """
+    Set of the files and directories below the download directory.
+
+    The directory is walked once with `scan()`, and the checks for existing
+    files and folders are then answered from memory, instead of making
+    several filesystem calls for each asset. This helps a lot on network
+    volumes (SMB, NFS), where every call is a round trip to the server.
+    Paths outside of the download directory are checked on disk.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.normpath(directory)
+        self._prefix = os.path.join(self.directory, "")
+        self._lock = threading.Lock()
+        self._files = set()
+        self._dirs = set([self.directory])
+
+    def scan(self):
+        """Walk the download directory and return the number of files found"""
+        for dirs, files in _scan_tree(self.directory):
+            self._dirs.update(os.path.normpath(path) for path in dirs)
+            self._files.update(os.path.normpath(path) for path in files)
+        return len(self._files)
+
+    def _indexed(self, path):
+        return path == self.directory or path.startswith(self._prefix)
+
+    def isfile(self, path):
+        """Returns True if path is a file in the download directory"""
+        path = os.path.normpath(path)
+        if not self._indexed(path):
+            return os.path.isfile(path)
+        return path in self._files
+
+    def add(self, path):
+        """Add a file that has been downloaded"""
+        with self._lock:
+            self._files.add(os.path.normpath(path))
+
+    def makedirs(self, path):
+        """Create a directory (and its parents), unless it already exists"""
+        path = os.path.normpath(path)
+        if path in self._dirs:
+            return
+        with self._lock:
+            if path in self._dirs:
+                return
+            if not os.path.exists(path):
+                os.makedirs(path)
+            while self._indexed(path) and path not in self._dirs:
+                self._dirs.add(path)
+                path = os.path.dirname(path)
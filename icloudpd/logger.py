@@ -2,6 +2,7 @@
 
 import sys
 import logging
+import threading
 from logging import DEBUG, INFO
 
 
@@ -11,6 +12,8 @@ class IPDLogger(logging.Logger):
     def __init__(self, name, level=INFO):
         logging.Logger.__init__(self, name, level)
         self.tqdm = None
+        # Download workers can update the progress bar from other threads
+        self.tqdm_lock = threading.RLock()
 
     # If tdqm progress bar is not set, we just write regular log messages
     def set_tqdm(self, tdqm):
@@ -22,14 +25,16 @@ class IPDLogger(logging.Logger):
         if self.tqdm is None:
             self.log(loglevel, desc)
         else:
-            self.tqdm.set_description(desc)
+            with self.tqdm_lock:
+                self.tqdm.set_description(desc)
 
     def tqdm_write(self, message, loglevel=INFO):
         """Write to tqdm progress bar, fallback to logging"""
         if self.tqdm is None:
             self.log(loglevel, message)
         else:
-            self.tqdm.write(message)
+            with self.tqdm_lock:
+                self.tqdm.write(message)
 
 
 def setup_logger(loglevel=DEBUG):
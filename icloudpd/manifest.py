@@ -0,0 +1,264 @@
+"""Persistent manifest of downloaded assets, keyed by iCloud record ID"""
+
+import os
+import sqlite3
+import threading
+import time
+
+# Number of changes that are written before the manifest is committed
+COMMIT_INTERVAL = 100
+
+
+def remote_checksum(photo, size):
+    """
+    Returns iCloud's fileChecksum for a version of an AssetRecord, or None.
+    This changes whenever the file in iCloud changes.
+    """
+    try:
+        return photo.versions[size].checksum
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+
+class DownloadManifest(object):
+    """
+    SQLite database of the files that have been downloaded.
+
+    Each row stores the record ID and version (e.g. "original" or
+    "originalVideo") of an asset, together with the local path, size,
+    iCloud checksum and the SHA-256 of the downloaded file (for scrubs).
+    The manifest can be shared between download threads.
+
+    Downloads that failed are kept in a separate table, so that the next
+    run can retry them first. When more than one album is downloaded,
+    the copies of an asset in the other albums are kept in the links table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._pending_changes = 0
+        # Paths that are being downloaded, but are not in the manifest yet
+        self._reserved_paths = {}
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                "record_id TEXT NOT NULL, "
+                "version TEXT NOT NULL, "
+                "path TEXT NOT NULL, "
+                "size INTEGER, "
+                "checksum TEXT, "
+                "downloaded_at REAL, "
+                "sha256 TEXT, "
+                "PRIMARY KEY (record_id, version))")
+            columns = [
+                row["name"] for row in
+                self._db.execute("PRAGMA table_info(downloads)")]
+            if "sha256" not in columns:
+                # Manifests from older versions
+                self._db.execute("ALTER TABLE downloads ADD COLUMN sha256 TEXT")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS downloads_path "
+                "ON downloads (path)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS failed_assets ("
+                "record_id TEXT NOT NULL, "
+                "version TEXT NOT NULL, "
+                "asset_record_id TEXT, "
+                "error TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 1, "
+                "failed_at REAL, "
+                "PRIMARY KEY (record_id, version))")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                "path TEXT PRIMARY KEY, "
+                "record_id TEXT NOT NULL, "
+                "version TEXT NOT NULL)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS links_record_id "
+                "ON links (record_id)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT)")
+            self._db.commit()
+
+    def lookup(self, record_id, version):
+        """Returns the manifest row for a record version, or None"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT * FROM downloads WHERE record_id = ? AND version = ?",
+                (record_id, version)).fetchone()
+
+    def downloads_for(self, record_id):
+        """
+        Returns the (record_id, version, path) rows for all versions of
+        a record, including the links in other albums
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT record_id, version, path FROM downloads "
+                "WHERE record_id = ? "
+                "UNION ALL SELECT record_id, version, path FROM links "
+                "WHERE record_id = ?",
+                (record_id, record_id)).fetchall()
+
+    def is_downloaded(self, record_id, version, checksum=None):
+        """
+        Returns True if the record version has been downloaded.
+        If checksum is given, the downloaded file must also match it.
+        """
+        row = self.lookup(record_id, version)
+        if row is None:
+            return False
+        return checksum is None or row["checksum"] in (None, checksum)
+
+    def path_owner(self, path):
+        """Returns the record ID that has downloaded (or is downloading) path"""
+        with self._lock:
+            if path in self._reserved_paths:
+                return self._reserved_paths[path]
+            row = self._db.execute(
+                "SELECT record_id FROM downloads WHERE path = ? "
+                "UNION ALL SELECT record_id FROM links WHERE path = ? LIMIT 1",
+                (path, path)).fetchone()
+            return row["record_id"] if row else None
+
+    def reserve_path(self, path, record_id):
+        """Mark path as being downloaded for record_id"""
+        with self._lock:
+            self._reserved_paths[path] = record_id
+
+    # pylint: disable-msg=too-many-arguments
+    def add(self, record_id, version, path, size=None, checksum=None,
+            sha256=None):
+        """Record a downloaded file"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads "
+                "(record_id, version, path, size, checksum, downloaded_at, "
+                "sha256) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record_id, version, path, size, checksum, time.time(),
+                 sha256))
+            self._db.execute(
+                "DELETE FROM failed_assets WHERE record_id = ? AND version = ?",
+                (record_id, version))
+            self._reserved_paths.pop(path, None)
+            self._changed()
+
+    def add_link(self, record_id, version, path):
+        """Record a link (or copy) of a downloaded file in another album"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO links (path, record_id, version) "
+                "VALUES (?, ?, ?)",
+                (path, record_id, version))
+            self._reserved_paths.pop(path, None)
+            self._changed()
+
+    def remove(self, record_id, version=None):
+        """Forget a record (or a single version of it), and its links"""
+        with self._lock:
+            for table in ("downloads", "links"):
+                if version is None:
+                    self._db.execute(
+                        "DELETE FROM %s WHERE record_id = ?" % table,
+                        (record_id,))
+                else:
+                    self._db.execute(
+                        "DELETE FROM %s WHERE record_id = ? AND version = ?"
+                        % table, (record_id, version))
+            self._changed()
+
+    def clear(self):
+        """Remove all downloads from the manifest"""
+        with self._lock:
+            self._db.execute("DELETE FROM downloads")
+            self._db.execute("DELETE FROM links")
+            self._reserved_paths = {}
+            self._changed()
+
+    def add_failure(self, record_id, version, asset_record_id, error):
+        """
+        Record a download that failed. The CPLAsset record ID is kept
+        so that the photo can be looked up again without a listing.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT attempts FROM failed_assets "
+                "WHERE record_id = ? AND version = ?",
+                (record_id, version)).fetchone()
+            attempts = row["attempts"] + 1 if row else 1
+            self._db.execute(
+                "INSERT OR REPLACE INTO failed_assets "
+                "(record_id, version, asset_record_id, error, attempts, "
+                "failed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (record_id, version, asset_record_id, error, attempts,
+                 time.time()))
+            # Committed straight away, so the failure is retried first
+            # even if this run is killed
+            self.commit()
+
+    def remove_failure(self, record_id):
+        """Forget the failed downloads of a record"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM failed_assets WHERE record_id = ?", (record_id,))
+            self._changed()
+
+    def failed_assets(self):
+        """Returns the failed downloads, oldest first"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT * FROM failed_assets ORDER BY failed_at").fetchall()
+
+    def get_state(self, key, default=None):
+        """Returns a value that was saved with set_state"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM sync_state WHERE key = ?",
+                (key,)).fetchone()
+            return row["value"] if row else default
+
+    def set_state(self, key, value):
+        """Save a value that is kept between runs, e.g. a sync cursor"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                (key, value))
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def _changed(self):
+        self._pending_changes += 1
+        if self._pending_changes >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        """Write pending changes to disk"""
+        with self._lock:
+            self._db.commit()
+            self._pending_changes = 0
+
+    def close(self):
+        """Commit and close the database"""
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def open_manifest(path):
+    """Open (or create) the manifest at path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return DownloadManifest(path)
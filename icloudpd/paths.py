@@ -1,5 +1,6 @@
 """Path functions"""
 import os
+import re
 
 
 def local_download_path(media, size, download_dir):
@@ -16,3 +17,24 @@ def filename_with_size(media, size):
     if size == 'original':
         return filename
     return ("-%s." % size).join(filename.rsplit(".", 1))
+
+
+def unique_local_download_path(media, size, download_dir):
+    """
+    Returns the download path with part of the record ID added,
+    e.g. IMG1234-AbC12dE.jpg. This is used when a different photo with
+    the same filename has already been downloaded to the same folder.
+    """
+    download_path = local_download_path(media, size, download_dir)
+    suffix = re.sub("[^0-9a-zA-Z]", "", media.id)[0:7]
+    root, ext = os.path.splitext(download_path)
+    return "%s-%s%s" % (root, suffix, ext)
+
+
+def album_folder(album):
+    """Returns the name of the folder for an album, e.g. for --album Trip/2018"""
+    folder = re.sub(r"[/\\]", "_", album)
+    if not folder.strip("."):
+        # "." or ".."
+        folder = folder.replace(".", "_")
+    return folder
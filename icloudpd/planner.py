@@ -0,0 +1,132 @@
+"""Plans the download paths for a page of photos at a time"""
+
+import datetime
+import logging
+import math
+import os
+from collections import namedtuple
+import pytz
+from tzlocal import get_localzone
+from icloudpd.logger import setup_logger
+from icloudpd.paths import local_download_path
+
+# What base.main needs to know to download a photo.
+# size is None if the requested size doesn't exist and --force-size is set.
+# mtime is None if the created date couldn't be converted to local time,
+# and then the modification time isn't changed.
+DownloadPlan = namedtuple("DownloadPlan", [
+    "record", "size", "created_date", "download_dir", "download_path",
+    "mtime"])
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def formats_by_day(folder_structure):
+    """
+    True if the folder structure only depends on the calendar day
+    (e.g. {:%Y/%m/%d}), so it can be formatted once for each day.
+    """
+    morning = datetime.datetime(2000, 1, 2)
+    evening = datetime.datetime(2000, 1, 2, 23, 59, 59, 999999)
+    try:
+        return folder_structure.format(morning) == \
+            folder_structure.format(evening)
+    except (ValueError, IndexError, KeyError):
+        return False
+
+
+class PathPlanner(object):
+    """
+    Works out the local created date, folder, download size and path of
+    each photo. The local timezone is looked up once, and the folder
+    path is formatted once for each calendar day.
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(self, directory, folder_structure, size, force_size=False,
+                 timezone=None):
+        self.directory = directory
+        self.folder_structure = folder_structure
+        self.size = size
+        self.force_size = force_size
+        self.timezone = timezone if timezone is not None else get_localzone()
+        self._folders = {} if formats_by_day(folder_structure) else None
+
+    def local_created_date(self, record):
+        """Returns (created date in the local timezone, mtime)"""
+        try:
+            created_date = record.created.astimezone(self.timezone)
+        except (ValueError, OSError):
+            setup_logger().set_tqdm_description(
+                "Could not convert photo created date to local timezone (%s)" %
+                record.created, logging.ERROR)
+            return record.created, None
+        # The same as time.mktime(created_date.timetuple()), but faster
+        return created_date, math.floor((created_date - EPOCH).total_seconds())
+
+    def folder(self, created_date):
+        """Returns (created date, download folder) for a created date"""
+        if self._folders is not None:
+            key = (created_date.year, created_date.month, created_date.day,
+                   created_date.utcoffset())
+            download_dir = self._folders.get(key)
+            if download_dir is not None:
+                return created_date, download_dir
+        try:
+            date_path = self.folder_structure.format(created_date)
+        except ValueError:  # pragma: no cover
+            # This error only seems to happen in Python 2
+            setup_logger().set_tqdm_description(
+                "Photo created date was not valid (%s)" %
+                created_date, logging.ERROR)
+            # e.g. ValueError: year=5 is before 1900
+            # (https://github.com/ndbroadbent/icloud_photos_downloader/issues/122)
+            # Just use the Unix epoch
+            created_date = datetime.datetime.fromtimestamp(0)
+            return created_date, os.path.join(
+                self.directory, self.folder_structure.format(created_date))
+        download_dir = os.path.join(self.directory, date_path)
+        if self._folders is not None:
+            self._folders[key] = download_dir
+        return created_date, download_dir
+
+    def download_size(self, record):
+        """The size to download, or None if it doesn't exist"""
+        if self.size not in record.versions and self.size != "original":
+            if self.force_size:
+                return None
+            return "original"
+        return self.size
+
+    def plan(self, record):
+        """Returns the DownloadPlan of a record"""
+        created_date, mtime = self.local_created_date(record)
+        created_date, download_dir = self.folder(created_date)
+        download_size = self.download_size(record)
+        download_path = None
+        if download_size is not None:
+            download_path = local_download_path(
+                record, download_size, download_dir)
+        return DownloadPlan(
+            record, download_size, created_date, download_dir,
+            download_path, mtime)
+
+    def plan_page(self, records):
+        """Returns the DownloadPlans of a page of records"""
+        return [self.plan(record) for record in records]
+
+
+def plan_pages(planner, records, page_size):
+    """
+    Yields the DownloadPlan of each record. The records are planned in
+    pages of page_size, as they come in from the album listing.
+    """
+    page = []
+    for record in records:
+        page.append(record)
+        if len(page) >= page_size:
+            for download_plan in planner.plan_page(page):
+                yield download_plan
+            page = []
+    for download_plan in planner.plan_page(page):
+        yield download_plan
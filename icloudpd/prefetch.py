@@ -0,0 +1,84 @@
+"""Fetches album pages in a background thread, ahead of the download loop"""
+
+import threading
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    # Python 2.7
+    import Queue as queue
+
+
+class _Done(object):  # pylint: disable-msg=too-few-public-methods
+    """Marks the end of the iterable"""
+
+
+class _Error(object):  # pylint: disable-msg=too-few-public-methods
+    """Wraps an exception that was raised while iterating"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class PrefetchIterator(object):
+    """
+    Iterates over an iterable in a producer thread, and keeps up to
+    `size` items ready in a bounded queue. This lets the next album page
+    be requested while the photos from the current page are downloaded.
+
+    Exceptions raised by the iterable (e.g. after the PhotoAlbum
+    exception handler gives up re-authenticating) are raised again in
+    the consuming thread.
+    """
+
+    def __init__(self, iterable, size):
+        self._queue = queue.Queue(max(size, 1))
+        self._closed = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(
+            target=self._produce, args=(iterable,), name="icloudpd-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        """Put an item on the queue, unless the iterator has been closed"""
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put(item):
+                    return
+        except Exception as ex:  # pylint: disable-msg=broad-except
+            self._put(_Error(ex))
+        else:
+            self._put(_Done())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        item = self._queue.get()
+        if isinstance(item, _Done):
+            self._finished = True
+            raise StopIteration
+        if isinstance(item, _Error):
+            self._finished = True
+            raise item.exception
+        return item
+
+    # Python 2.7
+    next = __next__
+
+    def close(self):
+        """Stop the producer thread"""
+        self._finished = True
+        self._closed.set()
+        self._thread.join()
@@ -0,0 +1,183 @@
+"""Backoff policies for retries, and a queue of downloads that are retried later"""
+
+import heapq
+import random
+import socket
+import threading
+import time
+from requests.exceptions import ConnectionError  # pylint: disable=redefined-builtin
+from requests.exceptions import ChunkedEncodingError, Timeout
+from pyicloud_ipd.exceptions import PyiCloudAPIResponseError
+
+# Import the constants object so that we can mock WAIT_SECONDS in tests
+from icloudpd import constants
+
+# Errors that download_media retries
+RETRY_ERRORS = (ConnectionError, ChunkedEncodingError, Timeout,
+                socket.timeout, PyiCloudAPIResponseError)
+
+# Response codes and reasons that mean Apple is throttling requests
+THROTTLE_CODES = ("429", "503", "ACCESS_DENIED", "THROTTLED")
+
+
+class RetryPolicy(object):  # pylint: disable-msg=too-few-public-methods
+    """
+    Exponential backoff with jitter.
+
+    The delay for retry n (counting from 0) is base * factor ** n seconds,
+    up to max_seconds, minus a random part of up to `jitter` of the delay.
+    The jitter spreads out the retries of downloads that failed at the
+    same time. The base is a multiple of constants.WAIT_SECONDS.
+    """
+
+    # pylint: disable-msg=too-many-arguments
+    def __init__(self, base_multiplier=1.0, factor=2.0, max_seconds=60,
+                 jitter=0.5, immediate_first_retry=False):
+        self.base_multiplier = base_multiplier
+        self.factor = factor
+        self.max_seconds = max_seconds
+        self.jitter = jitter
+        self.immediate_first_retry = immediate_first_retry
+
+    def delay(self, retries):
+        """Seconds to wait before retry number `retries`"""
+        if self.immediate_first_retry:
+            if retries == 0:
+                return 0
+            retries -= 1
+        delay = constants.WAIT_SECONDS * self.base_multiplier * \
+            self.factor ** retries
+        delay = min(delay, self.max_seconds)
+        return delay * (1 - self.jitter * random.random())
+
+
+# "Invalid global session": re-authenticate, and retry straight away
+SESSION_POLICY = RetryPolicy(immediate_first_retry=True)
+# 429, 503 etc.: back off for longer
+THROTTLE_POLICY = RetryPolicy(base_multiplier=2, factor=3, max_seconds=300)
+# Connection errors, timeouts and other API errors
+CONNECTION_POLICY = RetryPolicy()
+
+
+def is_session_error(ex):
+    """True if the iCloud session has expired"""
+    return "Invalid global session" in str(ex)
+
+
+def is_throttle_error(ex):
+    """True if the error means that the server is throttling requests"""
+    if isinstance(ex, PyiCloudAPIResponseError):
+        return str(ex.code) in THROTTLE_CODES or \
+            "throttle" in str(ex.reason).lower()
+    return False
+
+
+def is_congestion_error(ex):
+    """True if the server is throttling requests, or a request timed out"""
+    return is_throttle_error(ex) or isinstance(ex, (Timeout, socket.timeout))
+
+
+def policy_for(ex):
+    """The retry policy for an error"""
+    if is_session_error(ex):
+        return SESSION_POLICY
+    if is_throttle_error(ex):
+        return THROTTLE_POLICY
+    return CONNECTION_POLICY
+
+
+class RetryLater(object):  # pylint: disable-msg=too-few-public-methods
+    """
+    Returned by download_media when a failed download should be retried
+    after `delay` seconds, starting at retry number `retries`.
+    This is falsy, like a failed download.
+    """
+
+    def __init__(self, delay, retries):
+        self.delay = delay
+        self.retries = retries
+
+    def __bool__(self):
+        return False
+
+    # Python 2.7
+    __nonzero__ = __bool__
+
+
+class Downloaded(object):  # pylint: disable-msg=too-few-public-methods
+    """
+    Returned by download_media when a file was downloaded.
+    Keeps the SHA-256 of the file for the manifest.
+    """
+
+    def __init__(self, sha256=None):
+        self.sha256 = sha256
+
+    def __bool__(self):
+        return True
+
+    # Python 2.7
+    __nonzero__ = __bool__
+
+
+class DownloadFailed(object):  # pylint: disable-msg=too-few-public-methods
+    """
+    Returned by download_media when it has given up on a download.
+    This is falsy, and keeps the last error for the failed downloads
+    in the manifest.
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def __bool__(self):
+        return False
+
+    # Python 2.7
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        return str(self.error) if self.error is not None else "Unknown error"
+
+
+class RetryQueue(object):
+    """
+    Downloads that failed, waiting for their retry time.
+
+    The download loop keeps going while these wait, and submits them
+    again once they are due.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = 0
+
+    def defer(self, delay, func, *args, **kwargs):
+        """Run func(*args, **kwargs) after delay seconds"""
+        with self._lock:
+            self._counter += 1
+            heapq.heappush(
+                self._heap,
+                (time.time() + delay, self._counter, func, args, kwargs))
+
+    def pop_due(self):
+        """Returns the (func, args, kwargs) that are due now"""
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, func, args, kwargs = heapq.heappop(self._heap)
+                due.append((func, args, kwargs))
+        return due
+
+    def next_delay(self):
+        """Seconds until the next retry is due, or None if the queue is empty"""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - time.time(), 0)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
@@ -0,0 +1,205 @@
+"""Copies HTTP response bodies to disk with large, adaptive reads"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import os
+from requests.exceptions import ConnectionError  # pylint: disable=redefined-builtin
+from requests.exceptions import ChunkedEncodingError
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+# Import the constants object so that we can mock the read sizes in tests
+from icloudpd import constants
+
+# fallocate(2) flag that reserves the blocks without changing the file size
+FALLOC_FL_KEEP_SIZE = 1
+
+
+def _bind_fallocate():
+    """
+    Returns glibc's fallocate with 64-bit offsets, or None.
+    On 32-bit systems (e.g. ARM NAS boxes) fallocate takes a 32-bit
+    off_t, so fallocate64 has to be used there.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    for name in ("fallocate64", "fallocate"):
+        func = getattr(libc, name, None)
+        if func is not None:
+            func.argtypes = [
+                ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+            return func
+    # Not Linux (e.g. macOS or Windows)
+    return None
+
+
+_FALLOCATE = _bind_fallocate()
+
+
+class StreamDigest(object):
+    """
+    SHA-256 of the bytes that are written for a download, and the number
+    of bytes that were received from the server. These differ if the
+    bytes are transformed (e.g. to set the EXIF date).
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.received = 0
+
+    def update(self, data):
+        """Add written bytes to the hash"""
+        self._hash.update(data)
+
+    def add_file(self, file_obj, length):
+        """
+        Add the first length bytes of a file that were downloaded before,
+        e.g. when a download is resumed. Leaves the file at that position.
+        """
+        file_obj.seek(0)
+        buf = bytearray(min(constants.DOWNLOAD_MAX_READ_SIZE, max(length, 1)))
+        view = memoryview(buf)
+        remaining = length
+        while remaining:
+            read = file_obj.readinto(view[:min(remaining, len(buf))])
+            if not read:
+                break
+            self.update(view[:read])
+            remaining -= read
+        self.received += length - remaining
+        file_obj.seek(length - remaining)
+
+    def hexdigest(self):
+        """The SHA-256 as a hex string"""
+        return self._hash.hexdigest()
+
+
+def file_sha256(path):
+    """SHA-256 of a file on disk, e.g. to scrub downloaded files"""
+    digest = StreamDigest()
+    with open(path, "rb") as file_obj:
+        digest.add_file(file_obj, os.path.getsize(path))
+    return digest.hexdigest()
+
+
+def preallocate(file_obj, size):
+    """
+    Reserve disk space for the rest of the file, so large downloads
+    are not fragmented. The file size doesn't change, so the size of an
+    interrupted download is still the number of bytes that were written
+    (see download.partial_download_offset). Does nothing if the OS or
+    filesystem doesn't support it.
+    """
+    offset = file_obj.tell()
+    if not size or size <= offset or _FALLOCATE is None:
+        return
+    file_obj.flush()
+    # Errors (e.g. not supported on some network filesystems) are ignored
+    _FALLOCATE(file_obj.fileno(), FALLOC_FL_KEEP_SIZE, offset, size - offset)
+
+
+# pylint: disable-msg=too-many-arguments
+def write_stream(response, file_obj, expected_size=None, transform=None,
+                 truncate=True, digest=None, bandwidth=None):
+    """
+    Write the body of a streamed response to file_obj, starting at its
+    current position. Returns the number of bytes that were written.
+
+    The body is read into a single reused buffer. The read size starts at
+    DOWNLOAD_MIN_READ_SIZE and doubles (up to DOWNLOAD_MAX_READ_SIZE) every
+    time a read fills the whole buffer. If expected_size is given, the space
+    is preallocated first.
+
+    If the download fails, the file is truncated to the bytes that were
+    written, so the download can be resumed from the file size.
+
+    If transform is given, the bytes are passed through its feed() method
+    before they are written, and the result of finish() is written at the end
+    (see exif_datetime.ExifDateInjector).
+
+    If digest (a StreamDigest) is given, the written bytes are hashed on
+    the way to the file, so they don't have to be read back.
+
+    With truncate=False the file keeps its size, e.g. when a byte range
+    is written into a file that was preallocated for all the ranges.
+
+    If bandwidth (a BandwidthLimiter) is given, each read waits for its
+    share of the bandwidth before it is written.
+    """
+    start = file_obj.tell()
+    preallocate(file_obj, expected_size)
+    try:
+        raw = getattr(response, "raw", None)
+        if transform is None and digest is None and bandwidth is None:
+            write = file_obj.write
+        else:
+            def write(data):
+                """Pass the data through the transform and the digest"""
+                if bandwidth is not None:
+                    bandwidth.consume(len(data))
+                if digest is not None:
+                    digest.received += len(data)
+                if transform is not None:
+                    data = transform.feed(data)
+                file_obj.write(data)
+                if digest is not None:
+                    digest.update(data)
+        if _can_read_raw(response, raw):
+            _copy_raw(raw, write)
+        else:
+            for chunk in response.iter_content(
+                    chunk_size=constants.DOWNLOAD_MAX_READ_SIZE):
+                if chunk:
+                    write(chunk)
+        if transform is not None:
+            data = transform.finish()
+            file_obj.write(data)
+            if digest is not None:
+                digest.update(data)
+    finally:
+        if truncate:
+            # Remove any preallocated space that wasn't written
+            file_obj.truncate(file_obj.tell())
+    return file_obj.tell() - start
+
+
+def _can_read_raw(response, raw):
+    """
+    The raw stream can only be used if the body doesn't have to be decoded.
+    Otherwise fall back to requests' iter_content.
+    """
+    if not isinstance(raw, io.IOBase) or not hasattr(raw, "readinto"):
+        return False
+    encoding = response.headers.get("Content-Encoding", "identity")
+    return encoding.lower() == "identity"
+
+
+def _copy_raw(raw, write):
+    """
+    Copy a raw urllib3 response to a write function with a reused buffer.
+    urllib3 errors are raised as the requests exceptions that iter_content
+    raises, so that download_media can retry them.
+    """
+    try:
+        _copy_raw_buffer(raw, write)
+    except ProtocolError as ex:
+        # E.g. the connection was closed before the whole body was sent
+        raise ChunkedEncodingError(ex)
+    except ReadTimeoutError as ex:
+        raise ConnectionError(ex)
+
+
+def _copy_raw_buffer(raw, write):
+    """Copy with reads that grow up to DOWNLOAD_MAX_READ_SIZE"""
+    buf = bytearray(constants.DOWNLOAD_MAX_READ_SIZE)
+    view = memoryview(buf)
+    read_size = min(constants.DOWNLOAD_MIN_READ_SIZE, len(buf))
+    while True:
+        length = raw.readinto(view[:read_size])
+        if not length:
+            break
+        write(view[:length])
+        if length == read_size and read_size < len(buf):
+            read_size = min(read_size * 2, len(buf))
@@ -0,0 +1,58 @@
+"""Incremental sync: only list the photos that were added since the last run"""
+
+import calendar
+from icloudpd.logger import setup_logger
+
+
+def supports_cursor(album):
+    """
+    A cursor can only be used for albums that are sorted by the date
+    that photos were added (e.g. "All Photos"). Albums sorted by the
+    photo date can have photos added anywhere in the listing.
+    """
+    return "ByAddedDate" in getattr(album, "list_type", "")
+
+
+def added_timestamp(photo):
+    """Returns the date the photo was added to iCloud, as a Unix timestamp"""
+    added_date = photo.added_date
+    return calendar.timegm(added_date.utctimetuple()) + \
+        added_date.microsecond / 1000000.0
+
+
+class SyncCursor(object):
+    """
+    Remembers the newest added date that was seen for an album, so that
+    the next run can stop paging through the album once it gets to photos
+    that were already there in the last run.
+    The cursor is stored in the download manifest.
+    """
+
+    def __init__(self, manifest, album_name):
+        self.manifest = manifest
+        self.key = "cursor:%s" % album_name
+        value = manifest.get_state(self.key)
+        self.previous = float(value) if value is not None else None
+        self.newest = self.previous
+
+    def photos_since(self, album):
+        """
+        Yields the photos in the album until one is older than the cursor.
+        Albums that are sorted by added date list the newest photos first
+        (at rank 0), so no more pages are requested after that.
+        """
+        logger = setup_logger()
+        for photo in album:
+            added = added_timestamp(photo)
+            if self.previous is not None and added < self.previous:
+                logger.debug(
+                    "Reached photos that were added before the last run.")
+                return
+            if self.newest is None or added > self.newest:
+                self.newest = added
+            yield photo
+
+    def save(self):
+        """Store the newest added date that has been seen"""
+        if self.newest is not None:
+            self.manifest.set_state(self.key, repr(self.newest))
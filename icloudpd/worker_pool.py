@@ -0,0 +1,71 @@
+"""Bounded pool of worker threads for running downloads concurrently"""
+
+import threading
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    # Python 2.7
+    import Queue as queue
+from icloudpd.logger import setup_logger
+
+
+class WorkerPool(object):
+    """
+    Runs tasks on a fixed number of worker threads.
+
+    The queue of pending tasks is bounded, so the photos enumerator
+    can't run too far ahead of the downloads. With a single thread,
+    tasks are run inline in the calling thread, which keeps the
+    original sequential behavior.
+    """
+
+    def __init__(self, threads_num=1, queue_size=None):
+        self.threads_num = max(threads_num, 1)
+        if queue_size is None:
+            queue_size = self.threads_num * 2
+        self._tasks = queue.Queue(queue_size)
+        self._error = None
+        self._threads = []
+        if self.threads_num > 1:
+            for i in range(self.threads_num):
+                thread = threading.Thread(
+                    target=self._worker, name="icloudpd-worker-%d" % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the next available worker"""
+        self._raise_error()
+        if not self._threads:
+            func(*args, **kwargs)
+            return
+        self._tasks.put((func, args, kwargs))
+
+    def join(self):
+        """Wait for all submitted tasks to finish and stop the workers"""
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._raise_error()
+
+    def _raise_error(self):
+        """Re-raise the first exception that was raised in a worker thread"""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _worker(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            func, args, kwargs = task
+            try:
+                func(*args, **kwargs)
+            except Exception as ex:  # pylint: disable-msg=broad-except
+                if self._error is None:
+                    self._error = ex
+                setup_logger().exception("Error in download worker")
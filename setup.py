@@ -23,5 +23,8 @@ setup(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
     ],
-    entry_points={"console_scripts": ["icloudpd = icloudpd.base:main"]},
+    entry_points={"console_scripts": [
+        "icloudpd = icloudpd.base:main",
+        "icloudpd-accounts = icloudpd.accounts:main",
+    ]},
 )
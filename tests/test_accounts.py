@@ -0,0 +1,126 @@
+from unittest import TestCase, skipIf
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import click
+import mock
+from click.testing import CliRunner
+from icloudpd import accounts, base
+from icloudpd.bandwidth import BandwidthLimiter
+
+ACCOUNT = {
+    "username": "jdoe@gmail.com",
+    "directory": "/photos/jdoe",
+    "cookie_directory": "/cookies/jdoe",
+}
+
+
+def fake_main(args, prog_name, standalone_mode, obj):
+    """Stands in for icloudpd in the worker processes"""
+    username = args[args.index("--username") + 1]
+    if username.startswith("2sa"):
+        exit(1)
+    if username.startswith("broken"):
+        raise ValueError("Broken account")
+    threads_num = int(args[args.index("--threads-num") + 1])
+    return {
+        "downloaded": threads_num,
+        "linked": 1 if isinstance(obj["bandwidth"], BandwidthLimiter) else 0,
+        "failed": 0,
+    }
+
+
+class AccountsTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "accounts.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_accounts(self, accounts_list):
+        with open(self.path, "w") as accounts_file:
+            json.dump(accounts_list, accounts_file)
+
+    def test_account_args(self):
+        account = dict(ACCOUNT, password="password1",
+                       args=["--until-found", "10", "--threads-num", "32"])
+        self.assertEqual(accounts.account_args(account, 4), [
+            "--username", "jdoe@gmail.com",
+            "--directory", "/photos/jdoe",
+            "--cookie-directory", "/cookies/jdoe",
+            "--no-progress-bar",
+            "--password", "password1",
+            "--until-found", "10", "--threads-num", "32",
+            "--threads-num", "4", "--connection-pool-size", "4",
+        ])
+
+    def test_log_format(self):
+        formatter = logging.Formatter(accounts.log_format("50%off@gmail.com"))
+        record = logging.LogRecord(
+            "icloudpd", logging.INFO, __file__, 1, "Downloading", None, None)
+        self.assertTrue(
+            formatter.format(record).endswith("50%off@gmail.com: Downloading"))
+
+    def test_load_accounts(self):
+        self.write_accounts([ACCOUNT])
+        self.assertEqual(accounts.load_accounts(self.path), [ACCOUNT])
+
+        self.write_accounts([dict(ACCOUNT, cookie_directory="")])
+        with self.assertRaises(click.BadParameter):
+            accounts.load_accounts(self.path)
+
+    @skipIf(getattr(multiprocessing, "get_start_method", lambda: "fork")()
+            != "fork", "The patched main is only inherited by forked processes")
+    def test_summary(self):
+        self.write_accounts([
+            dict(ACCOUNT, username="jdoe@gmail.com"),
+            dict(ACCOUNT, username="2sa@gmail.com"),
+            dict(ACCOUNT, username="broken@gmail.com"),
+        ])
+        with mock.patch.object(base.main, "main", side_effect=fake_main):
+            runner = CliRunner()
+            result = runner.invoke(accounts.main, [
+                self.path,
+                "--processes", "2",
+                "--max-connections", "10",
+                "--max-bandwidth", "1000",
+            ])
+        self.assertEqual(result.exit_code, 1)
+        lines = result.output.splitlines()
+        self.assertEqual(lines[0].split(), [
+            "Account", "Downloaded", "Linked", "Failed", "Seconds", "Status"])
+        # Each of the 2 processes gets 5 connections,
+        # and all of them share the bandwidth limiter
+        self.assertEqual(
+            lines[1].split()[:4], ["jdoe@gmail.com", "5", "1", "0"])
+        self.assertTrue(lines[1].endswith("ok"))
+        self.assertTrue(lines[2].endswith("exit 1"))
+        self.assertTrue(lines[3].endswith("error: Broken account"))
+        self.assertEqual(lines[4].split()[:4], ["Total", "5", "1", "0"])
+        self.assertTrue(lines[4].endswith("1 of 3 accounts ok"))
+
+    def test_processes_are_capped_by_connections(self):
+        self.write_accounts([
+            dict(ACCOUNT, username="%d@gmail.com" % number)
+            for number in range(3)])
+
+        def imap(func, tasks):
+            return [dict(
+                username=account["username"], status="ok",
+                downloaded=threads_num, linked=0, failed=0, seconds=0)
+                for account, threads_num in tasks]
+
+        with mock.patch("multiprocessing.Pool") as pool_patched:
+            pool_patched.return_value.imap.side_effect = imap
+            runner = CliRunner()
+            result = runner.invoke(accounts.main, [
+                self.path, "--processes", "8", "--max-connections", "2"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(pool_patched.call_args[0][0], 2)
+        # One connection for each of the 2 accounts that run at a time
+        self.assertEqual(
+            result.output.splitlines()[-1].split()[:2], ["Total", "3"])
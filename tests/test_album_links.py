@@ -0,0 +1,74 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+from icloudpd.album_links import AlbumLinker
+from icloudpd.manifest import DownloadManifest
+
+
+class AlbumLinkerTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "Favorites"))
+        os.makedirs(os.path.join(self.directory, "Trip"))
+        self.manifest = DownloadManifest(
+            os.path.join(self.directory, "manifest.db"))
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.directory)
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def test_copy_of(self):
+        linker = AlbumLinker(self.directory, self.manifest)
+        favorites = self.path("Favorites", "IMG_1.JPG")
+        self.assertIsNone(linker.copy_of("1", "original", favorites))
+        self.assertEqual(
+            linker.copy_of("1", "original", self.path("Trip", "IMG_1.JPG")),
+            favorites)
+
+        # Downloaded in an earlier run
+        self.manifest.add("2", "original", "Favorites/IMG_2.JPG")
+        self.assertEqual(
+            linker.copy_of("2", "original", self.path("Trip", "IMG_2.JPG")),
+            self.path("Favorites", "IMG_2.JPG"))
+
+    def test_existing_path(self):
+        self.manifest.add("1", "original", "Favorites/IMG_1.JPG")
+        entry = self.manifest.lookup("1", "original")
+        linker = AlbumLinker(self.directory, self.manifest)
+        trip = self.path("Trip", "IMG_1.JPG")
+        self.assertEqual(
+            linker.existing_path(
+                "1", entry, self.path("Favorites", "IMG_1.JPG"),
+                self.path("Favorites")),
+            self.path("Favorites", "IMG_1.JPG"))
+        self.assertIsNone(
+            linker.existing_path("1", entry, trip, self.path("Trip")))
+
+        # Linked in an earlier run
+        self.manifest.add_link("1", "original", "Trip/IMG_1.JPG")
+        self.assertEqual(
+            linker.existing_path("1", entry, trip, self.path("Trip")), trip)
+
+    def test_link_all(self):
+        source = self.path("Favorites", "IMG_1.JPG")
+        with open(source, "wb") as file_obj:
+            file_obj.write(b"JPG")
+        self.manifest.add("1", "original", "Favorites/IMG_1.JPG")
+        linker = AlbumLinker(self.directory, self.manifest)
+        linker.defer_link("1", "original", source, self.path("Trip", "IMG_1.JPG"))
+        linker.defer_link(
+            "2", "original", self.path("Favorites", "IMG_2.JPG"),
+            self.path("Trip", "IMG_2.JPG"))
+
+        self.assertEqual(
+            linker.link_all(), (1, [self.path("Trip", "IMG_2.JPG")]))
+        self.assertTrue(
+            os.path.samefile(source, self.path("Trip", "IMG_1.JPG")))
+        self.assertEqual(
+            sorted(row["path"] for row in self.manifest.downloads_for("1")),
+            ["Favorites/IMG_1.JPG", "Trip/IMG_1.JPG"])
+        self.assertEqual(linker.link_all(), (0, []))
@@ -0,0 +1,65 @@
+from unittest import TestCase
+import datetime
+import mock
+import pytz
+from pyicloud_ipd.services.photos import PhotoAsset
+from icloudpd.asset_record import AssetRecord, AssetVersion, compact_records
+
+
+def photo_asset(download_url=True):
+    res = {"size": 10, "fileChecksum": "Abc="}
+    if download_url:
+        res["downloadURL"] = "https://example.com/IMG_0001.JPG"
+    master_record = {
+        "recordName": "ABC",
+        "fields": {
+            "filenameEnc": {"value": "SU1HXzAwMDEuSlBH"},
+            "itemType": {"value": "public.jpeg"},
+            "resOriginalRes": {"value": res},
+        },
+    }
+    asset_record = {
+        "recordName": "ASSET-ABC",
+        "fields": {"assetDate": {"value": 1533021744000}},
+    }
+    return PhotoAsset(mock.MagicMock(), master_record, asset_record)
+
+
+class AssetRecordTestCase(TestCase):
+    def test_from_photo(self):
+        photo = photo_asset()
+        record = AssetRecord.from_photo(photo)
+        self.assertEqual(record.id, "ABC")
+        self.assertEqual(record.filename, "IMG_0001.JPG")
+        self.assertEqual(
+            record.created,
+            datetime.datetime(2018, 7, 31, 7, 22, 24, tzinfo=pytz.utc))
+        self.assertEqual(record.item_type, "image")
+        self.assertEqual(record.asset_record_id, "ASSET-ABC")
+        self.assertEqual(record.versions, {"original": AssetVersion(
+            "IMG_0001.JPG", 10, "https://example.com/IMG_0001.JPG", "Abc=")})
+        # Records are compact, and extracted only once
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertIs(AssetRecord.from_photo(record), record)
+
+    def test_download(self):
+        photo = photo_asset()
+        record = AssetRecord.from_photo(photo)
+        response = record.download("original", headers={"Range": "bytes=5-"})
+        self.assertEqual(response, photo._service.session.get.return_value)
+        photo._service.session.get.assert_called_once_with(
+            "https://example.com/IMG_0001.JPG", stream=True,
+            headers={"Range": "bytes=5-"})
+        self.assertIsNone(record.download("medium"))
+
+    def test_compact_records_error_handler(self):
+        photos = [photo_asset(), photo_asset(download_url=False)]
+        with self.assertRaises(KeyError):
+            list(compact_records(photos))
+
+        errors = []
+        records = list(compact_records(
+            photos, lambda photo, ex: errors.append((photo, ex))))
+        self.assertEqual(len(records), 1)
+        self.assertIs(errors[0][0], photos[1])
+        self.assertEqual(str(errors[0][1]), "'downloadURL'")
@@ -2,9 +2,14 @@ from unittest import TestCase
 from vcr import VCR
 import pytest
 import os
+import threading
+import time
 import click
+import mock
 from click.testing import CliRunner
-from icloudpd.authentication import authenticate, TwoStepAuthRequiredError
+from icloudpd.authentication import (
+    authenticate, TwoStepAuthRequiredError, Reauthenticator,
+    reauthenticate, session_generation)
 import pyicloud_ipd
 from icloudpd.base import main
 
@@ -83,3 +88,76 @@ class AuthenticationTestCase(TestCase):
                 "INFO     All photos have been downloaded!", self._caplog.text
             )
             assert result.exit_code == 0
+
+
+class ReauthenticatorTestCase(TestCase):
+    def test_concurrent_session_errors_authenticate_once(self):
+        icloud = mock.MagicMock()
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow_authenticate():
+            started.set()
+            finish.wait(5)
+
+        icloud.authenticate.side_effect = slow_authenticate
+        generation = session_generation(icloud)
+
+        threads = [
+            threading.Thread(target=reauthenticate, args=(icloud, generation))
+            for _ in range(4)
+        ]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        finish.set()
+        for thread in threads:
+            thread.join()
+
+        icloud.authenticate.assert_called_once_with()
+        self.assertEqual(session_generation(icloud), generation + 1)
+
+        # A request that failed before the session was refreshed
+        # doesn't log in again
+        reauthenticate(icloud, generation)
+        icloud.authenticate.assert_called_once_with()
+
+        # A request that failed with the refreshed session does
+        reauthenticate(icloud, session_generation(icloud))
+        self.assertEqual(icloud.authenticate.call_count, 2)
+
+    def test_waiting_callers_share_the_error(self):
+        icloud = mock.MagicMock()
+        reauthenticator = Reauthenticator()
+        started = threading.Event()
+        finish = threading.Event()
+        errors = []
+
+        def failed_authenticate():
+            started.set()
+            finish.wait(5)
+            raise pyicloud_ipd.exceptions.PyiCloudFailedLoginException(
+                "Invalid email/password combination.")
+
+        def run():
+            try:
+                reauthenticator.reauthenticate(icloud, 0)
+            except pyicloud_ipd.exceptions.PyiCloudFailedLoginException as ex:
+                errors.append(ex)
+
+        icloud.authenticate.side_effect = failed_authenticate
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        # Let the other threads start waiting
+        time.sleep(0.1)
+        finish.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(icloud.authenticate.call_count, 1)
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(reauthenticator.generation, 0)
@@ -2,6 +2,9 @@ from unittest import TestCase
 from vcr import VCR
 import os
 import shutil
+import tempfile
+import datetime
+import pytz
 import click
 import pytest
 import mock
@@ -9,6 +12,8 @@ from click.testing import CliRunner
 import piexif
 from icloudpd.base import main
 import icloudpd.exif_datetime
+from icloudpd.autodelete import autodelete_photos
+from icloudpd.manifest import DownloadManifest
 
 vcr = VCR(decode_compressed_response=True, record_mode="new_episodes")
 
@@ -94,3 +99,81 @@ class AutodeletePhotosTestCase(TestCase):
             self.assertNotIn("IMG_7407-original.JPG", self._caplog.text)
 
             assert result.exit_code == 0
+
+
+class MockMedia(object):
+    def __init__(self, record_id, filename, created):
+        self.id = record_id
+        self.filename = filename
+        self.created = created
+        self.item_type = "image"
+        self.versions = {}
+        self._service = None
+
+
+class AutodeletePlanTestCase(TestCase):
+    @pytest.fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = DownloadManifest(os.path.join(self.directory, "manifest.db"))
+        self.icloud = mock.MagicMock()
+        # 23:30 UTC is already the next day in Berlin
+        self.media = MockMedia(
+            "AY6c+BsE", "IMG_7409.JPG",
+            datetime.datetime(2018, 7, 30, 23, 30, tzinfo=pytz.utc))
+        self.icloud.photos.albums = {"Recently Deleted": [self.media]}
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.directory)
+
+    def touch(self, path):
+        path = os.path.join(self.directory, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, "a").close()
+        return path
+
+    def autodelete(self, **kwargs):
+        with mock.patch("icloudpd.autodelete.get_localzone") as get_localzone_patched:
+            get_localzone_patched.return_value = pytz.timezone("Europe/Berlin")
+            autodelete_photos(
+                self.icloud, "{:%Y/%m/%d}", self.directory, **kwargs)
+
+    def test_uses_local_timezone(self):
+        path = self.touch("2018/07/31/IMG_7409.JPG")
+        other_day = self.touch("2018/07/30/IMG_7409.JPG")
+        self.autodelete()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(other_day))
+
+    def test_uses_manifest(self):
+        path = self.touch("2018/07/31/IMG_7409-AY6cBsE.JPG")
+        video_path = self.touch("2018/07/31/IMG_7409.MOV")
+        self.manifest.add(
+            "AY6c+BsE", "original", "2018/07/31/IMG_7409-AY6cBsE.JPG")
+        self.manifest.add(
+            "AY6c+BsE", "originalVideo", "2018/07/31/IMG_7409.MOV")
+        self.manifest.add("OTHER", "original", "2018/07/31/IMG_7410.JPG")
+
+        self.autodelete(download_manifest=self.manifest, threads_num=2)
+
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(video_path))
+        self.assertEqual(len(self.manifest), 1)
+        self.assertIn("Deleted 2 files from %s" % self.directory, self._caplog.text)
+
+    def test_dry_run(self):
+        path = self.touch("2018/07/31/IMG_7409.JPG")
+        self.manifest.add("AY6c+BsE", "original", "2018/07/31/IMG_7409.JPG")
+        self.autodelete(download_manifest=self.manifest, dry_run=True)
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(len(self.manifest), 1)
+        self.assertIn("Would delete %s" % path, self._caplog.text)
+        self.assertIn(
+            "Dry run: 1 files would be deleted from %s" % self.directory,
+            self._caplog.text)
@@ -0,0 +1,55 @@
+from unittest import TestCase, skipIf
+import multiprocessing
+import mock
+from icloudpd.bandwidth import BandwidthLimiter
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def consume_in_process(bandwidth, nbytes, result):
+    result.value = bandwidth.consume(nbytes)
+
+
+class BandwidthLimiterTestCase(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("icloudpd.bandwidth.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        bandwidth = BandwidthLimiter(100)
+        # The bucket starts full
+        self.assertEqual(bandwidth.consume(100), 0)
+        self.assertAlmostEqual(bandwidth.consume(50), 0.5)
+        self.assertAlmostEqual(bandwidth.consume(50), 0.5)
+        self.assertEqual(self.clock.now, 1001.0)
+
+    def test_large_chunks_keep_the_average_rate(self):
+        bandwidth = BandwidthLimiter(100)
+        self.assertEqual(bandwidth.consume(300), 0)
+        # 200 bytes of debt, and another 100 bytes
+        self.assertAlmostEqual(bandwidth.consume(100), 3.0)
+
+    @skipIf(getattr(multiprocessing, "get_start_method", lambda: "fork")()
+            != "fork", "The fake clock is only inherited by forked processes")
+    def test_shared_between_processes(self):
+        bandwidth = BandwidthLimiter(100, shared=True)
+        # The clock in the child process is the forked copy of this one
+        result = multiprocessing.Value("d", -1)
+        process = multiprocessing.Process(
+            target=consume_in_process, args=(bandwidth, 100, result))
+        process.start()
+        process.join()
+        self.assertEqual(result.value, 0)
+        # The child emptied the bucket
+        self.assertAlmostEqual(bandwidth.consume(50), 0.5)
@@ -0,0 +1,83 @@
+from unittest import TestCase
+import threading
+from icloudpd.concurrency import AdaptiveConcurrency
+
+
+class AdaptiveConcurrencyTestCase(TestCase):
+    def test_window_grows_from_initial_window(self):
+        concurrency = AdaptiveConcurrency(8)
+        self.assertEqual(concurrency.limit, 2)
+        self.assertEqual(concurrency.stats()["lowest_window"], 2)
+        for _ in range(100):
+            concurrency.succeeded(concurrency.acquire(), 0.1)
+        self.assertEqual(concurrency.limit, 8)
+        self.assertEqual(AdaptiveConcurrency(1).limit, 1)
+
+    def test_throttling_halves_window(self):
+        concurrency = AdaptiveConcurrency(8, initial_window=8)
+        concurrency.throttled(concurrency.acquire())
+        self.assertEqual(concurrency.limit, 4)
+        concurrency.throttled(concurrency.acquire())
+        self.assertEqual(concurrency.limit, 2)
+        self.assertEqual(concurrency.stats(), {
+            "window": 2,
+            "max_window": 8,
+            "lowest_window": 2,
+            "in_flight": 0,
+            "decreases": 2,
+        })
+
+    def test_cut_once_for_requests_in_flight(self):
+        concurrency = AdaptiveConcurrency(8, initial_window=8)
+        slots = [concurrency.acquire() for _ in range(4)]
+        for slot in slots:
+            concurrency.throttled(slot)
+        self.assertEqual(concurrency.limit, 4)
+        self.assertEqual(concurrency.stats()["decreases"], 1)
+
+    def test_window_does_not_go_below_minimum(self):
+        concurrency = AdaptiveConcurrency(4, min_window=2, initial_window=4)
+        for _ in range(5):
+            concurrency.throttled(concurrency.acquire())
+        self.assertEqual(concurrency.limit, 2)
+
+    def test_healthy_requests_grow_window(self):
+        concurrency = AdaptiveConcurrency(8, initial_window=8)
+        concurrency.throttled(concurrency.acquire())
+        concurrency.throttled(concurrency.acquire())
+        self.assertEqual(concurrency.limit, 2)
+        # About one more download per window of healthy downloads
+        for _ in range(3):
+            concurrency.succeeded(concurrency.acquire(), 0.1)
+        self.assertEqual(concurrency.limit, 3)
+        for _ in range(100):
+            concurrency.succeeded(concurrency.acquire(), 0.1)
+        self.assertEqual(concurrency.limit, 8)
+
+    def test_slow_requests_do_not_grow_window(self):
+        concurrency = AdaptiveConcurrency(8, initial_window=8)
+        concurrency.succeeded(concurrency.acquire(), 0.1)
+        concurrency.throttled(concurrency.acquire())
+        for _ in range(10):
+            concurrency.succeeded(concurrency.acquire(), 1.0)
+        self.assertEqual(concurrency.limit, 4)
+        self.assertEqual(concurrency.stats()["in_flight"], 0)
+
+    def test_acquire_waits_for_window(self):
+        concurrency = AdaptiveConcurrency(1)
+        slot = concurrency.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            concurrency.release(concurrency.acquire())
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        concurrency.release(slot)
+        # Releasing twice does nothing
+        concurrency.release(slot)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(concurrency.stats()["in_flight"], 0)
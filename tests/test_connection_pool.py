@@ -0,0 +1,39 @@
+from unittest import TestCase
+import mock
+import requests
+from requests.adapters import HTTPAdapter
+from icloudpd.connection_pool import configure_session, PooledHTTPAdapter
+
+
+class ConnectionPoolTestCase(TestCase):
+    def test_configure_session(self):
+        session = requests.Session()
+        content_adapter = configure_session(session, 16, timeout=30)
+
+        adapter = session.get_adapter(
+            "https://cvws.icloud-content.com/B/abc/IMG_7409.JPG")
+        self.assertIs(adapter, content_adapter)
+        self.assertEqual(adapter.timeout, 30)
+        self.assertEqual(adapter._pool_maxsize, 16)
+
+        other_adapter = session.get_adapter(
+            "https://p10-ckdatabasews.icloud.com/database/1")
+        self.assertIsInstance(other_adapter, PooledHTTPAdapter)
+        self.assertIsNot(other_adapter, content_adapter)
+        self.assertIsNone(other_adapter.timeout)
+        self.assertEqual(other_adapter._pool_maxsize, 16)
+
+    def test_pool_size_is_at_least_the_requests_default(self):
+        session = requests.Session()
+        adapter = configure_session(session, 1)
+        self.assertEqual(adapter._pool_maxsize, 10)
+
+    def test_default_timeout(self):
+        adapter = PooledHTTPAdapter(4, timeout=12)
+        with mock.patch.object(HTTPAdapter, "send") as send_mock:
+            adapter.send("request", timeout=None)
+            send_mock.assert_called_once_with(adapter, "request", timeout=12)
+
+        with mock.patch.object(HTTPAdapter, "send") as send_mock:
+            adapter.send("request", timeout=5)
+            send_mock.assert_called_once_with(adapter, "request", timeout=5)
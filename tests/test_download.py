@@ -0,0 +1,410 @@
+from unittest import TestCase
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import mock
+import piexif
+from requests.exceptions import ChunkedEncodingError
+from pyicloud_ipd.exceptions import PyiCloudAPIResponseError
+from icloudpd import download
+from icloudpd.retry import RetryLater, DownloadFailed
+from icloudpd.concurrency import AdaptiveConcurrency
+from icloudpd.asset_record import AssetVersion
+
+
+class MockResponse(object):
+    def __init__(self, chunks, status_code=200, error=None):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.error = error
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def mock_photo(content, responses):
+    photo = mock.MagicMock()
+    photo.filename = "IMG_0001.JPG"
+    photo.created = None
+    photo.versions = {"original": AssetVersion(
+        photo.filename, len(content), "https://", None)}
+    photo.download.side_effect = responses
+    return photo
+
+
+class DownloadMediaTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.download_path = os.path.join(self.directory, "IMG_0001.JPG")
+        self.part_path = self.download_path + ".part"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, "rb") as file_obj:
+            return file_obj.read()
+
+    def test_download_writes_part_file_and_renames(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [MockResponse([content])])
+
+        result = download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertTrue(result)
+        self.assertEqual(self.read(self.download_path), content)
+        self.assertFalse(os.path.exists(self.part_path))
+        photo.download.assert_called_once_with("original")
+
+    def test_fsync_before_rename(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [MockResponse([content])])
+
+        with mock.patch("icloudpd.download.replace_file") as replace_patched:
+            download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original",
+                fsync_policy="full")
+            replace_patched.assert_called_once_with(
+                self.part_path, self.download_path, "full")
+
+    def test_resume_after_interrupted_download(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            MockResponse([content[:4]], error=ChunkedEncodingError("Reset")),
+            MockResponse([content[4:]], status_code=206),
+        ])
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertTrue(result)
+        self.assertEqual(self.read(self.download_path), content)
+        self.assertFalse(os.path.exists(self.part_path))
+        photo.download.assert_called_with(
+            "original", headers={"Range": "bytes=4-"})
+
+    def test_resume_partial_file_from_previous_run(self):
+        content = b"0123456789"
+        with open(self.part_path, "wb") as file_obj:
+            file_obj.write(content[:6])
+        photo = mock_photo(content, [
+            MockResponse([content[6:]], status_code=206)])
+
+        download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertEqual(self.read(self.download_path), content)
+        photo.download.assert_called_once_with(
+            "original", headers={"Range": "bytes=6-"})
+
+    def test_range_not_supported_restarts_download(self):
+        content = b"0123456789"
+        with open(self.part_path, "wb") as file_obj:
+            file_obj.write(b"012")
+        photo = mock_photo(content, [MockResponse([content], status_code=200)])
+
+        download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertEqual(self.read(self.download_path), content)
+
+    def test_full_size_partial_file_restarts_download(self):
+        content = b"0123456789"
+        with open(self.part_path, "wb") as file_obj:
+            file_obj.write(b"\0" * len(content))
+        photo = mock_photo(content, [MockResponse([content])])
+
+        download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertEqual(self.read(self.download_path), content)
+        photo.download.assert_called_once_with("original")
+
+    def test_failed_download_keeps_part_file(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            MockResponse([content[:3]], error=ChunkedEncodingError("Reset"))
+            for _ in range(5)
+        ])
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(self.download_path))
+        self.assertTrue(os.path.exists(self.part_path))
+
+    def test_set_exif_date_while_downloading(self):
+        content = b"\xff\xd8\xff\xdb\x00\x04\x00\x00\xff\xd9"
+        photo = mock_photo(content, [MockResponse([content[:3], content[3:]])])
+
+        download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original",
+            exif_date="2018:07:31 07:22:24")
+
+        data = self.read(self.download_path)
+        self.assertTrue(data.startswith(b"\xff\xd8\xff\xe1"))
+        self.assertTrue(data.endswith(content[2:]))
+        length = struct.unpack(">H", data[4:6])[0]
+        self.assertEqual(
+            piexif.load(data[6:4 + length])["Exif"][36867],
+            b"2018:07:31 07:22:24")
+
+    def test_interrupted_exif_download_is_not_resumed(self):
+        content = b"\xff\xd8\xff\xdb\x00\x04\x00\x00\xff\xd9"
+        photo = mock_photo(content, [
+            MockResponse([content[:6]], error=KeyboardInterrupt()),
+            MockResponse([content])])
+
+        # e.g. Ctrl-C, which isn't handled like a download error
+        with self.assertRaises(KeyboardInterrupt):
+            download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original",
+                exif_date="2018:07:31 07:22:24")
+        self.assertFalse(os.path.exists(self.part_path))
+        self.assertTrue(os.path.exists(
+            download.injected_download_path(self.download_path)))
+
+        # The next run starts again from the first byte
+        self.assertTrue(download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original",
+            exif_date="2018:07:31 07:22:24"))
+        self.assertNotIn("headers", photo.download.call_args[1])
+        data = self.read(self.download_path)
+        self.assertTrue(data.startswith(b"\xff\xd8\xff\xe1"))
+        self.assertTrue(data.endswith(content[2:]))
+        self.assertFalse(os.path.exists(
+            download.injected_download_path(self.download_path)))
+
+    def test_exif_date_not_set_when_resuming(self):
+        content = b"\xff\xd8\xff\xdb\x00\x04\x00\x00\xff\xd9"
+        with open(self.part_path, "wb") as file_obj:
+            file_obj.write(content[:6])
+        photo = mock_photo(content, [
+            MockResponse([content[6:]], status_code=206)])
+
+        download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original",
+            exif_date="2018:07:31 07:22:24")
+
+        self.assertEqual(self.read(self.download_path), content)
+
+    def test_deferred_retry_resumes_download(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            MockResponse([content[:4]], error=ChunkedEncodingError("Reset")),
+            MockResponse([content[4:]], status_code=206),
+        ])
+
+        with mock.patch("time.sleep") as sleep_mock:
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original",
+                defer_retries=True)
+
+            self.assertIsInstance(result, RetryLater)
+            self.assertFalse(result)
+            self.assertEqual(result.retries, 1)
+            self.assertTrue(os.path.exists(self.part_path))
+
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original",
+                retries=result.retries, defer_retries=True)
+
+        self.assertTrue(result)
+        self.assertEqual(self.read(self.download_path), content)
+        sleep_mock.assert_not_called()
+
+    def test_last_retry_is_not_deferred(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            MockResponse([content[:3]], error=ChunkedEncodingError("Reset"))
+        ])
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original",
+                retries=4, defer_retries=True)
+
+        self.assertIsInstance(result, DownloadFailed)
+        self.assertEqual(str(result), "Reset")
+
+    def test_throttled_download_reduces_concurrency(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            PyiCloudAPIResponseError("Service Unavailable", 503),
+            MockResponse([content]),
+        ])
+        concurrency = AdaptiveConcurrency(4)
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original",
+                concurrency=concurrency)
+
+        self.assertTrue(result)
+        self.assertEqual(concurrency.stats()["decreases"], 1)
+        self.assertEqual(concurrency.stats()["in_flight"], 0)
+
+
+def mock_range_photo(content, status_code=206, fail_ranges=()):
+    """A photo whose download() supports Range requests"""
+    photo = mock_photo(content, None)
+    failed = set()
+
+    def download(size, headers=None):
+        if headers is None or status_code != 206:
+            return MockResponse([content], status_code=200)
+        start, end = headers["Range"][len("bytes="):].split("-")
+        start, end = int(start), int(end)
+        if start in fail_ranges and start not in failed:
+            failed.add(start)
+            return MockResponse(
+                [content[start:end]], status_code=206,
+                error=ChunkedEncodingError("Reset"))
+        return MockResponse([content[start:end + 1]], status_code=206)
+
+    photo.download.side_effect = download
+    return photo
+
+
+class SegmentedDownloadTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.download_path = os.path.join(self.directory, "IMG_0001.MOV")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, "rb") as file_obj:
+            return file_obj.read()
+
+    def test_segment_ranges(self):
+        self.assertEqual(
+            download.segment_ranges(10, 4), [(0, 2), (3, 5), (6, 8), (9, 9)])
+        self.assertEqual(download.segment_ranges(2, 4), [(0, 0), (1, 1)])
+
+    def test_segmented_download(self):
+        content = bytes(bytearray(range(256))) * 4
+        photo = mock_range_photo(content)
+
+        result = download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original",
+            segment_threshold=1000, segments=4)
+
+        self.assertTrue(result)
+        self.assertEqual(self.read(self.download_path), content)
+        self.assertEqual(
+            sorted(c[1]["headers"]["Range"]
+                   for c in photo.download.call_args_list),
+            ["bytes=0-255", "bytes=256-511", "bytes=512-767", "bytes=768-1023"])
+
+    def test_small_files_are_not_segmented(self):
+        content = b"0123456789"
+        photo = mock_range_photo(content)
+
+        result = download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original",
+            segment_threshold=1000, segments=4)
+
+        self.assertTrue(result)
+        photo.download.assert_called_once_with("original")
+
+    def test_server_without_range_support(self):
+        content = b"0123456789" * 10
+        photo = mock_range_photo(content, status_code=200)
+
+        result = download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original",
+            segment_threshold=10, segments=4)
+
+        self.assertTrue(result)
+        self.assertEqual(self.read(self.download_path), content)
+        self.assertEqual(photo.download.call_count, 2)
+
+    def test_failed_segment_is_retried(self):
+        content = b"0123456789" * 10
+        photo = mock_range_photo(content, fail_ranges=(50,))
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original",
+                segment_threshold=10, segments=4)
+
+        self.assertTrue(result)
+        self.assertEqual(self.read(self.download_path), content)
+        self.assertEqual(photo.download.call_count, 8)
+
+
+class DownloadVerificationTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.download_path = os.path.join(self.directory, "IMG_0001.JPG")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sha256_of_download(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [MockResponse([content])])
+
+        result = download.download_media(
+            mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertEqual(result.sha256, hashlib.sha256(content).hexdigest())
+
+    def test_sha256_of_resumed_download(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            MockResponse([content[:4]], error=ChunkedEncodingError("Reset")),
+            MockResponse([content[4:]], status_code=206),
+        ])
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertEqual(result.sha256, hashlib.sha256(content).hexdigest())
+
+    def test_size_mismatch_is_retried(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            # The connection was closed without an error
+            MockResponse([content[:4]]),
+            MockResponse([content[4:]], status_code=206),
+        ])
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertTrue(result)
+        with open(self.download_path, "rb") as file_obj:
+            self.assertEqual(file_obj.read(), content)
+        self.assertEqual(photo.download.call_count, 2)
+
+    def test_too_many_bytes_start_again(self):
+        content = b"0123456789"
+        photo = mock_photo(content, [
+            MockResponse([content + b"extra"]),
+            MockResponse([content]),
+        ])
+
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            result = download.download_media(
+                mock.MagicMock(), photo, self.download_path, "original")
+
+        self.assertEqual(result.sha256, hashlib.sha256(content).hexdigest())
+        photo.download.assert_called_with("original")
@@ -9,6 +9,8 @@ import pytest
 import mock
 import tzlocal
 import datetime
+import threading
+import pytz
 from mock import call, ANY
 from click.testing import CliRunner
 import piexif
@@ -18,6 +20,7 @@ from pyicloud_ipd.base import PyiCloudService
 from pyicloud_ipd.exceptions import PyiCloudAPIResponseError
 from requests.exceptions import ConnectionError
 from icloudpd.base import main
+from icloudpd.asset_record import AssetRecord, AssetVersion
 import icloudpd.constants
 from tests.helpers.print_result_exception import print_result_exception
 
@@ -115,16 +118,19 @@ class DownloadPhotoTestCase(TestCase):
         open("tests/fixtures/Photos/2018/07/30/IMG_7407.JPG", "a").close()
 
         # Download the first photo, but mock the video download
-        orig_download = PhotoAsset.download
+        orig_download = AssetRecord.download
 
         def mocked_download(self, size):
-            if not hasattr(PhotoAsset, "already_downloaded"):
+            if not hasattr(AssetRecord, "already_downloaded"):
                 response = orig_download(self, size)
-                setattr(PhotoAsset, "already_downloaded", True)
+                setattr(AssetRecord, "already_downloaded", True)
                 return response
             return mock.MagicMock()
 
-        with mock.patch.object(PhotoAsset, "download", new=mocked_download):
+        # The mocked video responses are empty, so they fail the size
+        # check and are retried without waiting
+        with mock.patch.object(AssetRecord, "download", new=mocked_download), \
+                mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
             with mock.patch(
                 "icloudpd.exif_datetime.get_photo_exif"
             ) as get_exif_patched:
@@ -337,7 +343,8 @@ class DownloadPhotoTestCase(TestCase):
                             ANY, ANY, "%s/%s" % (base_dir, f[0]),
                             "mediumVideo" if (
                                 f[1] == 'photo' and f[0].endswith('.MOV')
-                            ) else "original"),
+                            ) else "original",
+                            defer_retries=True, mtime=ANY),
                         files_to_download,
                     )
                 )
@@ -420,7 +427,7 @@ class DownloadPhotoTestCase(TestCase):
                 raise PyiCloudAPIResponseError("Invalid global session", 100)
 
             with mock.patch("time.sleep") as sleep_mock:
-                with mock.patch.object(PhotoAsset, "download") as pa_download:
+                with mock.patch.object(AssetRecord, "download") as pa_download:
                     pa_download.side_effect = mock_raise_response_error
 
                     # Let the initial authenticate() call succeed,
@@ -547,7 +554,7 @@ class DownloadPhotoTestCase(TestCase):
             def mock_raise_response_error(arg):
                 raise ConnectionError("Connection Error")
 
-            with mock.patch.object(PhotoAsset, "download") as pa_download:
+            with mock.patch.object(AssetRecord, "download") as pa_download:
                 pa_download.side_effect = mock_raise_response_error
 
                 # Let the initial authenticate() call succeed,
@@ -582,12 +589,13 @@ class DownloadPhotoTestCase(TestCase):
                         )
                         print_result_exception(result)
 
-                        # Error msg should be repeated 5 times
+                        # Error msg should be repeated for the 4 retries,
+                        # but not after the last attempt
                         assert (
                             self._caplog.text.count(
                                 "Error downloading IMG_7409.JPG, retrying after 0 seconds..."
                             )
-                            == 5
+                            == 4
                         )
 
                         self.assertIn(
@@ -602,7 +610,7 @@ class DownloadPhotoTestCase(TestCase):
             shutil.rmtree("tests/fixtures/Photos")
         os.makedirs("tests/fixtures/Photos")
 
-        with mock.patch.object(PhotoAsset, "download") as pa_download:
+        with mock.patch.object(AssetRecord, "download") as pa_download:
             pa_download.return_value = False
 
             with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
@@ -711,6 +719,7 @@ class DownloadPhotoTestCase(TestCase):
                         ANY,
                         "tests/fixtures/Photos/2018/07/31/IMG_7409.JPG",
                         "original",
+                        defer_retries=True, mtime=ANY,
                     )
 
                     assert result.exit_code == 0
@@ -952,3 +961,263 @@ class DownloadPhotoTestCase(TestCase):
                     dp_patched.assert_not_called
 
                     assert result.exit_code == 0
+
+    def test_download_photos_with_threads(self):
+        base_dir = "tests/fixtures/Photos"
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+
+            with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+                # Pass fixed client ID via environment variable
+                os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+                runner = CliRunner()
+                result = runner.invoke(
+                    main,
+                    [
+                        "--username",
+                        "jdoe@gmail.com",
+                        "--password",
+                        "password1",
+                        "--recent",
+                        "5",
+                        "--skip-live-photos",
+                        "--threads-num",
+                        "3",
+                        "--no-progress-bar",
+                        "-d",
+                        base_dir,
+                    ],
+                )
+                print_result_exception(result)
+
+                # Downloads can finish in any order
+                dp_patched.assert_has_calls(
+                    [
+                        call(ANY, ANY, "%s/2018/07/31/IMG_7409.JPG" % base_dir, "original", defer_retries=True, mtime=ANY,
+                             concurrency=ANY),
+                        call(ANY, ANY, "%s/2018/07/30/IMG_7408.JPG" % base_dir, "original", defer_retries=True, mtime=ANY,
+                             concurrency=ANY),
+                        call(ANY, ANY, "%s/2018/07/30/IMG_7407.JPG" % base_dir, "original", defer_retries=True, mtime=ANY,
+                             concurrency=ANY),
+                        call(ANY, ANY, "%s/2018/07/30/IMG_7405.MOV" % base_dir, "original", defer_retries=True, mtime=ANY,
+                             concurrency=ANY),
+                        call(ANY, ANY, "%s/2018/07/30/IMG_7404.MOV" % base_dir, "original", defer_retries=True, mtime=ANY,
+                             concurrency=ANY),
+                    ],
+                    any_order=True,
+                )
+                self.assertEqual(dp_patched.call_count, 5)
+                self.assertIn(
+                    "INFO     All photos have been downloaded!", self._caplog.text
+                )
+                assert result.exit_code == 0
+
+    def test_same_path_is_not_downloaded_twice_with_threads(self):
+        base_dir = "tests/fixtures/Photos"
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+
+        created = datetime.datetime(2018, 7, 31, 12, tzinfo=pytz.utc)
+        photos = [
+            AssetRecord(
+                None, record_id, "IMG_0001.JPG", created, "image",
+                {"original": AssetVersion("IMG_0001.JPG", 3, "https://", None)})
+            for record_id in ("A", "B")]
+        album = mock.MagicMock()
+        album.__iter__.side_effect = lambda: iter(photos)
+        album.__len__.return_value = len(photos)
+        icloud = mock.MagicMock()
+        icloud.photos.albums = {"All Photos": album}
+
+        # The first download is still running when the second photo
+        # is planned (unless the second one is downloaded too)
+        second_download = threading.Event()
+
+        def download_media(*args, **kwargs):
+            if second_download.is_set():
+                return True
+            if dp_patched.call_count > 1:
+                second_download.set()
+            second_download.wait(1)
+            return True
+
+        with mock.patch("icloudpd.base.authenticate") as auth_patched, \
+                mock.patch("icloudpd.download.download_media") as dp_patched:
+            auth_patched.return_value = icloud
+            dp_patched.side_effect = download_media
+            runner = CliRunner()
+            result = runner.invoke(
+                main,
+                [
+                    "--username",
+                    "jdoe@gmail.com",
+                    "--password",
+                    "password1",
+                    "--skip-live-photos",
+                    "--threads-num",
+                    "2",
+                    "--no-progress-bar",
+                    "-d",
+                    base_dir,
+                ],
+            )
+            print_result_exception(result)
+            assert result.exit_code == 0
+            self.assertEqual(dp_patched.call_count, 1)
+            self.assertIn(
+                "INFO     %s/2018/07/31/IMG_0001.JPG already exists." % base_dir,
+                self._caplog.text)
+
+    def test_segmented_download_options(self):
+        base_dir = "tests/fixtures/Photos"
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+
+            with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+                # Pass fixed client ID via environment variable
+                os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+                runner = CliRunner()
+                result = runner.invoke(
+                    main,
+                    [
+                        "--username",
+                        "jdoe@gmail.com",
+                        "--password",
+                        "password1",
+                        "--recent",
+                        "1",
+                        "--skip-live-photos",
+                        "--segmented-download-threshold",
+                        "2",
+                        "--download-segments",
+                        "3",
+                        "--no-progress-bar",
+                        "-d",
+                        base_dir,
+                    ],
+                )
+                print_result_exception(result)
+
+                dp_patched.assert_called_once_with(
+                    ANY, ANY, "%s/2018/07/31/IMG_7409.JPG" % base_dir,
+                    "original", defer_retries=True, mtime=ANY,
+                    segment_threshold=2 * 1024 * 1024, segments=3)
+                assert result.exit_code == 0
+
+    def test_download_photos_with_prefetch(self):
+        base_dir = "tests/fixtures/Photos"
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+
+            with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+                # Pass fixed client ID via environment variable
+                os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+                runner = CliRunner()
+                result = runner.invoke(
+                    main,
+                    [
+                        "--username",
+                        "jdoe@gmail.com",
+                        "--password",
+                        "password1",
+                        "--recent",
+                        "3",
+                        "--skip-live-photos",
+                        "--page-size",
+                        "2",
+                        "--prefetch-pages",
+                        "2",
+                        "--no-progress-bar",
+                        "-d",
+                        base_dir,
+                    ],
+                )
+                print_result_exception(result)
+
+                dp_patched.assert_has_calls(
+                    [
+                        call(ANY, ANY, "%s/2018/07/31/IMG_7409.JPG" % base_dir, "original", defer_retries=True, mtime=ANY),
+                        call(ANY, ANY, "%s/2018/07/30/IMG_7408.JPG" % base_dir, "original", defer_retries=True, mtime=ANY),
+                        call(ANY, ANY, "%s/2018/07/30/IMG_7407.JPG" % base_dir, "original", defer_retries=True, mtime=ANY),
+                    ]
+                )
+                self.assertIn(
+                    "INFO     All photos have been downloaded!", self._caplog.text
+                )
+                assert result.exit_code == 0
+
+    def test_handle_session_error_during_prefetch(self):
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+
+        with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+            # Pass fixed client ID via environment variable
+            os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+
+            def mock_raise_response_error(offset):
+                raise PyiCloudAPIResponseError("Invalid global session", 100)
+
+            with mock.patch("time.sleep") as sleep_mock:
+                with mock.patch.object(PhotoAlbum, "photos_request") as pa_photos_request:
+                    pa_photos_request.side_effect = mock_raise_response_error
+
+                    # Let the initial authenticate() call succeed,
+                    # but do nothing on the second try.
+                    orig_authenticate = PyiCloudService.authenticate
+
+                    def mocked_authenticate(self):
+                        if not hasattr(self, "already_authenticated"):
+                            orig_authenticate(self)
+                            setattr(self, "already_authenticated", True)
+
+                    with mock.patch.object(
+                        PyiCloudService, "authenticate", new=mocked_authenticate
+                    ):
+                        runner = CliRunner()
+                        result = runner.invoke(
+                            main,
+                            [
+                                "--username",
+                                "jdoe@gmail.com",
+                                "--password",
+                                "password1",
+                                "--recent",
+                                "1",
+                                "--prefetch-pages",
+                                "1",
+                                "--skip-videos",
+                                "--skip-live-photos",
+                                "--no-progress-bar",
+                                "-d",
+                                "tests/fixtures/Photos",
+                            ],
+                        )
+
+                        # The exception handler runs in the prefetch thread
+                        assert (
+                            self._caplog.text.count(
+                                "Session error, re-authenticating..."
+                            )
+                            == 5
+                        )
+                        self.assertIn(
+                            "INFO     iCloud re-authentication failed! Please try again later.",
+                            self._caplog.text,
+                        )
+                        self.assertEqual(sleep_mock.call_count, 4)
+                        self.assertIsInstance(
+                            result.exception, PyiCloudAPIResponseError)
@@ -0,0 +1,65 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import mock
+from icloudpd.durability import replace_file, link_file
+
+
+class ReplaceFileTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "IMG_0001.JPG")
+        self.temp_path = self.path + ".part"
+        with open(self.temp_path, "wb") as file_obj:
+            file_obj.write(b"new")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def replace(self, fsync_policy):
+        with open(self.path, "wb") as file_obj:
+            file_obj.write(b"old")
+        with mock.patch("os.fsync") as fsync_patched:
+            replace_file(self.temp_path, self.path, fsync_policy)
+        self.assertFalse(os.path.exists(self.temp_path))
+        with open(self.path, "rb") as file_obj:
+            self.assertEqual(file_obj.read(), b"new")
+        return fsync_patched.call_count
+
+    def test_no_fsync(self):
+        self.assertEqual(self.replace("none"), 0)
+
+    def test_fsync_file(self):
+        self.assertEqual(self.replace("file"), 1)
+
+    def test_fsync_file_and_directory(self):
+        expected = 2 if hasattr(os, "O_DIRECTORY") else 1
+        self.assertEqual(self.replace("full"), expected)
+
+
+class LinkFileTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "IMG_0001.JPG")
+        self.path = os.path.join(self.directory, "IMG_0001-link.JPG")
+        with open(self.source, "wb") as file_obj:
+            file_obj.write(b"JPG")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hard_link(self):
+        self.assertEqual(link_file(self.source, self.path), "hardlink")
+        self.assertTrue(os.path.samefile(self.source, self.path))
+
+    def test_copy_when_links_are_not_supported(self):
+        with mock.patch("os.link") as link_patched, \
+                mock.patch("icloudpd.durability.reflink") as reflink_patched:
+            link_patched.side_effect = OSError("Invalid cross-device link")
+            reflink_patched.side_effect = IOError("Operation not supported")
+            self.assertEqual(link_file(self.source, self.path), "copy")
+        self.assertFalse(os.path.samefile(self.source, self.path))
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        with open(self.path, "rb") as file_obj:
+            self.assertEqual(file_obj.read(), b"JPG")
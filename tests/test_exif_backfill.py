@@ -0,0 +1,108 @@
+from unittest import TestCase
+from vcr import VCR
+import io
+import os
+import shutil
+import tempfile
+import mock
+import piexif
+import pytest
+from click.testing import CliRunner
+from icloudpd.base import main
+from icloudpd.exif_backfill import backfill_exif
+from icloudpd.exif_datetime import get_photo_exif
+from tests.helpers.print_result_exception import print_result_exception
+
+vcr = VCR(decode_compressed_response=True)
+
+FIXTURE = "tests/fixtures/IMG_7409-original.JPG"
+
+
+def write_photo_without_exif(path):
+    with open(FIXTURE, "rb") as file_obj:
+        data = file_obj.read()
+    output = io.BytesIO()
+    piexif.remove(data, output)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as file_obj:
+        file_obj.write(output.getvalue())
+    os.utime(path, (1533021744, 1533021744))
+
+
+class BackfillExifTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_backfill(self):
+        tasks = []
+        for i in range(4):
+            path = os.path.join(self.directory, "IMG_%d.JPG" % i)
+            write_photo_without_exif(path)
+            tasks.append((path, "2018:07:31 07:22:%02d" % i))
+        # Already has a date
+        shutil.copyfile(FIXTURE, os.path.join(self.directory, "IMG_4.JPG"))
+        tasks.append((os.path.join(self.directory, "IMG_4.JPG"), "2018:07:31 07:22:04"))
+
+        self.assertEqual(backfill_exif(tasks, processes=2), 4)
+        for path, date in tasks[:4]:
+            self.assertEqual(get_photo_exif(path), date.encode())
+            # The modification time is kept
+            self.assertEqual(os.path.getmtime(path), 1533021744)
+        self.assertEqual(
+            get_photo_exif(tasks[4][0]), b"2018:07:31 14:22:26")
+
+        # Running it again doesn't change anything
+        self.assertEqual(backfill_exif(tasks), 0)
+
+
+class BackfillExifDownloadTestCase(TestCase):
+    @pytest.fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setUp(self):
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+
+    def test_backfill_exif(self):
+        write_photo_without_exif("tests/fixtures/Photos/2018/07/31/IMG_7409.JPG")
+
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+                # Pass fixed client ID via environment variable
+                os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+                runner = CliRunner()
+                result = runner.invoke(
+                    main,
+                    [
+                        "--username",
+                        "jdoe@gmail.com",
+                        "--password",
+                        "password1",
+                        "--recent",
+                        "3",
+                        "--no-progress-bar",
+                        "--backfill-exif",
+                        "-d",
+                        "tests/fixtures/Photos",
+                    ],
+                )
+                print_result_exception(result)
+            dp_patched.assert_not_called()
+
+        self.assertIn(
+            "INFO     Setting EXIF dates on 1 downloaded photos...",
+            self._caplog.text,
+        )
+        self.assertIn(
+            "INFO     Set the EXIF date on 1 photos.", self._caplog.text
+        )
+        self.assertNotIn("All photos have been downloaded!", self._caplog.text)
+        self.assertTrue(get_photo_exif(
+            "tests/fixtures/Photos/2018/07/31/IMG_7409.JPG").startswith(b"2018:07:3"))
+        assert result.exit_code == 0
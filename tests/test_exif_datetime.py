@@ -0,0 +1,135 @@
+from unittest import TestCase
+import io
+import os
+import shutil
+import tempfile
+import piexif
+from icloudpd.exif_datetime import (
+    ExifDateInjector, get_photo_exif, read_exif_segment, set_photo_exif)
+
+FIXTURE = "tests/fixtures/IMG_7409-original.JPG"
+DATE = "2018:07:31 07:22:24"
+
+
+def read(path):
+    with open(path, "rb") as file_obj:
+        return file_obj.read()
+
+
+def inject(data, date=DATE, chunk_size=4096):
+    injector = ExifDateInjector(date)
+    output = io.BytesIO()
+    for start in range(0, len(data), chunk_size):
+        output.write(injector.feed(data[start:start + chunk_size]))
+    output.write(injector.finish())
+    return output.getvalue(), injector
+
+
+class ExifDateInjectorTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.jpeg = read(FIXTURE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def set_photo_exif(self, data):
+        """Returns the bytes that set_photo_exif writes for data"""
+        path = os.path.join(self.directory, "photo.jpg")
+        with open(path, "wb") as file_obj:
+            file_obj.write(data)
+        set_photo_exif(path, DATE)
+        return read(path)
+
+    def test_set_photo_exif_replaces_photo(self):
+        path = os.path.join(self.directory, "photo.jpg")
+        with open(path, "wb") as file_obj:
+            file_obj.write(self.jpeg)
+        set_photo_exif(path, DATE, "file")
+        self.assertEqual(os.listdir(self.directory), ["photo.jpg"])
+        self.assertEqual(
+            piexif.load(path)["Exif"][36867], DATE.encode("ascii"))
+
+    def test_keeps_existing_date(self):
+        output, injector = inject(self.jpeg)
+        self.assertEqual(output, self.jpeg)
+        self.assertFalse(injector.injected)
+
+    def test_adds_missing_date(self):
+        exif_dict = piexif.load(self.jpeg)
+        del exif_dict["Exif"][36867]
+        output = io.BytesIO()
+        piexif.insert(piexif.dump(exif_dict), self.jpeg, output)
+        jpeg = output.getvalue()
+
+        output, injector = inject(jpeg)
+        self.assertTrue(injector.injected)
+        self.assertEqual(piexif.load(output)["Exif"][36867], DATE.encode())
+        self.assertEqual(output, self.set_photo_exif(jpeg))
+
+    def test_inserts_exif_segment(self):
+        output = io.BytesIO()
+        piexif.remove(self.jpeg, output)
+        jpeg = output.getvalue()
+
+        # Feed the file one byte at a time through the header
+        output, injector = inject(jpeg, chunk_size=1)
+        self.assertTrue(injector.injected)
+        self.assertEqual(piexif.load(output)["Exif"][36867], DATE.encode())
+        self.assertEqual(output, self.set_photo_exif(jpeg))
+
+    def test_passes_through_other_files(self):
+        data = b"\x00\x00\x00\x18ftypqt  " + b"\x00" * 100
+        output, injector = inject(data, chunk_size=7)
+        self.assertEqual(output, data)
+        self.assertFalse(injector.injected)
+
+    def test_truncated_header(self):
+        data = self.jpeg[:100]
+        output, injector = inject(data)
+        self.assertEqual(output, data)
+        self.assertFalse(injector.injected)
+
+
+class ReadExifSegmentTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.jpeg = read(FIXTURE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        path = os.path.join(self.directory, "photo.jpg")
+        with open(path, "wb") as file_obj:
+            file_obj.write(data)
+        return path
+
+    def test_reads_only_the_header(self):
+        file_obj = io.BytesIO(self.jpeg)
+        exif_data = read_exif_segment(file_obj)
+        self.assertTrue(exif_data.startswith(b"Exif\x00\x00"))
+        self.assertTrue(file_obj.tell() < 32 * 1024)
+        self.assertEqual(
+            piexif.load(exif_data)["Exif"][36867],
+            piexif.load(self.jpeg)["Exif"][36867])
+
+    def test_get_photo_exif(self):
+        self.assertEqual(get_photo_exif(FIXTURE), b"2018:07:31 14:22:26")
+
+    def test_no_exif(self):
+        output = io.BytesIO()
+        piexif.remove(self.jpeg, output)
+        self.assertEqual(read_exif_segment(io.BytesIO(output.getvalue())), b"")
+        self.assertIsNone(get_photo_exif(self.write(output.getvalue())))
+
+    def test_padded_and_truncated_markers(self):
+        data = b"\xff\xd8\xff\xff\xff\xe0\x00\x04\x00\x00" + self.jpeg[2:]
+        self.assertEqual(
+            read_exif_segment(io.BytesIO(data)),
+            read_exif_segment(io.BytesIO(self.jpeg)))
+        self.assertEqual(read_exif_segment(io.BytesIO(self.jpeg[:10])), b"")
+
+    def test_not_a_jpeg(self):
+        self.assertIsNone(read_exif_segment(io.BytesIO(b"GIF89a")))
+        self.assertIsNone(get_photo_exif(self.write(b"GIF89a")))
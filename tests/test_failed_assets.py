@@ -0,0 +1,78 @@
+from unittest import TestCase
+import json
+import mock
+from pyicloud_ipd.exceptions import PyiCloudAPIResponseError
+from icloudpd.failed_assets import lookup_photos, retry_failed_first
+
+
+def records(record_id):
+    return [
+        {"recordName": record_id, "recordType": "CPLMaster", "fields": {}},
+        {"recordName": "ASSET-%s" % record_id, "recordType": "CPLAsset",
+         "fields": {"masterRef": {"value": {"recordName": record_id}}}},
+    ]
+
+
+def failure(record_id, asset_record_id="", version="original"):
+    if asset_record_id == "":
+        asset_record_id = "ASSET-%s" % record_id
+    return {"record_id": record_id, "version": version,
+            "asset_record_id": asset_record_id}
+
+
+def mock_service(response_records):
+    service = mock.MagicMock()
+    service._service_endpoint = "https://example.com/database"
+    service.params = {"dsid": "123"}
+    service.session.post.return_value.json.return_value = {
+        "records": response_records}
+    return service
+
+
+class LookupPhotosTestCase(TestCase):
+    def test_lookup_photos(self):
+        service = mock_service(records("A") + records("B") + [
+            {"recordName": "C", "serverErrorCode": "NOT_FOUND"},
+            {"recordName": "ASSET-C", "serverErrorCode": "NOT_FOUND"},
+        ])
+        photos, missing = lookup_photos(service, [
+            failure("A"), failure("A", version="originalVideo"),
+            failure("B"), failure("C"), failure("D", asset_record_id=None),
+        ])
+        self.assertEqual([photo.id for photo in photos], ["A", "B"])
+
+        service.session.post.assert_called_once()
+        url = service.session.post.call_args[0][0]
+        self.assertEqual(
+            url, "https://example.com/database/records/lookup?dsid=123")
+        body = json.loads(service.session.post.call_args[1]["data"])
+        self.assertEqual(
+            [record["recordName"] for record in body["records"]],
+            ["A", "B", "C", "ASSET-A", "ASSET-B", "ASSET-C"])
+        # D was stored without an asset record ID, so it can't be looked up
+        self.assertEqual(missing, {"C", "D"})
+
+    def test_retry_failed_first(self):
+        service = mock_service(records("B"))
+        manifest = mock.MagicMock()
+        manifest.failed_assets.return_value = [failure("B"), failure("X")]
+        listed = [mock.MagicMock(id=record_id) for record_id in "ABC"]
+
+        photos = list(retry_failed_first(manifest, service, listed))
+
+        self.assertEqual([photo.id for photo in photos], ["B", "A", "C"])
+        # X was deleted from iCloud
+        manifest.remove_failure.assert_called_once_with("X")
+
+    def test_lookup_error(self):
+        service = mock_service([])
+        service.session.post.side_effect = PyiCloudAPIResponseError(
+            "Service Unavailable", 503)
+        manifest = mock.MagicMock()
+        manifest.failed_assets.return_value = [failure("B")]
+        listed = [mock.MagicMock(id="A")]
+
+        photos = list(retry_failed_first(manifest, service, listed))
+
+        self.assertEqual(photos, listed)
+        manifest.remove_failure.assert_not_called()
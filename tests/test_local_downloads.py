@@ -0,0 +1,86 @@
+from unittest import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+import pytz
+from icloudpd.asset_record import AssetRecord, AssetVersion
+from icloudpd.local_downloads import LocalDownloads
+from icloudpd.local_index import LocalFileIndex
+from icloudpd.manifest import DownloadManifest
+
+
+def record(record_id):
+    filename = "IMG_%s.JPG" % record_id
+    return AssetRecord(
+        None, record_id, filename,
+        datetime.datetime(2018, 7, 31, 12, tzinfo=pytz.utc), "image",
+        {"original": AssetVersion(filename, 3, "https://", None)})
+
+
+class LocalDownloadsTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = DownloadManifest(
+            os.path.join(self.directory, "manifest.db"))
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.directory)
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def test_find_in_manifest(self):
+        downloads = LocalDownloads(self.directory, self.manifest)
+        self.assertIsNone(
+            downloads.find(record("1"), "original", self.path("IMG_1.JPG")))
+        self.manifest.add("1", "original", "2018/IMG_1.JPG")
+        self.assertEqual(
+            downloads.find(record("1"), "original", self.path("IMG_1.JPG")),
+            self.path("2018", "IMG_1.JPG"))
+
+    def test_find_on_disk(self):
+        open(self.path("IMG_1-original.JPG"), "a").close()
+        downloads = LocalDownloads(self.directory, self.manifest)
+        self.assertEqual(
+            downloads.find(
+                record("1"), "original", self.path("IMG_1.JPG"),
+                self.path("IMG_1-original.JPG")),
+            self.path("IMG_1-original.JPG"))
+        # The file is added to the manifest
+        self.assertEqual(
+            self.manifest.lookup("1", "original")["path"],
+            "IMG_1-original.JPG")
+
+    def test_find_in_flight(self):
+        downloads = LocalDownloads(self.directory, self.manifest)
+        downloads.in_flight.add(self.path("IMG_1.JPG"))
+        self.assertEqual(
+            downloads.find(record("1"), "original", self.path("IMG_1.JPG")),
+            self.path("IMG_1.JPG"))
+
+    def test_rebuild_manifest_ignores_manifest(self):
+        self.manifest.add("1", "original", "IMG_1.JPG")
+        downloads = LocalDownloads(
+            self.directory, self.manifest, rebuild_manifest=True)
+        self.assertIsNone(
+            downloads.find(record("1"), "original", self.path("IMG_1.JPG")))
+
+    def test_file_index(self):
+        index = LocalFileIndex(self.directory)
+        index.scan()
+        downloads = LocalDownloads(self.directory, file_index=index)
+        downloads.makedirs(self.path("2018"))
+        self.assertTrue(os.path.isdir(self.path("2018")))
+        downloads.record(record("1"), "original", self.path("2018", "IMG_1.JPG"))
+        self.assertTrue(downloads.file_exists(self.path("2018", "IMG_1.JPG")))
+
+    def test_paths_without_manifest(self):
+        downloads = LocalDownloads(self.directory)
+        downloads.reserve_path(self.path("IMG_1.JPG"), "1")
+        self.assertIsNone(downloads.path_owner(self.path("IMG_1.JPG")))
+
+        downloads = LocalDownloads(self.directory, self.manifest)
+        downloads.reserve_path(self.path("IMG_1.JPG"), "1")
+        self.assertEqual(downloads.path_owner(self.path("IMG_1.JPG")), "1")
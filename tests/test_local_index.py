@@ -0,0 +1,130 @@
+from unittest import TestCase
+from vcr import VCR
+import os
+import shutil
+import tempfile
+import mock
+import pytest
+from mock import ANY
+from click.testing import CliRunner
+from icloudpd.base import main
+from icloudpd.local_index import LocalFileIndex
+from tests.helpers.print_result_exception import print_result_exception
+
+vcr = VCR(decode_compressed_response=True)
+
+
+class LocalFileIndexTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "2018", "07", "31"))
+        open(os.path.join(self.directory, "2018", "07", "31", "IMG_7409.JPG"), "a").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_scan(self):
+        index = LocalFileIndex(self.directory)
+        self.assertEqual(index.scan(), 1)
+        self.assertTrue(index.isfile(
+            os.path.join(self.directory, "2018/07/31/IMG_7409.JPG")))
+        self.assertTrue(index.isfile(
+            os.path.join(self.directory, "2018/07/31/../31/IMG_7409.JPG")))
+        self.assertFalse(index.isfile(
+            os.path.join(self.directory, "2018/07/31/IMG_7410.JPG")))
+        self.assertFalse(index.isfile(os.path.join(self.directory, "2018/07/31")))
+
+    def test_files_are_not_checked_on_disk(self):
+        index = LocalFileIndex(self.directory)
+        index.scan()
+        path = os.path.join(self.directory, "2018/07/31/IMG_7410.JPG")
+        open(path, "a").close()
+        # Only files that were downloaded in this run are added
+        self.assertFalse(index.isfile(path))
+        index.add(path)
+        self.assertTrue(index.isfile(path))
+
+    def test_makedirs(self):
+        index = LocalFileIndex(self.directory)
+        index.scan()
+        with mock.patch("os.makedirs") as makedirs_patched:
+            index.makedirs(os.path.join(self.directory, "2018/07/31"))
+            makedirs_patched.assert_not_called()
+
+        new_dir = os.path.join(self.directory, "2018/08/01")
+        index.makedirs(new_dir)
+        self.assertTrue(os.path.isdir(new_dir))
+        with mock.patch("os.makedirs") as makedirs_patched:
+            index.makedirs(new_dir)
+            index.makedirs(os.path.join(self.directory, "2018/08"))
+            makedirs_patched.assert_not_called()
+
+    def test_paths_outside_directory(self):
+        index = LocalFileIndex(os.path.join(self.directory, "2018/07"))
+        index.scan()
+        self.assertFalse(index.isfile(
+            os.path.join(self.directory, "2018/07/31/IMG_7410.JPG")))
+        other = tempfile.NamedTemporaryFile()
+        self.assertTrue(index.isfile(other.name))
+        other.close()
+
+
+class PrescanDownloadTestCase(TestCase):
+    @pytest.fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setUp(self):
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos/2018/07/30/")
+        open("tests/fixtures/Photos/2018/07/30/IMG_7408.JPG", "a").close()
+        open("tests/fixtures/Photos/2018/07/30/IMG_7407-original.JPG", "a").close()
+
+    def test_download_photos_with_prescan(self):
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+            with mock.patch("os.path.isfile", wraps=os.path.isfile) as isfile_patched:
+                with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+                    # Pass fixed client ID via environment variable
+                    os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+                    runner = CliRunner()
+                    result = runner.invoke(
+                        main,
+                        [
+                            "--username",
+                            "jdoe@gmail.com",
+                            "--password",
+                            "password1",
+                            "--recent",
+                            "5",
+                            "--skip-videos",
+                            "--skip-live-photos",
+                            "--no-progress-bar",
+                            "--prescan",
+                            "-d",
+                            "tests/fixtures/Photos",
+                        ],
+                    )
+                    print_result_exception(result)
+                # The download directory was not checked for each photo
+                self.assertFalse(any(
+                    "tests/fixtures/Photos" in str(c)
+                    for c in isfile_patched.call_args_list))
+
+            self.assertIn(
+                "DEBUG    Found 2 files in tests/fixtures/Photos",
+                self._caplog.text,
+            )
+            self.assertIn(
+                "INFO     tests/fixtures/Photos/2018/07/30/IMG_7408.JPG already exists.",
+                self._caplog.text,
+            )
+            self.assertIn(
+                "INFO     tests/fixtures/Photos/2018/07/30/IMG_7407-original.JPG already exists.",
+                self._caplog.text,
+            )
+            dp_patched.assert_called_once_with(
+                ANY, ANY, "tests/fixtures/Photos/2018/07/31/IMG_7409.JPG", "original",
+                defer_retries=True, mtime=ANY)
+            assert result.exit_code == 0
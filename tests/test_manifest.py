@@ -0,0 +1,307 @@
+from unittest import TestCase
+from vcr import VCR
+import os
+import shutil
+import sqlite3
+import tempfile
+import mock
+import pytest
+from mock import ANY
+from click.testing import CliRunner
+from icloudpd.base import main
+from icloudpd.manifest import DownloadManifest, remote_checksum
+from icloudpd.retry import DownloadFailed
+from icloudpd.asset_record import AssetRecord, AssetVersion
+from requests.exceptions import ConnectionError
+from tests.helpers.print_result_exception import print_result_exception
+
+vcr = VCR(decode_compressed_response=True)
+
+
+class DownloadManifestTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "manifest.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_add_and_lookup(self):
+        manifest = DownloadManifest(self.path)
+        self.assertIsNone(manifest.lookup("ABC", "original"))
+        self.assertFalse(manifest.is_downloaded("ABC", "original"))
+
+        manifest.add("ABC", "original", "2018/07/31/IMG_7409.JPG", 1884695, "abc=")
+        manifest.close()
+
+        # The manifest is persisted
+        manifest = DownloadManifest(self.path)
+        entry = manifest.lookup("ABC", "original")
+        self.assertEqual(entry["path"], "2018/07/31/IMG_7409.JPG")
+        self.assertEqual(entry["size"], 1884695)
+        self.assertEqual(entry["checksum"], "abc=")
+        self.assertTrue(manifest.is_downloaded("ABC", "original"))
+        self.assertTrue(manifest.is_downloaded("ABC", "original", "abc="))
+        self.assertFalse(manifest.is_downloaded("ABC", "original", "def="))
+        self.assertFalse(manifest.is_downloaded("ABC", "medium"))
+        self.assertEqual(len(manifest), 1)
+
+        manifest.remove("ABC")
+        self.assertEqual(len(manifest), 0)
+        manifest.close()
+
+    def test_path_owner(self):
+        manifest = DownloadManifest(self.path)
+        self.assertIsNone(manifest.path_owner("IMG_1.JPG"))
+        manifest.reserve_path("IMG_1.JPG", "ABC")
+        self.assertEqual(manifest.path_owner("IMG_1.JPG"), "ABC")
+        manifest.add("DEF", "original", "IMG_2.JPG")
+        self.assertEqual(manifest.path_owner("IMG_2.JPG"), "DEF")
+        manifest.close()
+
+    def test_links(self):
+        manifest = DownloadManifest(self.path)
+        manifest.add("ABC", "original", "Favorites/IMG_1.JPG")
+        manifest.reserve_path("Trip/IMG_1.JPG", "ABC")
+        manifest.add_link("ABC", "original", "Trip/IMG_1.JPG")
+        self.assertEqual(manifest.path_owner("Trip/IMG_1.JPG"), "ABC")
+        self.assertEqual(
+            sorted(row["path"] for row in manifest.downloads_for("ABC")),
+            ["Favorites/IMG_1.JPG", "Trip/IMG_1.JPG"])
+        # Links aren't downloads
+        self.assertEqual(len(manifest), 1)
+        self.assertEqual(
+            manifest.lookup("ABC", "original")["path"], "Favorites/IMG_1.JPG")
+
+        manifest.remove("ABC")
+        self.assertIsNone(manifest.path_owner("Trip/IMG_1.JPG"))
+        self.assertEqual(manifest.downloads_for("ABC"), [])
+        manifest.close()
+
+    def test_sha256_and_older_manifests(self):
+        # A manifest from before the sha256 column was added
+        db = sqlite3.connect(self.path)
+        db.execute(
+            "CREATE TABLE downloads (record_id TEXT NOT NULL, "
+            "version TEXT NOT NULL, path TEXT NOT NULL, size INTEGER, "
+            "checksum TEXT, downloaded_at REAL, "
+            "PRIMARY KEY (record_id, version))")
+        db.execute(
+            "INSERT INTO downloads VALUES "
+            "('ABC', 'original', 'IMG_1.JPG', 10, 'abc=', 0)")
+        db.commit()
+        db.close()
+
+        manifest = DownloadManifest(self.path)
+        self.assertIsNone(manifest.lookup("ABC", "original")["sha256"])
+        manifest.add("DEF", "original", "IMG_2.JPG", 10, "def=", "0123abcd")
+        self.assertEqual(
+            manifest.lookup("DEF", "original")["sha256"], "0123abcd")
+        manifest.close()
+
+    def test_failed_assets(self):
+        manifest = DownloadManifest(self.path)
+        manifest.add_failure("ABC", "original", "ASSET-ABC", "Connection Error")
+        manifest.add_failure("ABC", "original", "ASSET-ABC", "Read timed out")
+        manifest.add_failure("DEF", "originalVideo", "ASSET-DEF", "Reset")
+        manifest.close()
+
+        manifest = DownloadManifest(self.path)
+        failures = manifest.failed_assets()
+        self.assertEqual(
+            [(row["record_id"], row["asset_record_id"], row["error"],
+              row["attempts"]) for row in failures],
+            [("ABC", "ASSET-ABC", "Read timed out", 2),
+             ("DEF", "ASSET-DEF", "Reset", 1)])
+
+        # A download of the same version clears the failure
+        manifest.add("ABC", "original", "IMG_1.JPG")
+        manifest.add("DEF", "original", "IMG_2.JPG")
+        self.assertEqual(
+            [row["record_id"] for row in manifest.failed_assets()], ["DEF"])
+        manifest.remove_failure("DEF")
+        self.assertEqual(manifest.failed_assets(), [])
+        manifest.close()
+
+    def test_failures_are_committed(self):
+        manifest = DownloadManifest(self.path)
+        manifest.add_failure("ABC", "original", "ASSET-ABC", "Connection Error")
+        # Another connection sees the failure before the manifest is closed
+        db = sqlite3.connect(self.path)
+        self.assertEqual(
+            db.execute("SELECT record_id FROM failed_assets").fetchall(),
+            [("ABC",)])
+        db.close()
+        manifest.close()
+
+    def test_remote_checksum(self):
+        photo = AssetRecord(None, "ABC", "IMG_1.JPG", None, "image", {
+            "original": AssetVersion("IMG_1.JPG", 10, "https://", "Abc=")})
+        self.assertEqual(remote_checksum(photo, "original"), "Abc=")
+        self.assertIsNone(remote_checksum(photo, "medium"))
+
+
+class ManifestDownloadTestCase(TestCase):
+    @pytest.fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def run_main(self, args):
+        with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+            # Pass fixed client ID via environment variable
+            os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+            runner = CliRunner()
+            result = runner.invoke(
+                main,
+                [
+                    "--username",
+                    "jdoe@gmail.com",
+                    "--password",
+                    "password1",
+                    "--recent",
+                    "3",
+                    "--skip-videos",
+                    "--skip-live-photos",
+                    "--no-progress-bar",
+                    "-d",
+                    "tests/fixtures/Photos",
+                    "--manifest",
+                    self.manifest_path,
+                ] + args,
+            )
+            print_result_exception(result)
+            return result
+
+    def setUp(self):
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+        # The manifest isn't kept in the fixtures
+        manifest_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, manifest_directory)
+        self.manifest_path = os.path.join(manifest_directory, "manifest.db")
+
+    def test_manifest_skips_downloaded_assets(self):
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+            result = self.run_main([])
+            assert result.exit_code == 0
+            self.assertEqual(dp_patched.call_count, 3)
+
+        manifest = DownloadManifest(self.manifest_path)
+        self.assertEqual(len(manifest), 3)
+        manifest.close()
+
+        # The files were never written, so only the manifest knows about them
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+            result = self.run_main([])
+            assert result.exit_code == 0
+            dp_patched.assert_not_called()
+        self.assertIn(
+            "INFO     tests/fixtures/Photos/2018/07/31/IMG_7409.JPG already exists.",
+            self._caplog.text,
+        )
+
+    def test_same_filename_on_same_day(self):
+        manifest = DownloadManifest(self.manifest_path)
+        manifest.add(
+            "ANOTHER-RECORD", "original", "2018/07/31/IMG_7409.JPG")
+        manifest.close()
+
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+            result = self.run_main([])
+            assert result.exit_code == 0
+            dp_patched.assert_any_call(
+                ANY, ANY,
+                "tests/fixtures/Photos/2018/07/31/IMG_7409-AY6cBsE.JPG",
+                "original", defer_retries=True, mtime=ANY)
+
+    def test_rebuild_manifest(self):
+        os.makedirs("tests/fixtures/Photos/2018/07/30/")
+        open("tests/fixtures/Photos/2018/07/30/IMG_7408.JPG", "a").close()
+        open("tests/fixtures/Photos/2018/07/30/IMG_7407-original.JPG", "a").close()
+
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            result = self.run_main(["--rebuild-manifest"])
+            assert result.exit_code == 0
+            dp_patched.assert_not_called()
+
+        self.assertIn(
+            "INFO     Rebuilt the manifest with 2 downloaded files.",
+            self._caplog.text,
+        )
+        manifest = DownloadManifest(self.manifest_path)
+        paths = sorted(row["path"] for row in manifest._db.execute(
+            "SELECT path FROM downloads"))
+        # Paths are relative to the download directory
+        self.assertEqual(paths, [
+            "2018/07/30/IMG_7407-original.JPG",
+            "2018/07/30/IMG_7408.JPG",
+        ])
+        manifest.close()
+
+    def test_rebuild_manifest_requires_manifest(self):
+        runner = CliRunner()
+        with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+            os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+            result = runner.invoke(
+                main,
+                [
+                    "--username",
+                    "jdoe@gmail.com",
+                    "--password",
+                    "password1",
+                    "--rebuild-manifest",
+                    "-d",
+                    "tests/fixtures/Photos",
+                ],
+            )
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("--rebuild-manifest requires --manifest", result.output)
+
+    def test_failed_download_is_retried_first(self):
+        failed_path = "tests/fixtures/Photos/2018/07/30/IMG_7407.JPG"
+
+        def download_media(icloud, photo, download_path, size, **kwargs):
+            if download_path == failed_path:
+                return DownloadFailed(ConnectionError("Connection Error"))
+            return True
+
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.side_effect = download_media
+            result = self.run_main([])
+            assert result.exit_code == 0
+            failed_photo = dp_patched.call_args_list[2][0][1]
+
+        manifest = DownloadManifest(self.manifest_path)
+        failures = manifest.failed_assets()
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0]["record_id"], failed_photo.id)
+        self.assertEqual(failures[0]["version"], "original")
+        self.assertEqual(
+            failures[0]["asset_record_id"],
+            failed_photo.asset_record_id)
+        self.assertEqual(failures[0]["error"], "Connection Error")
+        manifest.close()
+
+        # The next run only lists the most recent photo, but looks up
+        # the failed photo and downloads it first
+        with mock.patch("icloudpd.failed_assets.lookup_photos") as lookup_patched:
+            lookup_patched.return_value = ([failed_photo], set())
+            with mock.patch("icloudpd.download.download_media") as dp_patched:
+                dp_patched.return_value = True
+                result = self.run_main(["--recent", "1"])
+                assert result.exit_code == 0
+                dp_patched.assert_called_once_with(
+                    ANY, failed_photo, failed_path, "original",
+                    defer_retries=True, mtime=ANY)
+
+        self.assertIn(
+            "INFO     Retrying 1 downloads that failed in earlier runs...",
+            self._caplog.text,
+        )
+        manifest = DownloadManifest(self.manifest_path)
+        self.assertEqual(manifest.failed_assets(), [])
+        manifest.close()
@@ -0,0 +1,128 @@
+from unittest import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+import mock
+import pytz
+from click.testing import CliRunner
+from icloudpd.asset_record import AssetRecord, AssetVersion
+from icloudpd.base import main
+from icloudpd.manifest import DownloadManifest
+from icloudpd.paths import album_folder
+from tests.helpers.print_result_exception import print_result_exception
+
+
+def record(record_id):
+    filename = "IMG_%s.JPG" % record_id
+    return AssetRecord(
+        None, record_id, filename,
+        datetime.datetime(2018, 7, 31, 12, tzinfo=pytz.utc), "image",
+        {"original": AssetVersion(filename, 3, "https://", None)})
+
+
+class FakeAlbum(object):
+    def __init__(self, records):
+        self.records = records
+        self.exception_handler = None
+        self.page_size = None
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+
+def write_file(icloud, photo, download_path, size, **kwargs):
+    with open(download_path, "wb") as file_obj:
+        file_obj.write(b"JPG")
+    return True
+
+
+class AlbumFolderTestCase(TestCase):
+    def test_album_folder(self):
+        self.assertEqual(album_folder("Trip"), "Trip")
+        self.assertEqual(album_folder("Trip/2018"), "Trip_2018")
+        self.assertEqual(album_folder("Trip\\2018"), "Trip_2018")
+        self.assertEqual(album_folder(".."), "__")
+
+
+class MultipleAlbumsTestCase(TestCase):
+    def setUp(self):
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+        # The manifest isn't kept in the fixtures
+        manifest_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, manifest_directory)
+        self.manifest_path = os.path.join(manifest_directory, "manifest.db")
+        icloud = mock.MagicMock()
+        icloud.photos.albums = {
+            "Favorites": FakeAlbum([record("1"), record("2")]),
+            "Trip/2018": FakeAlbum([record("2"), record("3")]),
+        }
+        self.icloud = icloud
+
+    def run_main(self):
+        with mock.patch("icloudpd.base.authenticate") as auth_patched, \
+                mock.patch("icloudpd.download.download_media") as dp_patched:
+            auth_patched.return_value = self.icloud
+            dp_patched.side_effect = write_file
+            runner = CliRunner()
+            result = runner.invoke(
+                main,
+                [
+                    "--username",
+                    "jdoe@gmail.com",
+                    "--password",
+                    "password1",
+                    "--album",
+                    "Favorites",
+                    "--album",
+                    "Trip/2018",
+                    "--skip-live-photos",
+                    "--no-progress-bar",
+                    "-d",
+                    "tests/fixtures/Photos",
+                    "--manifest",
+                    self.manifest_path,
+                ],
+            )
+            print_result_exception(result)
+            self.assertEqual(result.exit_code, 0)
+            return sorted(call[0][2] for call in dp_patched.call_args_list)
+
+    def test_photo_in_both_albums_is_downloaded_once(self):
+        self.assertEqual(self.run_main(), [
+            "tests/fixtures/Photos/Favorites/2018/07/31/IMG_1.JPG",
+            "tests/fixtures/Photos/Favorites/2018/07/31/IMG_2.JPG",
+            "tests/fixtures/Photos/Trip_2018/2018/07/31/IMG_3.JPG",
+        ])
+        source = "tests/fixtures/Photos/Favorites/2018/07/31/IMG_2.JPG"
+        link = "tests/fixtures/Photos/Trip_2018/2018/07/31/IMG_2.JPG"
+        self.assertTrue(os.path.samefile(source, link))
+
+        manifest = DownloadManifest(self.manifest_path)
+        self.assertEqual(
+            sorted(row["path"] for row in manifest.downloads_for("2")),
+            ["Favorites/2018/07/31/IMG_2.JPG", "Trip_2018/2018/07/31/IMG_2.JPG"])
+        self.assertEqual(
+            manifest.path_owner("Trip_2018/2018/07/31/IMG_2.JPG"), "2")
+        manifest.close()
+
+        # Nothing is downloaded or linked again
+        self.assertEqual(self.run_main(), [])
+
+    def test_missing_link_is_made_again(self):
+        self.run_main()
+        os.remove("tests/fixtures/Photos/Trip_2018/2018/07/31/IMG_2.JPG")
+        manifest = DownloadManifest(self.manifest_path)
+        manifest.remove("2")
+        manifest.add("2", "original", "Favorites/2018/07/31/IMG_2.JPG")
+        manifest.close()
+
+        self.assertEqual(self.run_main(), [])
+        self.assertTrue(os.path.samefile(
+            "tests/fixtures/Photos/Favorites/2018/07/31/IMG_2.JPG",
+            "tests/fixtures/Photos/Trip_2018/2018/07/31/IMG_2.JPG"))
@@ -0,0 +1,79 @@
+from unittest import TestCase
+import calendar
+import datetime
+import mock
+import pytz
+from icloudpd.asset_record import AssetRecord, AssetVersion
+from icloudpd.planner import PathPlanner, formats_by_day, plan_pages
+
+BERLIN = pytz.timezone("Europe/Berlin")
+
+
+def record(record_id, created, versions=("original",)):
+    return AssetRecord(
+        None, record_id, "IMG_%s.JPG" % record_id, created, "image",
+        {version: AssetVersion("IMG_%s.JPG" % record_id, 10, "https://", None)
+         for version in versions})
+
+
+class PathPlannerTestCase(TestCase):
+    def test_formats_by_day(self):
+        self.assertTrue(formats_by_day("{:%Y/%m/%d}"))
+        self.assertTrue(formats_by_day("{:%Y/%B}"))
+        self.assertFalse(formats_by_day("{:%Y/%m/%d/%H}"))
+
+    def test_plan(self):
+        planner = PathPlanner("/photos", "{:%Y/%m/%d}", "original", timezone=BERLIN)
+        # 23:30 UTC is already the next day in Berlin
+        created = datetime.datetime(2018, 7, 30, 23, 30, tzinfo=pytz.utc)
+        plan = planner.plan(record("1", created))
+        self.assertEqual(plan.size, "original")
+        self.assertEqual(plan.download_dir, "/photos/2018/07/31")
+        self.assertEqual(plan.download_path, "/photos/2018/07/31/IMG_1.JPG")
+        self.assertEqual(plan.created_date, created.astimezone(BERLIN))
+        self.assertEqual(plan.mtime, calendar.timegm(created.utctimetuple()))
+
+    def test_download_size(self):
+        created = datetime.datetime(2018, 7, 31, tzinfo=pytz.utc)
+        photo = record("1", created)
+        planner = PathPlanner("/photos", "{:%Y/%m/%d}", "medium", timezone=BERLIN)
+        plan = planner.plan(photo)
+        self.assertEqual(plan.size, "original")
+        self.assertEqual(plan.download_path, "/photos/2018/07/31/IMG_1.JPG")
+
+        planner = PathPlanner(
+            "/photos", "{:%Y/%m/%d}", "medium", force_size=True, timezone=BERLIN)
+        self.assertIsNone(planner.plan(photo).size)
+        plan = planner.plan(record("2", created, ("original", "medium")))
+        self.assertEqual(plan.download_path, "/photos/2018/07/31/IMG_2-medium.JPG")
+
+    def test_folders_are_formatted_once_per_day(self):
+        folder_structure = mock.MagicMock(wraps="{:%Y/%m/%d}")
+        planner = PathPlanner("/photos", "{:%Y/%m/%d}", "original", timezone=BERLIN)
+        planner.folder_structure = folder_structure
+        page = [
+            record(str(hour), datetime.datetime(2018, 7, 30, hour, tzinfo=pytz.utc))
+            for hour in range(0, 24, 4)]
+        plans = planner.plan_page(page)
+        self.assertEqual(
+            [plan.download_dir for plan in plans],
+            ["/photos/2018/07/30"] * 6)
+        self.assertEqual(folder_structure.format.call_count, 1)
+
+    def test_invalid_created_date(self):
+        class NewDateTime(datetime.datetime):
+            def astimezone(self, tz=None):
+                raise ValueError('Invalid date')
+
+        planner = PathPlanner("/photos", "{:%Y/%m/%d}", "original", timezone=BERLIN)
+        plan = planner.plan(record("1", NewDateTime(2018, 1, 1)))
+        self.assertEqual(plan.download_dir, "/photos/2018/01/01")
+        self.assertIsNone(plan.mtime)
+
+    def test_plan_pages(self):
+        planner = mock.MagicMock()
+        planner.plan_page.side_effect = lambda page: list(page)
+        self.assertEqual(list(plan_pages(planner, range(5), 2)), list(range(5)))
+        self.assertEqual(
+            [call[0][0] for call in planner.plan_page.call_args_list],
+            [[0, 1], [2, 3], [4]])
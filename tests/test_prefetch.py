@@ -0,0 +1,47 @@
+from unittest import TestCase
+import threading
+import time
+from icloudpd.prefetch import PrefetchIterator
+
+
+class PrefetchIteratorTestCase(TestCase):
+    def test_items_are_returned_in_order(self):
+        self.assertEqual(list(PrefetchIterator(range(100), 10)), list(range(100)))
+
+    def test_items_are_fetched_in_another_thread(self):
+        threads = []
+
+        def producer():
+            for i in range(3):
+                threads.append(threading.current_thread().name)
+                yield i
+
+        self.assertEqual(list(PrefetchIterator(producer(), 2)), [0, 1, 2])
+        self.assertEqual(set(threads), set(["icloudpd-prefetch"]))
+
+    def test_prefetch_is_bounded(self):
+        produced = []
+
+        def producer():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        prefetcher = PrefetchIterator(producer(), 5)
+        self.assertEqual(next(prefetcher), 0)
+        time.sleep(0.2)
+        # 5 items in the queue, and one waiting to be put on it
+        self.assertTrue(len(produced) <= 7)
+        prefetcher.close()
+
+    def test_exceptions_are_raised_in_consumer(self):
+        def producer():
+            yield 1
+            raise ValueError("Invalid global session")
+
+        prefetcher = PrefetchIterator(producer(), 5)
+        self.assertEqual(next(prefetcher), 1)
+        with self.assertRaises(ValueError):
+            next(prefetcher)
+        with self.assertRaises(StopIteration):
+            next(prefetcher)
@@ -0,0 +1,63 @@
+from unittest import TestCase
+import mock
+from requests.exceptions import ConnectionError
+from pyicloud_ipd.exceptions import PyiCloudAPIResponseError
+from icloudpd.retry import (
+    RetryPolicy, RetryQueue, policy_for,
+    SESSION_POLICY, THROTTLE_POLICY, CONNECTION_POLICY)
+
+
+class RetryPolicyTestCase(TestCase):
+    def test_exponential_backoff(self):
+        policy = RetryPolicy(factor=2, max_seconds=30, jitter=0)
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 5):
+            self.assertEqual(
+                [policy.delay(n) for n in range(5)], [5, 10, 20, 30, 30])
+
+    def test_jitter(self):
+        policy = RetryPolicy(factor=2, jitter=0.5)
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 5):
+            with mock.patch("random.random", return_value=1.0):
+                self.assertEqual(policy.delay(1), 5)
+            with mock.patch("random.random", return_value=0.0):
+                self.assertEqual(policy.delay(1), 10)
+
+    def test_session_errors_retry_immediately(self):
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 5):
+            self.assertEqual(SESSION_POLICY.delay(0), 0)
+            self.assertGreater(SESSION_POLICY.delay(1), 0)
+
+    def test_no_delay_without_wait_seconds(self):
+        with mock.patch("icloudpd.constants.WAIT_SECONDS", 0):
+            self.assertEqual(THROTTLE_POLICY.delay(3), 0)
+
+    def test_policy_for_error(self):
+        self.assertIs(
+            policy_for(PyiCloudAPIResponseError("Invalid global session", 100)),
+            SESSION_POLICY)
+        self.assertIs(
+            policy_for(PyiCloudAPIResponseError("Too Many Requests", 429)),
+            THROTTLE_POLICY)
+        self.assertIs(
+            policy_for(PyiCloudAPIResponseError("Service Unavailable", 503)),
+            THROTTLE_POLICY)
+        self.assertIs(
+            policy_for(ConnectionError("Connection Error")),
+            CONNECTION_POLICY)
+
+
+class RetryQueueTestCase(TestCase):
+    def test_pop_due_in_order(self):
+        queue = RetryQueue()
+        with mock.patch("time.time", return_value=100):
+            queue.defer(10, "later")
+            queue.defer(0, "now", 1, retries=2)
+            queue.defer(5, "soon")
+            self.assertEqual(len(queue), 3)
+            self.assertEqual(queue.pop_due(), [("now", (1,), {"retries": 2})])
+            self.assertEqual(queue.next_delay(), 5)
+        with mock.patch("time.time", return_value=110):
+            self.assertEqual(
+                [func for func, _, _ in queue.pop_due()], ["soon", "later"])
+        self.assertEqual(len(queue), 0)
+        self.assertIsNone(queue.next_delay())
@@ -0,0 +1,165 @@
+from unittest import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import mock
+from requests.exceptions import ChunkedEncodingError
+from urllib3.exceptions import ProtocolError
+from icloudpd.stream_writer import (
+    StreamDigest, file_sha256, preallocate, write_stream, _bind_fallocate)
+
+
+class RecordingRaw(io.BytesIO):
+    """BytesIO that records the size of every readinto() call"""
+
+    def __init__(self, data):
+        io.BytesIO.__init__(self, data)
+        self.read_sizes = []
+
+    def readinto(self, b):
+        self.read_sizes.append(len(b))
+        return io.BytesIO.readinto(self, b)
+
+
+class MockResponse(object):
+    def __init__(self, raw=None, chunks=None, headers=None, error=None):
+        self.raw = raw
+        self.chunks = chunks or []
+        self.headers = headers or {}
+        self.error = error
+
+    def iter_content(self, chunk_size=1):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+
+class StreamWriterTestCase(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_adaptive_read_sizes(self):
+        data = os.urandom(100 * 1024)
+        raw = RecordingRaw(data)
+        with mock.patch("icloudpd.constants.DOWNLOAD_MIN_READ_SIZE", 1024):
+            with mock.patch("icloudpd.constants.DOWNLOAD_MAX_READ_SIZE", 16384):
+                with open(self.path, "wb") as file_obj:
+                    written = write_stream(
+                        MockResponse(raw=raw), file_obj, len(data))
+
+        self.assertEqual(written, len(data))
+        with open(self.path, "rb") as file_obj:
+            self.assertEqual(file_obj.read(), data)
+        self.assertEqual(raw.read_sizes[:6], [1024, 2048, 4096, 8192, 16384, 16384])
+
+    def test_encoded_response_uses_iter_content(self):
+        raw = RecordingRaw(b"compressed")
+        response = MockResponse(
+            raw=raw, chunks=[b"decoded ", b"content"],
+            headers={"Content-Encoding": "gzip"})
+        with open(self.path, "wb") as file_obj:
+            write_stream(response, file_obj)
+
+        self.assertEqual(raw.read_sizes, [])
+        with open(self.path, "rb") as file_obj:
+            self.assertEqual(file_obj.read(), b"decoded content")
+
+    def test_preallocated_space_is_truncated_on_error(self):
+        response = MockResponse(chunks=[b"01234"], error=IOError("Reset"))
+        with open(self.path, "wb") as file_obj:
+            with self.assertRaises(IOError):
+                write_stream(response, file_obj, 1000)
+
+        self.assertEqual(os.path.getsize(self.path), 5)
+
+    def test_preallocate_keeps_the_file_size(self):
+        # A download that is killed (so the finally block never runs)
+        # must still be resumable from the file size
+        with open(self.path, "wb") as file_obj:
+            file_obj.write(b"01234")
+            preallocate(file_obj, 8 * 1024 * 1024)
+            file_obj.flush()
+            self.assertEqual(os.path.getsize(self.path), 5)
+
+    def test_fallocate64_is_preferred(self):
+        libc = mock.MagicMock()
+        with mock.patch("ctypes.CDLL", return_value=libc):
+            self.assertIs(_bind_fallocate(), libc.fallocate64)
+        del libc.fallocate64
+        with mock.patch("ctypes.CDLL", return_value=libc):
+            self.assertIs(_bind_fallocate(), libc.fallocate)
+        del libc.fallocate
+        with mock.patch("ctypes.CDLL", return_value=libc):
+            self.assertIsNone(_bind_fallocate())
+
+    def test_raw_errors_are_raised_as_requests_errors(self):
+        class DisconnectingRaw(io.BytesIO):
+            def readinto(self, b):
+                length = io.BytesIO.readinto(self, b)
+                if not length:
+                    raise ProtocolError("Connection broken: IncompleteRead")
+                return length
+
+        response = MockResponse(raw=DisconnectingRaw(b"01234"))
+        with open(self.path, "wb") as file_obj:
+            with self.assertRaises(ChunkedEncodingError):
+                write_stream(response, file_obj, 10)
+
+        self.assertEqual(os.path.getsize(self.path), 5)
+
+    def test_digest(self):
+        data = os.urandom(100 * 1024)
+        for response in [MockResponse(raw=RecordingRaw(data)),
+                         MockResponse(chunks=[data[:10], data[10:]])]:
+            digest = StreamDigest()
+            with open(self.path, "wb") as file_obj:
+                write_stream(response, file_obj, len(data), digest=digest)
+            self.assertEqual(digest.received, len(data))
+            self.assertEqual(
+                digest.hexdigest(), hashlib.sha256(data).hexdigest())
+            self.assertEqual(file_sha256(self.path), digest.hexdigest())
+
+    def test_digest_of_transformed_bytes(self):
+        transform = mock.MagicMock()
+        transform.feed.side_effect = lambda data: bytes(data).upper()
+        transform.finish.return_value = b"!"
+        digest = StreamDigest()
+        with open(self.path, "wb") as file_obj:
+            write_stream(
+                MockResponse(chunks=[b"abc", b"def"]), file_obj,
+                transform=transform, digest=digest)
+
+        self.assertEqual(digest.received, 6)
+        self.assertEqual(
+            digest.hexdigest(), hashlib.sha256(b"ABCDEF!").hexdigest())
+
+    def test_digest_of_resumed_file(self):
+        with open(self.path, "wb") as file_obj:
+            file_obj.write(b"0123")
+        digest = StreamDigest()
+        with open(self.path, "r+b") as file_obj:
+            digest.add_file(file_obj, 4)
+            write_stream(
+                MockResponse(chunks=[b"456789"]), file_obj, digest=digest)
+
+        self.assertEqual(digest.received, 10)
+        self.assertEqual(
+            digest.hexdigest(), hashlib.sha256(b"0123456789").hexdigest())
+
+    def test_bandwidth(self):
+        bandwidth = mock.MagicMock()
+        with open(self.path, "wb") as file_obj:
+            write_stream(
+                MockResponse(chunks=[b"abc", b"defg"]), file_obj,
+                bandwidth=bandwidth)
+
+        self.assertEqual(
+            bandwidth.consume.call_args_list, [mock.call(3), mock.call(4)])
+        with open(self.path, "rb") as file_obj:
+            self.assertEqual(file_obj.read(), b"abcdefg")
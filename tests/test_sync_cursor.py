@@ -0,0 +1,212 @@
+from unittest import TestCase
+from vcr import VCR
+import datetime
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import mock
+import pytest
+import pytz
+from click.testing import CliRunner
+from icloudpd.base import main
+from icloudpd.manifest import DownloadManifest
+from icloudpd.sync_cursor import SyncCursor, supports_cursor, added_timestamp
+from tests.helpers.print_result_exception import print_result_exception
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "benchmarks")
+sys.path.insert(0, BENCHMARKS)
+from fake_icloud import FakeICloud  # noqa: E402
+
+vcr = VCR(decode_compressed_response=True)
+
+
+class MockPhoto(object):
+    def __init__(self, name, day):
+        self.name = name
+        self.added_date = datetime.datetime(2018, 7, day, 12, 0, 0, tzinfo=pytz.utc)
+
+
+class MockAlbum(object):
+    """Lists the photos from rank 0 (the newest) like "All Photos" does"""
+    list_type = "CPLAssetAndMasterByAddedDate"
+
+    def __init__(self, photos):
+        self.direction = "ASCENDING"
+        self.photos = sorted(photos, key=added_timestamp, reverse=True)
+        self.iterated = []
+
+    def __iter__(self):
+        photos = self.photos
+        if self.direction == "DESCENDING":
+            photos = reversed(photos)
+        for photo in photos:
+            self.iterated.append(photo.name)
+            yield photo
+
+
+class SyncCursorTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = DownloadManifest(os.path.join(self.directory, "manifest.db"))
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.directory)
+
+    def test_added_timestamp(self):
+        self.assertEqual(added_timestamp(MockPhoto("a", 1)), 1530446400.0)
+
+    def test_supports_cursor(self):
+        self.assertTrue(supports_cursor(MockAlbum([])))
+        album = MockAlbum([])
+        album.list_type = "CPLContainerRelationLiveByAssetDate"
+        self.assertFalse(supports_cursor(album))
+
+    def test_stops_at_photos_from_last_run(self):
+        cursor = SyncCursor(self.manifest, "All Photos")
+        album = MockAlbum([MockPhoto("b", 20), MockPhoto("a", 10)])
+        self.assertEqual([p.name for p in cursor.photos_since(album)], ["b", "a"])
+        self.assertEqual(album.direction, "ASCENDING")
+        cursor.save()
+
+        cursor = SyncCursor(self.manifest, "All Photos")
+        album = MockAlbum([
+            MockPhoto("d", 25), MockPhoto("c", 22), MockPhoto("b", 20),
+            MockPhoto("a", 10), MockPhoto("older", 1)])
+        self.assertEqual(
+            [p.name for p in cursor.photos_since(album)], ["d", "c", "b"])
+        # The listing stops after the first photo that is older than the cursor
+        self.assertEqual(album.iterated, ["d", "c", "b", "a"])
+        cursor.save()
+        self.assertEqual(
+            float(self.manifest.get_state("cursor:All Photos")),
+            added_timestamp(MockPhoto("d", 25)))
+
+    def test_cursor_per_album(self):
+        cursor = SyncCursor(self.manifest, "All Photos")
+        list(cursor.photos_since(MockAlbum([MockPhoto("a", 10)])))
+        cursor.save()
+        self.assertIsNone(SyncCursor(self.manifest, "Favorites").previous)
+
+
+class IncrementalDownloadTestCase(TestCase):
+    @pytest.fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def run_main(self, args, print_exception=True):
+        with vcr.use_cassette("tests/vcr_cassettes/listing_photos.yml"):
+            # Pass fixed client ID via environment variable
+            os.environ["CLIENT_ID"] = "DE309E26-942E-11E8-92F5-14109FE0B321"
+            runner = CliRunner()
+            result = runner.invoke(
+                main,
+                [
+                    "--username",
+                    "jdoe@gmail.com",
+                    "--password",
+                    "password1",
+                    "--skip-videos",
+                    "--skip-live-photos",
+                    "--no-progress-bar",
+                    "-d",
+                    "tests/fixtures/Photos",
+                ] + args,
+            )
+            if print_exception:
+                print_result_exception(result)
+            return result
+
+    def setUp(self):
+        if os.path.exists("tests/fixtures/Photos"):
+            shutil.rmtree("tests/fixtures/Photos")
+        os.makedirs("tests/fixtures/Photos")
+        # The manifest isn't kept in the fixtures
+        manifest_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, manifest_directory)
+        self.manifest_path = os.path.join(manifest_directory, "manifest.db")
+
+    def test_incremental_requires_manifest(self):
+        result = self.run_main(["--incremental"], print_exception=False)
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("--incremental requires --manifest", result.output)
+
+    def test_incremental_saves_cursor(self):
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = True
+            result = self.run_main([
+                "--recent", "3",
+                "--manifest", self.manifest_path,
+                "--incremental"])
+            assert result.exit_code == 0
+            self.assertEqual(dp_patched.call_count, 3)
+
+        self.assertIn(
+            "INFO     Downloading 3 original photos to tests/fixtures/Photos/ ...",
+            self._caplog.text,
+        )
+        manifest = DownloadManifest(self.manifest_path)
+        self.assertIsNotNone(manifest.get_state("cursor:All Photos"))
+        manifest.close()
+
+    def test_failed_downloads_keep_cursor(self):
+        with mock.patch("icloudpd.download.download_media") as dp_patched:
+            dp_patched.return_value = False
+            result = self.run_main([
+                "--recent", "1",
+                "--manifest", self.manifest_path,
+                "--incremental"])
+            assert result.exit_code == 0
+
+        self.assertIn(
+            "INFO     1 downloads failed, not updating the sync cursor.",
+            self._caplog.text,
+        )
+        manifest = DownloadManifest(self.manifest_path)
+        self.assertIsNone(manifest.get_state("cursor:All Photos"))
+        manifest.close()
+
+
+class FakeServerIncrementalTestCase(TestCase):
+    def setUp(self):
+        self.server = FakeICloud(assets=5, file_size=1024).start()
+        self.addCleanup(self.server.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cookie_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cookie_directory)
+        self.manifest_path = os.path.join(self.cookie_directory, "manifest.db")
+
+    def run_icloudpd(self):
+        command = [
+            sys.executable, os.path.join(BENCHMARKS, "run_icloudpd.py"),
+            self.server.url,
+            "--username", "jdoe@gmail.com",
+            "--password", "password1",
+            "--cookie-directory", self.cookie_directory,
+            "--directory", self.directory,
+            "--no-progress-bar",
+            "--manifest", self.manifest_path,
+            "--incremental",
+        ]
+        env = dict(os.environ, CLIENT_ID="DE309E26-942E-11E8-92F5-14109FE0B321")
+        self.assertEqual(subprocess.call(command, env=env), 0)
+        return sorted(
+            filename for _, _, filenames in os.walk(self.directory)
+            for filename in filenames)
+
+    def test_photos_added_between_runs_are_downloaded(self):
+        self.assertEqual(self.run_icloudpd(), [
+            "IMG_000000.JPG", "IMG_000001.JPG", "IMG_000002.JPG",
+            "IMG_000003.JPG", "IMG_000004.JPG"])
+        downloads = self.server.request_counts["download"]
+
+        # Two photos are added to the library
+        self.server.assets = 7
+        self.assertEqual(self.run_icloudpd(), [
+            "IMG_000000.JPG", "IMG_000001.JPG", "IMG_000002.JPG",
+            "IMG_000003.JPG", "IMG_000004.JPG", "IMG_000005.JPG",
+            "IMG_000006.JPG"])
+        self.assertEqual(self.server.request_counts["download"], downloads + 2)
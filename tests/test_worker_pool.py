@@ -0,0 +1,46 @@
+from unittest import TestCase
+import threading
+import time
+from icloudpd.worker_pool import WorkerPool
+
+
+class WorkerPoolTestCase(TestCase):
+    def test_single_thread_runs_inline(self):
+        pool = WorkerPool(1)
+        calls = []
+        pool.submit(lambda x: calls.append((x, threading.current_thread())), 1)
+        # The task has already finished before join() is called
+        self.assertEqual(calls, [(1, threading.current_thread())])
+        pool.join()
+
+    def test_multiple_threads(self):
+        pool = WorkerPool(4)
+        results = []
+        lock = threading.Lock()
+        thread_names = set()
+
+        def task(value):
+            time.sleep(0.01)
+            with lock:
+                results.append(value)
+                thread_names.add(threading.current_thread().name)
+
+        for i in range(20):
+            pool.submit(task, i)
+        pool.join()
+
+        # Tasks can finish out of order, but all of them have run
+        self.assertEqual(sorted(results), list(range(20)))
+        self.assertTrue(len(thread_names) > 1)
+        for name in thread_names:
+            self.assertTrue(name.startswith("icloudpd-worker-"))
+
+    def test_worker_error_is_raised_on_join(self):
+        pool = WorkerPool(2)
+
+        def failing_task():
+            raise IOError("Disk full")
+
+        pool.submit(failing_task)
+        with self.assertRaises(IOError):
+            pool.join()